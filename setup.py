@@ -85,11 +85,12 @@ setup(
         "dev": ["check-manifest"],
         "test": ["coverage", "pytest", "pytest-cov", "python-coveralls", "hypothesis"],
         "docs": ["sphinx >= 1.4", "sphinx_rtd_theme", "pyastronomy"],
+        "fast": ["numexpr", "numba"],
     },
     # If there are data files included in your packages that need to be
     # installed, specify them here.  If using Python 2.6 or less, then these
     # have to be included in MANIFEST.in as well.
-    package_data={"spectrum_overload": ["data/*.fits"]},
+    package_data={"spectrum_overload": ["data/*.fits", "data/*.ipac"]},
     #    'sample': ['package_data.dat'],
     # },
     include_package_data=True,
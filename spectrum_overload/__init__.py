@@ -1,3 +1,5 @@
 
 from spectrum_overload.spectrum import Spectrum, SpectrumError
-from spectrum_overload.differential import DifferentialSpectrum
+from spectrum_overload.differential import DifferentialSeries, DifferentialSpectrum
+from spectrum_overload.frozen import FrozenSpectrum
+from spectrum_overload.lazy import LazySpectrum
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+"""Barycentric correction of spectra from their headers.
+
+The barycentric velocity corrections are computed with astropy for all
+epochs in a single vectorized call and cached by (time, site, target), so
+repeated reductions of the same observations reuse them.
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import astropy.units as u
+import numpy as np
+from astropy.coordinates import EarthLocation, SkyCoord
+from astropy.time import Time
+from numpy import ndarray
+
+from spectrum_overload.kernels import c_kms
+from spectrum_overload.spectrum import Spectrum, SpectrumError
+
+# Header keys of the observation time, target and observatory site.
+TIME_KEY = "MJD-OBS"
+EXPTIME_KEY = "EXPTIME"
+RA_KEY = "RA"
+DEC_KEY = "DEC"
+SITE_KEYS = ("ESO TEL GEOLON", "ESO TEL GEOLAT", "ESO TEL GEOELEV")
+CORRECTED_KEY = "BERVCORR"
+
+Site = Tuple[float, float, float]  # Longitude [deg], latitude [deg], elevation [m]
+Target = Tuple[float, float]  # RA [deg], DEC [deg]
+
+_cache = {}  # type: Dict[Tuple[float, Site, Target], float]
+
+
+def observation_time(header: Any) -> float:
+    """Modified Julian date (UTC) of the middle of the exposure."""
+    try:
+        return float(header[TIME_KEY]) + float(header.get(EXPTIME_KEY, 0)) / 2 / 86400
+    except KeyError as e:
+        raise SpectrumError("Header is missing {} for the observation time.".format(e))
+
+
+def observation_info(
+    header: Any, site: Optional[Site] = None
+) -> Tuple[float, Site, Target]:
+    """Get the mid-exposure MJD, site and target coordinates from a header.
+
+    Parameters
+    ----------
+    header: astropy.Header, dict-like
+        Header with the MJD-OBS, RA and DEC (in degrees) of the observation,
+        and the site location if site is not given.
+    site: tuple, None
+        (longitude [deg], latitude [deg], elevation [m]) of the observatory.
+        Default is read from the ESO TEL GEOLON/GEOLAT/GEOELEV keys.
+
+    Returns
+    -------
+    mjd: float
+        Modified Julian date (UTC) of the middle of the exposure.
+    site: tuple
+        (longitude, latitude, elevation) of the observatory.
+    target: tuple
+        (ra, dec) of the target.
+
+    """
+    mjd = observation_time(header)
+    try:
+        target = (float(header[RA_KEY]), float(header[DEC_KEY]))
+        if site is None:
+            site = tuple(float(header[key]) for key in SITE_KEYS)
+    except KeyError as e:
+        raise SpectrumError(
+            "Header is missing {} for the barycentric correction.".format(e)
+        )
+    return mjd, tuple(site), target
+
+
+def barycentric_rv(
+    mjd: Sequence[float], sites: Sequence[Site], targets: Sequence[Target]
+) -> ndarray:
+    """Barycentric velocity corrections of many epochs in km/s.
+
+    Epochs that are not in the cache are computed together in one
+    vectorized astropy call.
+
+    Parameters
+    ----------
+    mjd: list of float
+        Modified Julian dates (UTC) of each epoch.
+    sites: list of tuple
+        (longitude [deg], latitude [deg], elevation [m]) of each epoch.
+    targets: list of tuple
+        (ra [deg], dec [deg]) of each epoch.
+
+    Returns
+    -------
+    rv: ndarray
+        Velocity corrections to add to measured RVs [km/s].
+
+    """
+    keys = [
+        (float(t), tuple(site), tuple(target))
+        for t, site, target in zip(mjd, sites, targets)
+    ]
+    missing = list({key for key in keys if key not in _cache})
+    if missing:
+        times, site_list, target_list = zip(*missing)
+        lon, lat, elev = np.array(site_list).T
+        ra, dec = np.array(target_list).T
+        coords = SkyCoord(ra=ra * u.deg, dec=dec * u.deg, frame="icrs")
+        corrections = coords.radial_velocity_correction(
+            kind="barycentric",
+            obstime=Time(np.array(times), format="mjd", scale="utc"),
+            location=EarthLocation.from_geodetic(lon * u.deg, lat * u.deg, elev * u.m),
+        )
+        for key, rv in zip(missing, corrections.to_value(u.km / u.s)):
+            _cache[key] = float(rv)
+    return np.array([_cache[key] for key in keys])
+
+
+def clear_cache() -> None:
+    """Clear the cache of barycentric corrections."""
+    _cache.clear()
+
+
+def doppler_shift_spectra(spectra: Sequence[Spectrum], rvs: Sequence[float]) -> None:
+    """Doppler shift each spectrum by its RV in km/s, in-place.
+
+    Spectra sharing the same xaxis are shifted together with a single
+    broadcast multiplication.
+    """
+    rvs = np.asarray(rvs, dtype=float)
+    if len(rvs) != len(spectra):
+        raise ValueError("Need one RV for each spectrum.")
+    if any(not spec.calibrated for spec in spectra):
+        raise SpectrumError("Cannot doppler shift uncalibrated spectra.")
+
+    factors = 1.0 + rvs / c_kms
+    groups = []  # type: List[List[int]]
+    for i, spec in enumerate(spectra):
+        for group in groups:
+            first = spectra[group[0]]
+            if len(first) == len(spec) and first.same_xaxis(spec):
+                group.append(i)
+                break
+        else:
+            groups.append([i])
+
+    for group in groups:
+        shifted = spectra[group[0]].xaxis * factors[group, np.newaxis]
+        for i, xaxis in zip(group, shifted):
+            spectra[i].xaxis = xaxis
+
+
+def barycentric_correct(
+    spectra: Sequence[Spectrum], site: Optional[Site] = None
+) -> ndarray:
+    """Barycentric correct spectra in-place using their headers.
+
+    The corrections of all spectra are computed in one vectorized call and
+    applied in one pass. The correction is stored in the header under
+    ``BERVCORR`` to prevent correcting twice.
+
+    Parameters
+    ----------
+    spectra: list of Spectrum
+        Calibrated spectra with observation headers.
+    site: tuple, None
+        (longitude [deg], latitude [deg], elevation [m]) of the observatory.
+        Default is read from each header.
+
+    Returns
+    -------
+    rv: ndarray
+        Applied velocity corrections [km/s].
+
+    Raises
+    ------
+    SpectrumError:
+        A spectrum is already corrected or its header is incomplete.
+
+    """
+    if any(CORRECTED_KEY in spec.header for spec in spectra):
+        raise SpectrumError("Spectrum is already barycentric corrected.")
+    info = [observation_info(spec.header, site=site) for spec in spectra]
+    rvs = barycentric_rv(*zip(*info)) if info else np.array([])
+    doppler_shift_spectra(spectra, rvs)
+    for spec, rv in zip(spectra, rvs):
+        spec.header[CORRECTED_KEY] = rv
+    return rvs
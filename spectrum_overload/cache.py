@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+
+"""Content-addressed on-disk cache of Spectrum transforms.
+
+Results are stored under a key hashed from the content of the input
+spectrum (xaxis, flux, calibration, mask and header), the name of the
+operation, its parameters and the library version. Rerunning an unchanged
+pipeline therefore loads every result from disk instead of recomputing it,
+while any change of input, parameters or version computes and stores a new
+result.
+
+Each result is a directory of ``.npy`` files of the xaxis, flux and mask,
+loaded as read-only memory maps, and a JSON file with the header and
+calibration. The least recently used results are evicted once the cache
+exceeds its size limit.
+
+Examples
+--------
+>>> cache = DiskCache("~/.cache/spectrum_overload", max_bytes=2**30)
+>>> broadened = cache.apply(spectrum, "instrument_broaden", R=50000)
+>>> normalized = cache.apply(broadened, "normalize", method="linear")
+
+"""
+import functools
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Callable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from spectrum_overload.__about__ import __version__
+from spectrum_overload.frozen import FrozenSpectrum, content_hash
+from spectrum_overload.spectrum import (
+    Spectrum,
+    _array_fingerprint,
+    _header_from_json,
+    _header_to_json,
+)
+
+_META = "meta.json"
+
+
+def _token(value: Any) -> Any:
+    """Stable representation of a parameter for the cache key."""
+    if isinstance(value, Spectrum):
+        return ("Spectrum", _spectrum_token(value))
+    elif isinstance(value, np.ndarray):
+        return ("ndarray",) + _array_fingerprint(value)
+    elif isinstance(value, dict):
+        return ("dict",) + tuple(
+            sorted((repr(k), _token(v)) for k, v in value.items())
+        )
+    elif isinstance(value, (list, tuple)):
+        return (type(value).__name__,) + tuple(_token(v) for v in value)
+    elif callable(value):
+        return _callable_token(value)
+    return repr(value)
+
+
+def _spectrum_token(spectrum: Spectrum) -> Tuple[str, str]:
+    """Content and header hashes of a spectrum."""
+    if isinstance(spectrum, FrozenSpectrum):
+        data = spectrum.content_hash
+    else:
+        data = content_hash(spectrum)
+    header = json.dumps(_header_to_json(spectrum.header), sort_keys=True, default=repr)
+    return data, hashlib.sha1(header.encode()).hexdigest()
+
+
+def _callable_token(func: Callable) -> Any:
+    """Stable identity of a function for the cache key.
+
+    Partials are identified by their function and bound arguments, methods
+    by their function and instance, and other functions by their module and
+    qualified name.
+
+    Raises
+    ------
+    ValueError:
+        The function has no stable identity, e.g. a lambda or closure.
+
+    """
+    if isinstance(func, functools.partial):
+        return (
+            "partial",
+            _callable_token(func.func),
+            _token(func.args),
+            _token(func.keywords),
+        )
+    elif inspect.ismethod(func):
+        return ("method", _callable_token(func.__func__), _token(func.__self__))
+    elif isinstance(func, np.ufunc):
+        return ("ufunc", func.__name__)
+    qualname = getattr(func, "__qualname__", None)
+    # Closures and functions defined in functions have "<locals>" in the name.
+    if qualname is None or "<lambda>" in qualname or "<locals>" in qualname:
+        raise ValueError(
+            "Cannot identify {!r} in the cache key. Use a module level function "
+            "or give the operation a name.".format(func)
+        )
+    return ("function", func.__module__, qualname)
+
+
+def _mutable_copy(spectrum: Spectrum) -> Spectrum:
+    """Copy of a spectrum with its own arrays and header."""
+    return Spectrum(
+        xaxis=None if spectrum.xaxis is None else np.array(spectrum.xaxis),
+        flux=None if spectrum.flux is None else np.array(spectrum.flux),
+        calibrated=spectrum.calibrated,
+        header=spectrum.header.copy(),
+        interp_method=spectrum.interp_method,
+        mask=None if spectrum.mask is None else np.array(spectrum.mask),
+        align=spectrum.align,
+    )
+
+
+class DiskCache(object):
+    """Content-addressed cache of Spectrum transforms in a directory.
+
+    Parameters
+    ----------
+    directory: str
+        Directory of the cache. Created if missing.
+    max_bytes: int
+        Size limit of the cache. The least recently used results are
+        evicted when a new result takes the cache over the limit.
+    mmap: bool
+        Load the cached arrays as read-only memory maps. If False the
+        arrays are read into memory.
+
+    """
+
+    def __init__(
+        self, directory: str, max_bytes: int = 2 ** 30, mmap: bool = True
+    ) -> None:
+        """Open the cache directory."""
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_bytes = max_bytes
+        self.mmap = mmap
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(
+        self,
+        spectrum: Spectrum,
+        operation: Union[str, Callable],
+        args: Tuple = (),
+        kwargs: Optional[dict] = None,
+        name: Optional[str] = None,
+    ) -> str:
+        """Cache key of an operation on a spectrum.
+
+        Parameters
+        ----------
+        spectrum: Spectrum
+            Input spectrum. Its header is part of the key.
+        operation: str, callable
+            Name of a Spectrum method or a function. Functions are
+            identified by their module and qualified name, partials also
+            by their arguments.
+        args, kwargs:
+            Parameters of the operation. Arrays and spectra are identified
+            by their contents.
+        name: str, None
+            Name identifying the function instead, required for lambdas,
+            closures and other functions without a stable identity.
+
+        Raises
+        ------
+        ValueError:
+            The function has no stable identity and no name is given.
+
+        """
+        if name is not None:
+            operation = ("named", name)
+        elif not isinstance(operation, str):
+            operation = _callable_token(operation)
+        digest = hashlib.sha1()
+        for part in (
+            __version__,
+            _spectrum_token(spectrum),
+            operation,
+            _token(tuple(args)),
+            _token(kwargs or {}),
+        ):
+            digest.update(repr(part).encode())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.isfile(os.path.join(self._path(key), _META))
+
+    def get(self, key: str) -> Optional[Spectrum]:
+        """Cached spectrum of a key, or None if it is not cached."""
+        path = self._path(key)
+        try:
+            with open(os.path.join(path, _META)) as f:
+                meta = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        mmap_mode = "r" if self.mmap else None
+        arrays = {}
+        for name in ("xaxis", "flux", "mask"):
+            if meta.get(name):
+                arrays[name] = np.load(
+                    os.path.join(path, name + ".npy"), mmap_mode=mmap_mode
+                )
+            else:
+                arrays[name] = None
+        now = time.time()
+        os.utime(path, (now, now))  # Mark as recently used.
+        return Spectrum(
+            xaxis=arrays["xaxis"],
+            flux=arrays["flux"],
+            calibrated=meta["calibrated"],
+            header=_header_from_json(meta["header"]),
+            interp_method=meta["interp_method"],
+            mask=arrays["mask"],
+            align=meta.get("align", "left"),
+        )
+
+    def put(self, key: str, spectrum: Spectrum) -> None:
+        """Store a spectrum under a key and evict old results.
+
+        The result is written to a temporary directory first and moved into
+        place, so concurrent readers never see a partial result.
+        """
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+        try:
+            meta = {
+                "xaxis": spectrum.xaxis is not None,
+                "flux": spectrum.flux is not None,
+                "mask": spectrum.mask is not None,
+                "calibrated": spectrum.calibrated,
+                "interp_method": spectrum.interp_method,
+                "align": spectrum.align,
+                "header": _header_to_json(spectrum.header),
+            }
+            for name in ("xaxis", "flux", "mask"):
+                array = getattr(spectrum, name)
+                if array is not None:
+                    np.save(os.path.join(tmp, name + ".npy"), np.asarray(array))
+            # The metadata is written last, it marks a complete result.
+            with open(os.path.join(tmp, _META), "w") as f:
+                json.dump(meta, f)
+            try:
+                os.replace(tmp, self._path(key))
+            except OSError:
+                # Stored concurrently by another process.
+                shutil.rmtree(tmp, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        self.evict()
+
+    def apply(
+        self,
+        spectrum: Spectrum,
+        operation: Union[str, Callable],
+        *args,
+        name: Optional[str] = None,
+        **kwargs
+    ) -> Spectrum:
+        """Result of an operation on a spectrum, from the cache if stored.
+
+        Parameters
+        ----------
+        spectrum: Spectrum
+            Input spectrum. It is not modified.
+        operation: str, callable
+            Name of a Spectrum method, e.g. "instrument_broaden", or a
+            function of a spectrum. Methods that modify the spectrum in
+            place are applied to a copy.
+        args, kwargs:
+            Parameters passed to the operation.
+        name: str, None
+            Name of the function in the cache key, see ``key``. The name must
+            change whenever the function does.
+
+        Returns
+        -------
+        s: Spectrum
+            The result. Arrays loaded from the cache are read-only.
+
+        """
+        key = self.key(spectrum, operation, args, kwargs, name=name)
+        result = self.get(key)
+        if result is not None:
+            return result
+
+        if isinstance(operation, str):
+            working = _mutable_copy(spectrum)
+            result = getattr(working, operation)(*args, **kwargs)
+            if result is None:
+                result = working
+        else:
+            result = operation(spectrum, *args, **kwargs)
+        if not isinstance(result, Spectrum):
+            raise TypeError(
+                "Can only cache operations returning a Spectrum, not {}.".format(
+                    type(result)
+                )
+            )
+        self.put(key, result)
+        return result
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        """Access time, size and path of the cached results."""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(
+                    os.path.getsize(os.path.join(path, f)) for f in os.listdir(path)
+                )
+                entries.append((os.path.getmtime(path), size, path))
+            except OSError:
+                continue  # Evicted concurrently.
+        return entries
+
+    def size(self) -> int:
+        """Total size of the cached results in bytes."""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, max_bytes: Optional[int] = None) -> None:
+        """Remove the least recently used results over the size limit."""
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self) -> None:
+        """Remove all cached results."""
+        self.evict(max_bytes=0)
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+
+"""Out-of-core processing of spectra larger than memory.
+
+The functions here process a spectrum in blocks of ``chunk_size`` pixels
+and write each block of the result into an output array, so the peak
+memory is bounded by the chunk size rather than the spectrum length. The
+input xaxis and flux are usually memory-mapped ``.npy`` files (see
+:func:`memmap_spectrum`) and the output can be given as a path to a new
+``.npy`` file that is memory-mapped for writing.
+
+Examples
+--------
+>>> spec = memmap_spectrum("wave.npy", "flux.npy")
+>>> broad = instrument_broaden(spec, 50000, out="broad.npy")
+>>> norm_spec = normalize(broad, "linear", out="normalized.npy")
+
+"""
+from typing import Optional, Union
+
+import numpy as np
+from numpy import ndarray
+
+import spectrum_overload.norm as norm
+from spectrum_overload import kernels
+from spectrum_overload.spectrum import Spectrum
+
+DEFAULT_CHUNK_SIZE = 2 ** 20
+
+
+def memmap_spectrum(xaxis_file: str, flux_file: str, **kwargs) -> Spectrum:
+    """Create a Spectrum with read-only memory-mapped ``.npy`` arrays.
+
+    Parameters
+    ----------
+    xaxis_file: str
+        Path to the ``.npy`` file of the xaxis.
+    flux_file: str
+        Path to the ``.npy`` file of the flux.
+    kwargs:
+        Extra Spectrum parameters, e.g. header, calibrated.
+
+    """
+    return Spectrum(
+        xaxis=np.load(xaxis_file, mmap_mode="r"),
+        flux=np.load(flux_file, mmap_mode="r"),
+        **kwargs
+    )
+
+
+def _output_array(out: Optional[Union[str, ndarray]], length: int) -> ndarray:
+    """Return the output array, creating a ``.npy`` memmap for a path."""
+    if out is None:
+        return np.empty(length)
+    elif isinstance(out, str):
+        return np.lib.format.open_memmap(out, mode="w+", dtype=float, shape=(length,))
+    elif len(out) != length:
+        raise ValueError("The out array must be the same length as the spectrum.")
+    return out
+
+
+def _result_spectrum(spectrum: Spectrum, flux: ndarray) -> Spectrum:
+    """New spectrum like spectrum with flux, without copying the arrays."""
+    return Spectrum(
+        xaxis=spectrum.xaxis,
+        flux=flux,
+        calibrated=spectrum.calibrated,
+        header=spectrum.header.copy(),
+        interp_method=spectrum.interp_method,
+        mask=spectrum.mask,
+        align=spectrum.align,
+    )
+
+
+def _nearest_good(mask: ndarray, index: int, step: int, before: bool) -> Optional[int]:
+    """Nearest unmasked pixel before index, or from index onwards.
+
+    The mask is searched in blocks of step pixels. None if there is none.
+    """
+    if before:
+        for stop in range(index, 0, -step):
+            start = max(stop - step, 0)
+            good = np.flatnonzero(~mask[start:stop])
+            if len(good):
+                return start + good[-1]
+    else:
+        for start in range(index, len(mask), step):
+            good = np.flatnonzero(~mask[start : start + step])
+            if len(good):
+                return start + good[0]
+    return None
+
+
+def _filled_block(spectrum: Spectrum, lower: int, upper: int, step: int) -> ndarray:
+    """Flux of a block with the masked pixels linearly interpolated.
+
+    The nearest unmasked pixels on either side of the block are included,
+    so the values are the same as when filling the whole spectrum.
+    """
+    block = np.asarray(spectrum.flux[lower:upper], dtype=float)
+    mask = spectrum.mask
+    if mask is None or not np.any(mask[lower:upper]):
+        return block
+    good = [lower + np.flatnonzero(~mask[lower:upper])]
+    for index in (
+        _nearest_good(mask, lower, step, before=True),
+        _nearest_good(mask, upper, step, before=False),
+    ):
+        if index is not None:
+            good.append([index])
+    good = np.sort(np.concatenate(good)).astype(int)
+    filled = np.interp(
+        np.asarray(spectrum.xaxis[lower:upper], dtype=float),
+        np.asarray(spectrum.xaxis[good], dtype=float),
+        np.asarray(spectrum.flux[good], dtype=float),
+    )
+    return np.where(mask[lower:upper], filled, block)
+
+
+def instrument_broaden(
+    spectrum: Spectrum,
+    R: float,
+    out: Optional[Union[str, ndarray]] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    maxsig: float = 5.0,
+    edge_handling: Optional[str] = None,
+) -> Spectrum:
+    """Broaden a spectrum by instrumental resolution R in blocks.
+
+    Each block is extended by the half-width of the Gaussian kernel on
+    both sides so the result is identical to
+    ``spectrum.instrument_broaden(R, maxsig=maxsig)``. As there, masked
+    pixels are linearly interpolated from their unmasked neighbours before
+    broadening.
+
+    Parameters
+    ----------
+    spectrum: Spectrum
+        Spectrum with an equidistant xaxis. Can be memory-mapped.
+    R: float
+        Instrumental Resolution.
+    out: str, ndarray, None
+        Output flux array or path of a ``.npy`` file to create.
+        Default is a new in-memory array.
+    chunk_size: int
+        Number of pixels processed per block.
+    maxsig: float
+        Extent of the Gaussian kernel in standard deviations.
+    edge_handling: str, None
+        None or "firstlast", as in pyasl.instrBroadGaussFast.
+
+    Returns
+    -------
+    s: Spectrum
+        Broadened spectrum with the flux in ``out``.
+
+    Raises
+    ------
+    ValueError:
+        The wavelength axis is not equidistant.
+
+    """
+    xaxis, flux = spectrum.xaxis, spectrum.flux
+    n = len(flux)
+    result = _output_array(out, n)
+
+    # The mean of an equidistant axis is the mean of its end points.
+    dx = (xaxis[-1] - xaxis[0]) / (n - 1)
+    kernel = kernels.gaussian_kernel(
+        dx, (xaxis[0] + xaxis[-1]) / 2.0, R, maxsig=maxsig
+    )
+    overlap = len(kernel) // 2 + 1
+    if edge_handling not in (None, "firstlast"):
+        raise ValueError("Invalid edge_handling, choose either 'firstlast' or None.")
+
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        lower = max(start - overlap, 0)
+        upper = min(stop + overlap, n)
+
+        dwave = np.diff(xaxis[lower:upper])
+        if np.any(np.abs(dwave - dx) > abs(dx) * 1e-6):
+            raise ValueError(
+                "The wavelength axis is not equidistant, which is required."
+            )
+
+        block = _filled_block(spectrum, lower, upper, chunk_size)
+        pad_lower = pad_upper = 0
+        if edge_handling == "firstlast":
+            pad_lower = overlap if lower == 0 else 0
+            pad_upper = overlap if upper == n else 0
+            block = np.concatenate(
+                (np.full(pad_lower, block[0]), block, np.full(pad_upper, block[-1]))
+            )
+        broadened = kernels.convolve_same(block, kernel)
+        offset = pad_lower + start - lower
+        result[start:stop] = broadened[offset : offset + stop - start]
+
+    s = _result_spectrum(spectrum, result)
+    return s
+
+
+def normalize(
+    spectrum: Spectrum,
+    method: str = "scalar",
+    degree: Optional[int] = None,
+    nbins: int = 50,
+    ntop: int = 20,
+    out: Optional[Union[str, ndarray]] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Spectrum:
+    """Normalize a spectrum by its continuum in blocks.
+
+    The unmasked pixels of each block are split into the ``nbins``
+    continuum bins, carrying a partial bin over to the next block, so every
+    continuum point is found once without holding the spectrum in memory.
+    The continuum function is fitted to all points and then divided out
+    block by block. The result is identical to ``spectrum.normalize(method,
+    degree, nbins=nbins, ntop=ntop)``.
+
+    Parameters
+    ----------
+    spectrum: Spectrum
+        Spectrum to normalize. Can be memory-mapped.
+    method: str ("scalar")
+        The function type, valid functions are "scalar", "linear",
+        "quadratic", "cubic", "poly", and "exponential".
+    degree: int, None
+        Degree of polynomial when method="poly". Default = None.
+    nbins: int
+        Number of bins to separate the spectrum into.
+    ntop: int
+        Number of highest points in bin to take median of.
+    out: str, ndarray, None
+        Output flux array or path of a ``.npy`` file to create.
+        Default is a new in-memory array.
+    chunk_size: int
+        Number of pixels processed per block.
+
+    Returns
+    -------
+    s: Spectrum
+        Normalized spectrum with the flux in ``out``.
+
+    """
+    xaxis, flux = spectrum.xaxis, spectrum.flux
+    n = len(flux)
+    if method == "poly" and degree is None:
+        raise ValueError("No degree specified for continuum method 'poly'.")
+
+    mask = spectrum.mask
+    # The bins split the unmasked pixels, as in Spectrum.continuum.
+    bin_size = (n if mask is None else n - np.count_nonzero(mask)) // nbins
+    if bin_size == 0:
+        raise ValueError("Fewer unmasked pixels than continuum bins.")
+    wave_points, flux_points = [], []
+    carry_wave, carry_flux = np.empty(0), np.empty(0)
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        block_wave = np.asarray(xaxis[start:stop], dtype=float)
+        block_flux = np.asarray(flux[start:stop], dtype=float)
+        if mask is not None:
+            good = ~mask[start:stop]
+            block_wave, block_flux = block_wave[good], block_flux[good]
+        if np.any(np.isnan(block_wave)) or np.any(np.isnan(block_flux)):
+            raise ValueError(
+                "There are Nan values in spectrum. Please remove or mask first."
+            )
+        block_wave = np.concatenate((carry_wave, block_wave))
+        block_flux = np.concatenate((carry_flux, block_flux))
+        num_bins = min(len(block_flux) // bin_size, nbins - len(wave_points))
+        used = num_bins * bin_size
+        if num_bins:
+            points = norm.get_continuum_points(
+                block_wave[:used], block_flux[:used], nbins=num_bins, ntop=ntop
+            )
+            wave_points.extend(points[0])
+            flux_points.extend(points[1])
+        # The pixels after the last bin are not used.
+        if len(wave_points) < nbins:
+            carry_wave, carry_flux = block_wave[used:], block_flux[used:]
+        else:
+            carry_wave, carry_flux = np.empty(0), np.empty(0)
+
+    continuum = norm.continuum_function(
+        np.asarray(wave_points), np.asarray(flux_points), method, degree
+    )
+
+    result = _output_array(out, n)
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        result[start:stop] = flux[start:stop] / continuum(xaxis[start:stop])
+
+    s = _result_spectrum(spectrum, result)
+    s.header["normalized"] = "{0} with degree {1}".format(method, degree)
+    return s
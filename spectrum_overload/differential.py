@@ -1,12 +1,19 @@
 # -*- coding: utf-8 -*-
 
 """Differential Class which takes the difference between two spectra."""
-from typing import Any, Dict, Optional
+import logging
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Sequence, Tuple, Union
 
-from spectrum_overload.spectrum import Spectrum
+import numpy as np
+from numpy import ndarray
 
-# TODO: Add in s-profile from
-# Ferluga 1997: Separating the spectra of binary stars-I. A simple method: Secondary reconstruction
+import spectrum_overload.norm as norm
+from spectrum_overload import barycentric, orbit
+from spectrum_overload.spectrum import Spectrum, SpectrumError
+
+# Ferluga 1997 secondary reconstruction: see reconstruct_secondary.
 
 
 class DifferentialSpectrum(object):
@@ -21,13 +28,44 @@ class DifferentialSpectrum(object):
         self.spec2 = Spectrum2
         self.params = None  # type: Optional[Dict[str, Any]]
 
-    def barycentric_correct(self):
-        """Barycentric correct each spectra."""
-        pass
+    def barycentric_correct(self, site: Optional[barycentric.Site] = None) -> ndarray:
+        """Barycentric correct each spectra.
 
-    def rest_frame(self, frame):
-        """Change rest frame to one of the spectra."""
-        pass
+        Uses the time, target and site in the headers of the spectra.
+        See :func:`spectrum_overload.barycentric.barycentric_correct`.
+
+        Returns
+        -------
+        rv: ndarray
+            Applied velocity corrections [km/s].
+
+        """
+        return barycentric.barycentric_correct([self.spec1, self.spec2], site=site)
+
+    def rest_frame(self, frame: str, times: Optional[Sequence[float]] = None) -> ndarray:
+        """Change rest frame to one of the binary components.
+
+        The component RVs are computed from the orbital parameters (see
+        ``add_orbital_params``) and removed from both spectra in one pass.
+
+        Parameters
+        ----------
+        frame: str
+            "primary" or "secondary".
+        times: list of float, None
+            Observation times [MJD]. Default is the mid-exposure time
+            from the headers.
+
+        Returns
+        -------
+        rv: ndarray
+            RVs of the component that were removed [km/s].
+
+        """
+        spectra = [self.spec1, self.spec2]
+        rvs = _component_rvs(spectra, self.params, frame, times)
+        barycentric.doppler_shift_spectra(spectra, -rvs)
+        return rvs
 
     def diff(self):
         """Calculate difference between the two spectra."""
@@ -43,5 +81,400 @@ class DifferentialSpectrum(object):
         self.spec1, self.spec2 = self.spec2, self.spec1
 
     def add_orbital_params(self, params: Dict[str, Any]):
-        """A dictionary of orbital parameters to use for shifting frames."""
+        """A dictionary of orbital parameters to use for shifting frames.
+
+        See :mod:`spectrum_overload.orbit` for the parameter names.
+        """
         self.params = params
+
+
+class DifferentialSeries(object):
+    """Differentials of a time series of spectra.
+
+    All epochs are aligned once to a common grid and the aligned flux is
+    cached as a 2D stack of shape (epochs, pixels), from which the
+    differentials are computed without any further interpolation.
+
+    Parameters
+    ----------
+    spectra: list of Spectrum
+        Calibrated spectra of each epoch.
+    grid: int, Spectrum, ndarray
+        Common grid. An int selects the xaxis of that epoch. Default 0.
+
+    """
+
+    def __init__(
+        self, spectra: Sequence[Spectrum], grid: Union[int, Spectrum, ndarray] = 0
+    ) -> None:
+        """Initialise with the spectra of all epochs."""
+        if not all(spec.calibrated for spec in spectra):
+            raise ValueError("Input spectra are not calibrated.")
+        self.spectra = list(spectra)
+        if isinstance(grid, int):
+            grid = self.spectra[grid].xaxis
+        elif isinstance(grid, Spectrum):
+            grid = grid.xaxis
+        # Hold the grid in its own Spectrum so it stays fixed when the
+        # epochs are shifted. Only its xaxis is used.
+        self._grid = Spectrum(xaxis=grid, flux=grid)
+        self._aligned = None  # type: Optional[ndarray]
+        self.params = None  # type: Optional[Dict[str, Any]]
+
+    def __len__(self) -> int:
+        """Number of epochs."""
+        return len(self.spectra)
+
+    @property
+    def xaxis(self) -> ndarray:
+        """The common grid of the aligned spectra."""
+        return self._grid.xaxis
+
+    @property
+    def aligned(self) -> ndarray:
+        """Flux of all epochs on the common grid, shape (epochs, pixels).
+
+        Computed on first access and cached. Call ``clear_cache`` after
+        changing the spectra.
+        """
+        if self._aligned is None:
+            aligned = np.empty((len(self.spectra), len(self._grid)))
+            for i, spec in enumerate(self.spectra):
+                aligned[i] = self._grid._aligned_flux(spec)
+            self._aligned = aligned
+        return self._aligned
+
+    def clear_cache(self) -> None:
+        """Discard the cached alignment."""
+        self._aligned = None
+
+    def barycentric_correct(self, site: Optional[barycentric.Site] = None) -> ndarray:
+        """Barycentric correct all epochs in one pass.
+
+        Uses the time, target and site in the headers of the spectra.
+        See :func:`spectrum_overload.barycentric.barycentric_correct`.
+        The cached alignment is discarded, see ``rest_frame``.
+
+        Returns
+        -------
+        rv: ndarray
+            Applied velocity corrections [km/s].
+
+        """
+        rvs = barycentric.barycentric_correct(self.spectra, site=site)
+        self.clear_cache()
+        return rvs
+
+    def rest_frame(self, frame: str, times: Optional[Sequence[float]] = None) -> ndarray:
+        """Shift all epochs into the rest frame of a binary component.
+
+        The component RVs of every epoch are computed together from the
+        orbital parameters (see ``add_orbital_params``) and the xaxis of all
+        epochs are shifted in one pass.
+
+        The cached alignment is discarded rather than resampled, so the
+        next access to ``aligned`` spline interpolates every epoch again,
+        one epoch at a time. Shifting the cached stack in a batch would
+        interpolate twice, giving results that depend on when ``aligned``
+        was first computed and smoothing the stack with every shift.
+
+        Parameters
+        ----------
+        frame: str
+            "primary" or "secondary".
+        times: list of float, None
+            Observation times [MJD]. Default is the mid-exposure time
+            from the headers.
+
+        Returns
+        -------
+        rv: ndarray
+            RVs of the component that were removed [km/s].
+
+        """
+        rvs = _component_rvs(self.spectra, self.params, frame, times)
+        barycentric.doppler_shift_spectra(self.spectra, -rvs)
+        self.clear_cache()
+        return rvs
+
+    def add_orbital_params(self, params: Dict[str, Any]):
+        """A dictionary of orbital parameters to use for shifting frames.
+
+        See :mod:`spectrum_overload.orbit` for the parameter names.
+        """
+        self.params = params
+
+    def reconstruct(
+        self,
+        primary_rvs: Optional[Sequence[float]] = None,
+        secondary_rvs: Optional[Sequence[float]] = None,
+        times: Optional[Sequence[float]] = None,
+        max_iter: int = 100,
+        tol: float = 1e-6,
+        continuum: str = "cubic",
+    ) -> Tuple[Spectrum, Spectrum]:
+        """Reconstruct the component spectra from all epochs.
+
+        See :func:`reconstruct_secondary`. The epochs must be in the
+        frame the RVs are given in, e.g. barycentric corrected.
+
+        Parameters
+        ----------
+        primary_rvs, secondary_rvs: list of float, None
+            RVs of each component at every epoch [km/s]. Default is
+            computed from the orbital parameters at the epoch times.
+        times: list of float, None
+            Observation times [MJD] for the orbital RVs. Default is the
+            mid-exposure time from the headers.
+        max_iter: int
+            Maximum number of iterations.
+        tol: float
+            Convergence tolerance on the change of the components.
+        continuum: str
+            Function of the continuum of the secondary. Default "cubic".
+
+        Returns
+        -------
+        primary, secondary: Spectrum
+            Component spectra in their rest frames on the common grid.
+
+        """
+        if primary_rvs is None:
+            primary_rvs = _component_rvs(self.spectra, self.params, "primary", times)
+        if secondary_rvs is None:
+            secondary_rvs = _component_rvs(
+                self.spectra, self.params, "secondary", times
+            )
+        primary, secondary, iterations = reconstruct_secondary(
+            self.xaxis,
+            self.aligned,
+            primary_rvs,
+            secondary_rvs,
+            max_iter=max_iter,
+            tol=tol,
+            continuum=continuum,
+        )
+        header = {"reconstruction_iterations": iterations}
+        return (
+            Spectrum(xaxis=self.xaxis, flux=primary, header=dict(header)),
+            Spectrum(xaxis=self.xaxis, flux=secondary, header=dict(header)),
+        )
+
+    def diff(self, reference: int = 0) -> ndarray:
+        """Differences of every epoch to the reference epoch.
+
+        Returns
+        -------
+        diffs: ndarray
+            Array of shape (epochs, pixels) of ``epoch - reference``.
+
+        """
+        aligned = self.aligned
+        return aligned - aligned[reference]
+
+    def pairwise(
+        self, pairs: Optional[ndarray] = None, n_jobs: int = 1
+    ) -> Tuple[ndarray, ndarray]:
+        """Differences between pairs of epochs.
+
+        Parameters
+        ----------
+        pairs: ndarray, None
+            Array of shape (n, 2) of epoch indices (i, j) giving
+            ``epoch_i - epoch_j``. Default is all pairs with i < j.
+        n_jobs: int
+            Number of threads splitting the pairs. Default 1.
+
+        Returns
+        -------
+        pairs: ndarray
+            Epoch indices of each differential, shape (n, 2).
+        diffs: ndarray
+            Differentials of shape (n, pixels).
+
+        """
+        if pairs is None:
+            pairs = np.column_stack(np.triu_indices(len(self.spectra), k=1))
+        pairs = np.asarray(pairs, dtype=int).reshape(-1, 2)
+        aligned = self.aligned
+        diffs = np.empty((len(pairs), aligned.shape[1]))
+
+        def subtract(block: range) -> None:
+            for k in block:
+                np.subtract(aligned[pairs[k, 0]], aligned[pairs[k, 1]], out=diffs[k])
+
+        if n_jobs > 1 and len(pairs) > 1:
+            step = -(-len(pairs) // n_jobs)  # Ceiling division
+            blocks = [
+                range(i, min(i + step, len(pairs))) for i in range(0, len(pairs), step)
+            ]
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                list(executor.map(subtract, blocks))
+        else:
+            subtract(range(len(pairs)))
+        return pairs, diffs
+
+
+def doppler_shift_stack(grid: ndarray, stack: ndarray, rvs: Sequence[float]) -> ndarray:
+    """Doppler shift each row of a stack of flux on a common grid.
+
+    Row i is shifted by rvs[i] [km/s] and linearly resampled back onto the
+    grid in a single vectorized pass. Points shifted in from outside the
+    grid are NaN.
+
+    Parameters
+    ----------
+    grid: ndarray
+        Ascending common wavelength grid of length n.
+    stack: ndarray
+        Flux of shape (m, n).
+    rvs: list of float
+        Radial velocity of each row [km/s].
+
+    Returns
+    -------
+    shifted: ndarray
+        Shifted flux of shape (m, n).
+
+    """
+    grid = np.asarray(grid, dtype=float)
+    factors = 1.0 + np.asarray(rvs, dtype=float) / barycentric.c_kms
+    # Flux at grid after the shift is the flux at grid / factor before it.
+    positions = grid[np.newaxis, :] / factors[:, np.newaxis]
+    j = np.clip(np.searchsorted(grid, positions) - 1, 0, len(grid) - 2)
+    weight = (positions - grid[j]) / (grid[j + 1] - grid[j])
+    rows = np.arange(len(stack))[:, np.newaxis]
+    shifted = stack[rows, j] * (1 - weight) + stack[rows, j + 1] * weight
+    shifted[(positions < grid[0]) | (positions > grid[-1])] = np.nan
+    return shifted
+
+
+def reconstruct_secondary(
+    grid: ndarray,
+    stack: ndarray,
+    primary_rvs: Sequence[float],
+    secondary_rvs: Sequence[float],
+    max_iter: int = 100,
+    tol: float = 1e-6,
+    continuum: str = "cubic",
+) -> Tuple[ndarray, ndarray, int]:
+    """Separate the spectra of the two components of a binary.
+
+    Iterative reconstruction of the secondary in the spirit of Ferluga et
+    al. (1997). Starting with no secondary, each iteration
+
+    1. shifts every epoch minus the current secondary into the rest frame
+       of the primary and averages them to update the primary,
+    2. shifts every epoch minus the updated primary into the rest frame of
+       the secondary and averages them to update the secondary.
+
+    Every step acts on the whole (epochs, pixels) stack at once. The data
+    only constrain the sum of the two continua, so without a constraint
+    slowly varying offsets move between the components and the iterations
+    barely converge. The continuum of the secondary is therefore fitted
+    and removed in every iteration. The iterations stop when neither
+    component changes by more than ``tol`` or after ``max_iter``
+    iterations.
+
+    Parameters
+    ----------
+    grid: ndarray
+        Common wavelength grid of the epochs.
+    stack: ndarray
+        Flux of every epoch on the grid, shape (epochs, pixels).
+    primary_rvs, secondary_rvs: list of float
+        RVs of each component at every epoch [km/s].
+    max_iter: int
+        Maximum number of iterations.
+    tol: float
+        Convergence tolerance on the change of the components.
+    continuum: str
+        Function of the continuum of the secondary, any method of
+        :func:`spectrum_overload.norm.continuum`. Default "cubic".
+
+    Returns
+    -------
+    primary: ndarray
+        Primary spectrum in its rest frame. Contains the continuum.
+    secondary: ndarray
+        Secondary spectrum in its rest frame, relative to the continuum.
+    iterations: int
+        Number of iterations done.
+
+    """
+    stack = np.asarray(stack, dtype=float)
+    primary_rvs = np.asarray(primary_rvs, dtype=float)
+    secondary_rvs = np.asarray(secondary_rvs, dtype=float)
+    if not (len(primary_rvs) == len(secondary_rvs) == len(stack)):
+        raise ValueError("Need the RVs of both components for each epoch.")
+
+    shape = stack.shape
+    primary = np.zeros(shape[1])
+    secondary = np.zeros(shape[1])
+    iterations = 0
+    with warnings.catch_warnings():
+        # Pixels without data in all epochs give NaN.
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for iterations in range(1, max_iter + 1):
+            shifted = doppler_shift_stack(
+                grid, np.broadcast_to(secondary, shape), secondary_rvs
+            )
+            new_primary = np.nanmean(
+                doppler_shift_stack(grid, stack - shifted, -primary_rvs), axis=0
+            )
+            shifted = doppler_shift_stack(
+                grid, np.broadcast_to(new_primary, shape), primary_rvs
+            )
+            new_secondary = np.nanmean(
+                doppler_shift_stack(grid, stack - shifted, -secondary_rvs), axis=0
+            )
+            # Only the sum of the continua is constrained by the data, so
+            # the continuum of the secondary is removed every iteration.
+            finite = np.isfinite(new_secondary)
+            if np.any(finite):
+                new_secondary[finite] -= _continuum(
+                    grid[finite], new_secondary[finite], continuum
+                )
+            # Fill the edges left by the shifts so they do not spread.
+            new_primary[np.isnan(new_primary)] = 0.0
+            new_secondary[np.isnan(new_secondary)] = 0.0
+
+            change = max(
+                np.max(np.abs(new_primary - primary)),
+                np.max(np.abs(new_secondary - secondary)),
+            )
+            primary, secondary = new_primary, new_secondary
+            if change < tol:
+                break
+        else:
+            logging.warning(
+                "Secondary reconstruction did not converge in {0} iterations.".format(
+                    max_iter
+                )
+            )
+    return primary, secondary, iterations
+
+
+def _continuum(wave: ndarray, flux: ndarray, method: str) -> ndarray:
+    """Continuum of a spectrum of lines relative to the continuum.
+
+    Fitted to the median of the highest fifth of the pixels in 20 bins.
+    """
+    nbins = min(20, len(flux))
+    return norm.continuum(
+        wave, flux, method=method, nbins=nbins, ntop=max(len(flux) // (5 * nbins), 1)
+    )
+
+
+def _component_rvs(
+    spectra: Sequence[Spectrum],
+    params: Optional[Dict[str, Any]],
+    frame: str,
+    times: Optional[Sequence[float]] = None,
+) -> ndarray:
+    """RVs of a binary component at the epochs of the spectra."""
+    if params is None:
+        raise SpectrumError("No orbital parameters. Use add_orbital_params first.")
+    if times is None:
+        times = [barycentric.observation_time(spec.header) for spec in spectra]
+    return orbit.radial_velocity(np.asarray(times, dtype=float), params, frame)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+"""Fourier-space disentangling of the component spectra of binaries.
+
+On a grid uniform in the logarithm of wavelength a Doppler shift is a
+constant shift of pixels, which the Fourier transform turns into a phase
+factor. Each epoch is the sum of the shifted components, so for every
+frequency k
+
+    F_j(k) = sum_c exp(-2 pi i k s_jc / M) X_c(k)
+
+where F_j is the transform of epoch j, X_c of component c and s_jc the
+shift in pixels. The small (epochs, components) systems of all frequencies
+are independent and are solved together by least squares (Hadrava 1995).
+
+The continuum (frequency 0) and the lowest frequencies cannot be
+separated between the components, so the component spectra are only
+determined up to a smooth offset between them.
+"""
+import warnings
+from typing import List, Optional, Sequence
+
+import numpy as np
+from numpy import ndarray
+
+from spectrum_overload.differential import DifferentialSeries
+from spectrum_overload.kernels import c_kms
+from spectrum_overload.spectrum import Spectrum, SpectrumError
+
+
+def log_wavelength_grid(start: float, stop: float, num: int) -> ndarray:
+    """Wavelength grid with constant spacing in log(wavelength)."""
+    if start <= 0 or stop <= start:
+        raise ValueError("Wavelength limits must be positive and increasing.")
+    grid = np.exp(np.linspace(np.log(start), np.log(stop), num))
+    # Keep the end points exact so the grid stays within the limits.
+    grid[[0, -1]] = start, stop
+    return grid
+
+
+def disentangle(
+    spectra: Sequence[Spectrum],
+    rvs: ndarray,
+    light_factors: Optional[Sequence[float]] = None,
+    oversample: float = 1.0,
+    rcond: float = 1e-3,
+) -> List[Spectrum]:
+    """Separate the component spectra from the epochs of a binary.
+
+    The epochs are resampled once onto a common log-lambda grid covering
+    their overlap, and the per-frequency least squares systems are solved
+    in a single batched call.
+
+    Parameters
+    ----------
+    spectra: list of Spectrum
+        Continuum normalized, calibrated spectra of each epoch.
+    rvs: ndarray
+        RVs of each component at every epoch [km/s], shape
+        (epochs, components).
+    light_factors: list of float, None
+        Fraction of the total light of each component. The returned
+        spectra are normalized by them. Default is not to rescale.
+    oversample: float
+        Number of log-lambda pixels per pixel of the longest epoch.
+    rcond: float
+        Relative cut-off of small singular values of the per-frequency
+        systems, which suppresses the frequencies that cannot be separated.
+
+    Returns
+    -------
+    components: list of Spectrum
+        Spectrum of each component in its rest frame on the log-lambda grid.
+
+    Raises
+    ------
+    SpectrumError:
+        The spectra are not calibrated or do not overlap.
+
+    """
+    rvs = np.atleast_2d(np.asarray(rvs, dtype=float))
+    if rvs.shape[0] != len(spectra):
+        raise ValueError("Need the component RVs for each epoch.")
+    if not all(spec.calibrated for spec in spectra):
+        raise SpectrumError("Cannot disentangle uncalibrated spectra.")
+    n_components = rvs.shape[1]
+    if light_factors is not None and len(light_factors) != n_components:
+        raise ValueError("Need a light factor for each component.")
+
+    lower = max(np.min(spec.xaxis) for spec in spectra)
+    upper = min(np.max(spec.xaxis) for spec in spectra)
+    if lower >= upper:
+        raise SpectrumError("The spectra do not overlap so cannot be disentangled.")
+    n = int(max(len(spec) for spec in spectra) * oversample)
+    grid = log_wavelength_grid(lower, upper, n)
+    step = np.log(grid[1] / grid[0])
+
+    # Zero pad the line depths so the shifts do not wrap around the edges.
+    shifts = np.log1p(rvs / c_kms) / step
+    pad = int(np.ceil(np.max(np.abs(shifts)))) + 1
+    size = n + 2 * pad
+    depth = np.zeros((len(spectra), size))
+    depth[:, pad : pad + n] = DifferentialSeries(spectra, grid=grid).aligned - 1.0
+    depth[~np.isfinite(depth)] = 0.0
+
+    transform = np.fft.rfft(depth, axis=1)  # (epochs, frequencies)
+    k = np.arange(transform.shape[1])
+    # Design matrix of every frequency, (frequencies, epochs, components).
+    design = np.exp(-2j * np.pi * k[:, None, None] * shifts[None, :, :] / size)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        solution = np.einsum(
+            "kcj,jk->kc", np.linalg.pinv(design, rcond=rcond), transform
+        )
+    component_depth = np.fft.irfft(solution.T, n=size, axis=1)[:, pad : pad + n]
+
+    components = []
+    for c in range(n_components):
+        flux = component_depth[c]
+        if light_factors is not None:
+            flux = flux / light_factors[c]
+        components.append(
+            Spectrum(
+                xaxis=grid,
+                flux=1.0 + flux,
+                calibrated=True,
+                header={"component": c},
+            )
+        )
+    return components
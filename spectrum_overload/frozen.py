@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+"""Immutable spectra that can be shared between threads and used as keys.
+
+A FrozenSpectrum holds read-only copies of the xaxis and flux and refuses
+attribute assignment. The methods that modify a Spectrum in place instead
+return a new FrozenSpectrum, and the methods and operators that return a
+new Spectrum return a FrozenSpectrum.
+
+The content hash of the xaxis, flux and calibration is computed once on
+first use, so hashing and comparing frozen spectra is O(1) after that.
+"""
+import hashlib
+from functools import wraps
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+from numpy import ndarray
+
+from spectrum_overload.spectrum import Spectrum, _array_fingerprint
+
+# Attributes that are caches, which may still be set on a frozen spectrum.
+_CACHE_ATTRIBUTES = ("_hash", "_xaxis_fingerprint", "_runs")
+
+
+def content_hash(spectrum: Spectrum) -> str:
+    """Hash of the xaxis, flux, calibration and mask of any spectrum."""
+    digest = hashlib.sha1()
+    if isinstance(spectrum, FrozenSpectrum):
+        xaxis = spectrum.xaxis_fingerprint()
+    else:
+        # The cached fingerprint is stale after an in-place change of an
+        # xaxis shared with a copy, only frozen arrays cannot change.
+        xaxis = None if spectrum.xaxis is None else _array_fingerprint(spectrum.xaxis)
+    digest.update(repr(xaxis).encode())
+    flux = None if spectrum.flux is None else _array_fingerprint(spectrum.flux)
+    digest.update(repr(flux).encode())
+    digest.update(repr(spectrum.calibrated).encode())
+    if spectrum.mask is not None:
+        digest.update(repr(_array_fingerprint(spectrum.mask)).encode())
+    return digest.hexdigest()
+
+
+def _arrays_of(values: Iterable[Any]) -> List[ndarray]:
+    """Arrays of the arrays, spectra and sequences of them in values."""
+    arrays = []  # type: List[ndarray]
+    for value in values:
+        if isinstance(value, Spectrum):
+            arrays.extend(
+                array
+                for array in (value.xaxis, value.flux, value.mask)
+                if array is not None
+            )
+        elif isinstance(value, np.ndarray):
+            arrays.append(value)
+        elif isinstance(value, (list, tuple)):
+            arrays.extend(_arrays_of(value))
+    return arrays
+
+
+def _freeze_owned(spectrum: Spectrum, inputs: Iterable[Any]) -> "FrozenSpectrum":
+    """Freeze a new spectrum, copying the arrays it shares with the inputs.
+
+    The arrays of the inputs, e.g. the reference grid of an interpolation,
+    belong to the caller and must not be made read-only.
+    """
+    shared = _arrays_of(inputs)
+    for name in ("flux", "xaxis", "mask"):
+        array = getattr(spectrum, name)
+        if array is not None and any(
+            np.may_share_memory(array, other) for other in shared
+        ):
+            setattr(spectrum, name, np.array(array))
+    return FrozenSpectrum.from_spectrum(spectrum, copy=False)
+
+
+def _freeze_result(method):
+    """Wrap a Spectrum method so a Spectrum result is frozen."""
+
+    @wraps(method)
+    def frozen_method(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        if isinstance(result, Spectrum) and not isinstance(result, FrozenSpectrum):
+            return _freeze_owned(result, args + tuple(kwargs.values()))
+        return result
+
+    return frozen_method
+
+
+def _new_instead(method):
+    """Wrap an in-place Spectrum method to return a new FrozenSpectrum."""
+
+    @wraps(method)
+    def frozen_method(self, *args, **kwargs):
+        spectrum = self.thaw()
+        method(spectrum, *args, **kwargs)
+        return _freeze_owned(spectrum, args + tuple(kwargs.values()))
+
+    frozen_method.__doc__ = "{}\n\n        Returns a new FrozenSpectrum instead.".format(
+        (method.__doc__ or "").rstrip()
+    )
+    return frozen_method
+
+
+class FrozenSpectrum(Spectrum):
+    """Immutable Spectrum with read-only arrays and a cached content hash.
+
+    Takes the same parameters as Spectrum. The arrays and header are copied
+    on creation. The header is not part of the content hash.
+    """
+
+    def __init__(self, **kwargs) -> None:
+        """Initialise like a Spectrum with copies of the arrays and freeze."""
+        for key in ("xaxis", "flux", "mask"):
+            if kwargs.get(key) is not None:
+                kwargs[key] = np.array(kwargs[key], copy=True)
+        if kwargs.get("header") is not None:
+            kwargs["header"] = kwargs["header"].copy()
+        super().__init__(**kwargs)
+        self._freeze()
+
+    def _freeze(self) -> None:
+        """Make the arrays read-only and block attribute assignment."""
+        for array in (self._xaxis, self._flux, self._mask):
+            if array is not None:
+                array.flags.writeable = False
+        self._hash = None  # type: Optional[str]
+        self._frozen = True
+
+    @classmethod
+    def from_spectrum(cls, spectrum: Spectrum, copy: bool = True) -> "FrozenSpectrum":
+        """Freeze a spectrum.
+
+        Parameters
+        ----------
+        spectrum: Spectrum
+            Spectrum to freeze.
+        copy: bool
+            Copy the arrays and header. Only use False if the spectrum is
+            not used afterwards.
+
+        """
+        kwargs = dict(
+            xaxis=spectrum.xaxis,
+            flux=spectrum.flux,
+            calibrated=spectrum.calibrated,
+            header=spectrum.header,
+            interp_method=spectrum.interp_method,
+            mask=spectrum.mask,
+            align=spectrum.align,
+        )
+        if copy:
+            return cls(**kwargs)
+        frozen = cls.__new__(cls)
+        Spectrum.__init__(frozen, **kwargs)
+        frozen._freeze()
+        return frozen
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if getattr(self, "_frozen", False) and name not in _CACHE_ATTRIBUTES:
+            raise AttributeError(
+                "Cannot set {} of a FrozenSpectrum. Use thaw() for a mutable "
+                "copy.".format(name)
+            )
+        super().__setattr__(name, value)
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        """Restore from a pickle with read-only arrays."""
+        self.__dict__.update(state)
+        for array in (self._xaxis, self._flux, self._mask):
+            if array is not None and array.flags.writeable:
+                array.flags.writeable = False
+
+    def thaw(self) -> Spectrum:
+        """Mutable Spectrum copy of the frozen spectrum."""
+        return Spectrum(
+            xaxis=None if self.xaxis is None else np.array(self.xaxis),
+            flux=None if self.flux is None else np.array(self.flux),
+            calibrated=self.calibrated,
+            header=self.header.copy(),
+            interp_method=self.interp_method,
+            mask=None if self.mask is None else np.array(self.mask),
+            align=self.align,
+        )
+
+    # The methods of Spectrum copy before modifying, so copies are mutable.
+    copy = thaw
+
+    def freeze(self) -> "FrozenSpectrum":
+        """A FrozenSpectrum is already frozen."""
+        return self
+
+    @property
+    def content_hash(self) -> str:
+        """Hash of the xaxis, flux, calibration and mask, computed once."""
+        if self._hash is None:
+            self._hash = content_hash(self)
+        return self._hash
+
+    def __hash__(self) -> int:
+        return hash(self.content_hash)
+
+    def __eq__(self, other: object) -> bool:
+        """Compare the cached content hashes first, then the headers."""
+        if isinstance(other, FrozenSpectrum):
+            return other is self or (
+                self.content_hash == other.content_hash and self.header == other.header
+            )
+        return super().__eq__(other)
+
+    def __ne__(self, other: object) -> bool:
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        """Apply numpy ufuncs, see ``Spectrum.__array_ufunc__``.
+
+        New Spectrum results are frozen. Spectrum objects given to ``out``
+        are returned unchanged.
+        """
+        results = Spectrum.__array_ufunc__(self, ufunc, method, *inputs, **kwargs)
+        out = kwargs.get("out", ())
+        if method != "__call__":
+            return results
+        single = not isinstance(results, tuple)
+        frozen = []
+        for i, result in enumerate((results,) if single else results):
+            if isinstance(result, Spectrum) and not (i < len(out) and out[i] is result):
+                result = _freeze_owned(result, inputs)
+            frozen.append(result)
+        return frozen[0] if single else tuple(frozen)
+
+    # In-place methods of Spectrum return a new FrozenSpectrum instead.
+    wav_select = _new_instead(Spectrum.wav_select)
+    add_noise = _new_instead(Spectrum.add_noise)
+    add_noise_sigma = _new_instead(Spectrum.add_noise_sigma)
+    doppler_shift = _new_instead(Spectrum.doppler_shift)
+    calibrate_with = _new_instead(Spectrum.calibrate_with)
+    interpolate1d_to = _new_instead(Spectrum.interpolate1d_to)
+    spline_interpolate_to = _new_instead(Spectrum.spline_interpolate_to)
+    rebin_to = _new_instead(Spectrum.rebin_to)
+    mask_nans = _new_instead(Spectrum.mask_nans)
+
+    # Methods returning a new Spectrum return a FrozenSpectrum.
+    interpolated = _freeze_result(Spectrum.interpolated)
+    remove_nans = _freeze_result(Spectrum.remove_nans)
+    continuum = _freeze_result(Spectrum.continuum)
+    normalize = _freeze_result(Spectrum.normalize)
+    instrument_broaden = _freeze_result(Spectrum.instrument_broaden)
+    __getitem__ = _freeze_result(Spectrum.__getitem__)
+    __add__ = _freeze_result(Spectrum.__add__)
+    __radd__ = _freeze_result(Spectrum.__radd__)
+    __sub__ = _freeze_result(Spectrum.__sub__)
+    __mul__ = _freeze_result(Spectrum.__mul__)
+    __div__ = _freeze_result(Spectrum.__div__)
+    __truediv__ = _freeze_result(Spectrum.__truediv__)
+    __pow__ = _freeze_result(Spectrum.__pow__)
+    __neg__ = _freeze_result(Spectrum.__neg__)
+    __pos__ = _freeze_result(Spectrum.__pos__)
+    __abs__ = _freeze_result(Spectrum.__abs__)
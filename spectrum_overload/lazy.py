@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+"""Deferred evaluation of chained Spectrum arithmetic.
+
+Operators on a :class:`LazySpectrum` build an expression tree instead of
+computing a new Spectrum at every step. When the result is requested every
+Spectrum in the expression is aligned once to a common grid (the xaxis of
+the first Spectrum in the expression) and the flux is evaluated in a single
+pass, using numexpr when it is installed.
+
+Examples
+--------
+>>> residual = (obs.lazy() - model.lazy() * scale) / continuum + offset
+>>> residual.flux  # Evaluated here.
+
+"""
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+from numpy import ndarray
+
+from spectrum_overload.spectrum import Spectrum, SpectrumError, _combine_masks
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+_OPERATORS = {
+    "add": (np.add, "+"),
+    "sub": (np.subtract, "-"),
+    "mul": (np.multiply, "*"),
+    "truediv": (np.true_divide, "/"),
+    "pow": (np.power, "**"),
+}
+
+
+class _Node(object):
+    """A node of the expression tree."""
+
+    __slots__ = ("op", "args")
+
+    def __init__(self, op: str, *args: Any) -> None:
+        self.op = op
+        self.args = args
+
+
+class LazySpectrum(object):
+    """A deferred arithmetic expression of spectra.
+
+    Create one with :meth:`Spectrum.lazy`. The expression is evaluated when
+    ``flux`` is accessed or :meth:`evaluate` is called and the result is
+    cached.
+
+    Attributes
+    ----------
+    use_numexpr: bool
+        Evaluate with numexpr when it is available. (Default = True.)
+
+    """
+
+    # Let Spectrum operators hand over to the reflected lazy operators.
+    _deferred = True
+
+    def __init__(
+        self, value: Union[Spectrum, _Node], use_numexpr: bool = True
+    ) -> None:
+        """Initialise from a Spectrum or an expression node."""
+        if isinstance(value, Spectrum):
+            value = _Node("leaf", value)
+        elif not isinstance(value, _Node):
+            raise TypeError("Cannot create a LazySpectrum from {}".format(type(value)))
+        self._node = value
+        self.use_numexpr = use_numexpr
+        self._result = None  # type: Optional[Spectrum]
+
+    @property
+    def reference(self) -> Spectrum:
+        """The first Spectrum of the expression which defines the grid."""
+        for leaf in self._leaves():
+            if isinstance(leaf, Spectrum):
+                return leaf
+        raise SpectrumError("The expression does not contain a Spectrum.")
+
+    @property
+    def xaxis(self) -> ndarray:
+        """The xaxis of the result."""
+        return self.reference.xaxis
+
+    @property
+    def flux(self) -> ndarray:
+        """The flux of the result. Evaluates the expression."""
+        return self.evaluate().flux
+
+    @property
+    def header(self):
+        """The header of the result."""
+        return self.reference.header
+
+    @property
+    def calibrated(self) -> bool:
+        """The calibration state of the result."""
+        return self.reference.calibrated
+
+    def __len__(self) -> int:
+        """Return length of the result."""
+        return len(self.reference)
+
+    def evaluate(self) -> Spectrum:
+        """Align all spectra to the grid once and evaluate the expression.
+
+        Returns
+        -------
+        s: Spectrum
+            Result of the expression, with the xaxis and header of the
+            first Spectrum of the expression. Its ``align`` mode selects
+            the xaxis for spectra on other grids, as for the operators.
+
+        """
+        if self._result is None:
+            reference = self.reference
+            others = [
+                leaf
+                for leaf in self._leaves()
+                if isinstance(leaf, Spectrum)
+                and not (len(leaf) == len(reference) and leaf.same_xaxis(reference))
+            ]
+            window = None
+            if reference.align != "left" and others:
+                window, start = reference._overlap_window(others)
+
+            values = {}  # type: Dict[int, Any]
+            mask = None
+            for leaf in self._leaves():
+                if id(leaf) in values:
+                    continue
+                if isinstance(leaf, Spectrum):
+                    if leaf.calibrated != reference.calibrated:
+                        raise SpectrumError(
+                            "Spectra are not consistently calibrated for evaluation."
+                        )
+                    if window is not None:
+                        values[id(leaf)], leaf_mask = reference._window_values(
+                            window, start, leaf
+                        )
+                        mask = _combine_masks(mask, leaf_mask)
+                    else:
+                        values[id(leaf)] = reference._aligned_flux(leaf)
+                        mask = _combine_masks(mask, reference._aligned_mask(leaf))
+                elif np.isscalar(leaf):
+                    values[id(leaf)] = leaf
+                else:
+                    if len(leaf) != len(reference):
+                        raise ValueError(
+                            "Dimension mismatch in operation with lengths {} and {}.".format(
+                                len(reference), len(leaf)
+                            )
+                        )
+                    values[id(leaf)] = leaf
+                    if window is not None:
+                        values[id(leaf)], __ = reference._window_values(
+                            window, start, leaf
+                        )
+
+            if self.use_numexpr and numexpr is not None:
+                local_dict = {
+                    "v{}".format(i): value for i, value in enumerate(values.values())
+                }
+                names = {key: "v{}".format(i) for i, key in enumerate(values)}
+                flux = numexpr.evaluate(
+                    _to_string(self._node, names), local_dict=local_dict
+                )
+            else:
+                flux, __ = _evaluate(self._node, values)
+
+            if window is not None:
+                window.flux = flux
+                window.mask = mask
+                result = reference._window_result(window, start, others)
+            else:
+                result = reference.copy()
+                result.flux = flux
+                result.mask = mask
+            self._result = result
+        return self._result
+
+    def _leaves(self) -> List[Any]:
+        """Leaf values of the expression from left to right."""
+        leaves = []
+        stack = [self._node]
+        while stack:
+            node = stack.pop()
+            if node.op == "leaf":
+                leaves.append(node.args[0])
+            else:
+                stack.extend(reversed(node.args))
+        return leaves
+
+    # ######################################################
+    # Expression building operators
+    # ######################################################
+    def _binary(self, op: str, other: Any, reflected: bool = False) -> "LazySpectrum":
+        if isinstance(other, LazySpectrum):
+            other_node = other._node
+        elif isinstance(other, Spectrum) or np.isscalar(other):
+            other_node = _Node("leaf", other)
+        else:
+            other_node = _Node("leaf", np.asarray(other))
+
+        if op == "pow" and any(
+            isinstance(leaf, Spectrum)
+            for leaf in LazySpectrum(other_node)._leaves()
+        ):
+            raise TypeError("Can not preform Spectrum ** Spectrum")
+
+        if reflected:
+            node = _Node(op, other_node, self._node)
+        else:
+            node = _Node(op, self._node, other_node)
+        return LazySpectrum(node, use_numexpr=self.use_numexpr)
+
+    def __add__(self, other: Any) -> "LazySpectrum":
+        return self._binary("add", other)
+
+    def __radd__(self, other: Any) -> "LazySpectrum":
+        return self._binary("add", other, reflected=True)
+
+    def __sub__(self, other: Any) -> "LazySpectrum":
+        return self._binary("sub", other)
+
+    def __rsub__(self, other: Any) -> "LazySpectrum":
+        return self._binary("sub", other, reflected=True)
+
+    def __mul__(self, other: Any) -> "LazySpectrum":
+        return self._binary("mul", other)
+
+    def __rmul__(self, other: Any) -> "LazySpectrum":
+        return self._binary("mul", other, reflected=True)
+
+    def __truediv__(self, other: Any) -> "LazySpectrum":
+        return self._binary("truediv", other)
+
+    def __rtruediv__(self, other: Any) -> "LazySpectrum":
+        return self._binary("truediv", other, reflected=True)
+
+    def __pow__(self, other: Any) -> "LazySpectrum":
+        return self._binary("pow", other)
+
+    def __neg__(self) -> "LazySpectrum":
+        return LazySpectrum(_Node("neg", self._node), use_numexpr=self.use_numexpr)
+
+
+def _to_string(node: _Node, names: Dict[int, str]) -> str:
+    """Build a numexpr expression string of the tree."""
+    if node.op == "leaf":
+        return names[id(node.args[0])]
+    elif node.op == "neg":
+        return "(-{})".format(_to_string(node.args[0], names))
+    return "({} {} {})".format(
+        _to_string(node.args[0], names),
+        _OPERATORS[node.op][1],
+        _to_string(node.args[1], names),
+    )
+
+
+def _evaluate(node: _Node, values: Dict[int, Any]):
+    """Evaluate the tree with numpy.
+
+    Temporaries created during the evaluation are reused as output buffers
+    so only one new array is allocated per branch of the tree.
+
+    Returns
+    -------
+    value: ndarray or scalar
+        Result of the node.
+    owned: bool
+        True if value is a temporary that can be overwritten.
+
+    """
+    if node.op == "leaf":
+        return values[id(node.args[0])], False
+    elif node.op == "neg":
+        value, owned = _evaluate(node.args[0], values)
+        if owned:
+            return np.negative(value, out=value), True
+        value = np.negative(value)
+        return value, isinstance(value, np.ndarray)
+
+    ufunc = _OPERATORS[node.op][0]
+    left, left_owned = _evaluate(node.args[0], values)
+    right, right_owned = _evaluate(node.args[1], values)
+    for buffer, owned in ((left, left_owned), (right, right_owned)):
+        if (
+            owned
+            and buffer.shape == np.broadcast(left, right).shape
+            and np.result_type(left, right) == buffer.dtype
+            and (node.op != "truediv" or buffer.dtype.kind in "fc")
+        ):
+            return ufunc(left, right, out=buffer), True
+    value = ufunc(left, right)
+    return value, isinstance(value, np.ndarray)
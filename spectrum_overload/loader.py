@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+"""Loading of spectra from FITS files with asyncio prefetching.
+
+``PrefetchLoader`` is an async iterator of spectra that reads the next
+files on a thread pool while the current spectrum is being processed, so
+the latency of slow storage is hidden behind the computation.
+
+Examples
+--------
+>>> async def reduce(paths):
+...     async with PrefetchLoader(paths, prefetch=4) as spectra:
+...         async for spec in spectra:
+...             spec.normalize("linear")
+
+"""
+import asyncio
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Iterable, Optional
+
+import numpy as np
+from astropy.io import fits
+
+from spectrum_overload.spectrum import Spectrum
+
+
+def read_fits(
+    path: str,
+    ext: Optional[int] = None,
+    flux_column: Optional[str] = None,
+    xaxis_column: Optional[str] = "Wavelength",
+) -> Spectrum:
+    """Read a spectrum from a FITS file.
+
+    Image data is the flux, with the xaxis from the linear CRVAL1, CDELT1
+    (or CD1_1) and CRPIX1 header keys when present, otherwise pixel
+    positions. Table data uses the xaxis_column and flux_column columns.
+
+    Parameters
+    ----------
+    path: str
+        Path of the FITS file.
+    ext: int, None
+        HDU to read. Default is the first HDU with data.
+    flux_column: str, None
+        Table column of the flux. Default is the first column that is not
+        the xaxis column.
+    xaxis_column: str, None
+        Table column of the xaxis. If missing the xaxis is pixel positions.
+
+    Returns
+    -------
+    s: Spectrum
+        The spectrum, calibrated if a wavelength axis was found, with the
+        primary header.
+
+    """
+    with fits.open(path) as hdul:
+        if ext is None:
+            ext = next((i for i, hdu in enumerate(hdul) if hdu.data is not None), 0)
+        hdu = hdul[ext]
+        header = hdul[0].header.copy()
+        xaxis = None
+        if isinstance(hdu, (fits.BinTableHDU, fits.TableHDU)):
+            names = hdu.columns.names
+            if flux_column is None:
+                flux_column = next(name for name in names if name != xaxis_column)
+            flux = np.array(hdu.data[flux_column])
+            if xaxis_column in names:
+                xaxis = np.array(hdu.data[xaxis_column])
+        else:
+            flux = np.array(hdu.data)
+            step = hdu.header.get("CDELT1", hdu.header.get("CD1_1"))
+            if "CRVAL1" in hdu.header and step is not None:
+                pixels = np.arange(len(flux)) + 1 - hdu.header.get("CRPIX1", 1)
+                xaxis = hdu.header["CRVAL1"] + step * pixels
+    return Spectrum(xaxis=xaxis, flux=flux, header=header, calibrated=xaxis is not None)
+
+
+class PrefetchLoader(object):
+    """Async iterator of spectra read ahead on a thread pool.
+
+    Up to ``prefetch`` files are read or held ahead of the consumer. A new
+    read only starts when the consumer takes a spectrum, so a slow consumer
+    applies backpressure instead of filling memory. The spectra are
+    returned in the order of the paths.
+
+    Parameters
+    ----------
+    paths: iterable of str
+        Files to read. Can be a lazy iterable.
+    reader: callable
+        Function of a path returning a Spectrum. Default ``read_fits``.
+    prefetch: int
+        Maximum number of spectra read ahead.
+    max_workers: int, None
+        Number of concurrent reads. Default is ``prefetch``.
+    executor: Executor, None
+        Executor to read with instead of an own thread pool.
+
+    """
+
+    def __init__(
+        self,
+        paths: Iterable[str],
+        reader: Callable[[str], Spectrum] = read_fits,
+        prefetch: int = 4,
+        max_workers: Optional[int] = None,
+        executor: Optional[Executor] = None,
+    ) -> None:
+        """Set up the loader. Reading starts on the first iteration."""
+        if prefetch < 1:
+            raise ValueError("prefetch must be at least 1.")
+        self._paths = iter(paths)
+        self.reader = reader
+        self.prefetch = prefetch
+        self._own_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers or prefetch)
+        self._pending = deque()  # type: Deque[Any]
+
+    def _fill(self) -> None:
+        """Start reads until prefetch spectra are in flight or ready."""
+        loop = asyncio.get_running_loop()
+        while len(self._pending) < self.prefetch:
+            try:
+                path = next(self._paths)
+            except StopIteration:
+                return
+            self._pending.append(
+                loop.run_in_executor(self._executor, self.reader, path)
+            )
+
+    def __aiter__(self) -> "PrefetchLoader":
+        return self
+
+    async def __anext__(self) -> Spectrum:
+        self._fill()
+        if not self._pending:
+            await self.aclose()
+            raise StopAsyncIteration
+        future = self._pending.popleft()
+        # Keep the window full while the consumer works on this spectrum.
+        self._fill()
+        return await future
+
+    async def aclose(self) -> None:
+        """Cancel the outstanding reads and release the thread pool."""
+        while self._pending:
+            self._pending.popleft().cancel()
+        self._paths = iter(())
+        if self._own_executor:
+            self._executor.shutdown(wait=False)
+
+    async def __aenter__(self) -> "PrefetchLoader":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
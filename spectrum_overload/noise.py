@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+"""Monte Carlo noise realizations of a spectrum.
+
+Uncertainties of quantities measured from a spectrum, e.g. the RV from a
+cross-correlation, are estimated by repeating the measurement on many noisy
+realizations of the spectrum. ``noise_realizations`` draws them as one 2D
+stack of flux arrays, and ``iter_noise_realizations`` in chunks of rows so
+that many realizations of long spectra never need to be in memory at once.
+
+Each realization has its own random stream spawned from a single
+``np.random.SeedSequence``, so realization i is the same for a given seed
+however the realizations are chunked, and independent of the global
+``np.random`` state. Requires numpy 1.17 or later.
+
+Examples
+--------
+>>> stack = noise_realizations(spectrum, 1000, snr=100, seed=42)
+>>> rvs = monte_carlo(spectrum, measure_rv, 10000, snr=100, seed=42)
+>>> rv_error = np.std(rvs)
+
+"""
+from typing import Any, Callable, Iterator, List, Optional, Union
+
+import numpy as np
+from numpy import ndarray
+
+from spectrum_overload.spectrum import Spectrum
+
+DEFAULT_CHUNK_SIZE = 256
+
+SeedType = Optional[Union[int, np.random.SeedSequence]]
+
+
+def _noise_sigma(
+    spectrum: Spectrum,
+    snr: Optional[float] = None,
+    sigma: Optional[Union[float, ndarray]] = None,
+) -> Union[float, ndarray]:
+    """Standard deviation of the noise from the snr or sigma."""
+    if (snr is None) == (sigma is None):
+        raise ValueError("Give exactly one of snr or sigma.")
+    if snr is not None:
+        # The same noise level as Spectrum.add_noise.
+        return np.abs(spectrum.flux) / snr
+    if np.ndim(sigma) and len(sigma) != len(spectrum):
+        raise ValueError("The sigma array must be the same length as the spectrum.")
+    return sigma
+
+
+def iter_noise_realizations(
+    spectrum: Spectrum,
+    n: int,
+    snr: Optional[float] = None,
+    sigma: Optional[Union[float, ndarray]] = None,
+    seed: SeedType = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[ndarray]:
+    """Noisy realizations of the flux in chunks of rows.
+
+    Parameters
+    ----------
+    spectrum: Spectrum
+        Spectrum to add noise to.
+    n: int
+        Number of realizations.
+    snr: float, None
+        Signal-to-noise ratio, the noise sigma is flux / snr.
+    sigma: float, ndarray, None
+        Noise sigma of all or of each pixel. Give either snr or sigma.
+    seed: int, SeedSequence, None
+        Seed of the random streams. None for fresh entropy.
+    chunk_size: int
+        Number of realizations per chunk.
+
+    Yields
+    ------
+    chunk: ndarray
+        Realizations of shape (rows, len(spectrum)), at most chunk_size
+        rows, n rows in total.
+
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1.")
+    noise_sigma = _noise_sigma(spectrum, snr=snr, sigma=sigma)
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    streams = seed.spawn(n)
+    flux = np.asarray(spectrum.flux, dtype=float)
+
+    for start in range(0, n, chunk_size):
+        chunk_streams = streams[start : start + chunk_size]
+        chunk = np.empty((len(chunk_streams), len(flux)))
+        for row, stream in zip(chunk, chunk_streams):
+            np.random.Generator(np.random.PCG64(stream)).standard_normal(out=row)
+        chunk *= noise_sigma
+        chunk += flux
+        yield chunk
+
+
+def noise_realizations(
+    spectrum: Spectrum,
+    n: int,
+    snr: Optional[float] = None,
+    sigma: Optional[Union[float, ndarray]] = None,
+    seed: SeedType = None,
+) -> ndarray:
+    """Stack of noisy realizations of the flux.
+
+    Parameters are as for ``iter_noise_realizations``.
+
+    Returns
+    -------
+    stack: ndarray
+        Realizations of shape (n, len(spectrum)).
+
+    """
+    chunks = list(
+        iter_noise_realizations(
+            spectrum, n, snr=snr, sigma=sigma, seed=seed, chunk_size=max(n, 1)
+        )
+    )
+    return chunks[0] if chunks else np.empty((0, len(spectrum)))
+
+
+def monte_carlo(
+    spectrum: Spectrum,
+    func: Callable[[Spectrum], Any],
+    n: int,
+    snr: Optional[float] = None,
+    sigma: Optional[Union[float, ndarray]] = None,
+    seed: SeedType = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> List[Any]:
+    """Apply a function to noisy realizations of a spectrum.
+
+    Only chunk_size realizations are in memory at a time. The realizations
+    share the xaxis, header and mask of spectrum.
+
+    Parameters
+    ----------
+    spectrum: Spectrum
+        Spectrum to add noise to.
+    func: callable
+        Function of a Spectrum, e.g. measuring an RV.
+    n, snr, sigma, seed, chunk_size:
+        As for ``iter_noise_realizations``.
+
+    Returns
+    -------
+    results: list
+        Result of func for each realization.
+
+    """
+    results = []  # type: List[Any]
+    for chunk in iter_noise_realizations(
+        spectrum, n, snr=snr, sigma=sigma, seed=seed, chunk_size=chunk_size
+    ):
+        for flux in chunk:
+            results.append(
+                func(
+                    Spectrum(
+                        xaxis=spectrum.xaxis,
+                        flux=flux,
+                        calibrated=spectrum.calibrated,
+                        header=spectrum.header,
+                        interp_method=spectrum.interp_method,
+                        mask=spectrum.mask,
+                        align=spectrum.align,
+                    )
+                )
+            )
+    return results
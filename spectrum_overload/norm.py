@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import logging
-from typing import Optional, Tuple
+from typing import Callable, Optional, Tuple
 
 import numpy as np
 from numpy import ndarray
@@ -45,6 +45,7 @@ def continuum(
     degree: Optional[int] = None,
     nbins: int = 50,
     ntop: int = 20,
+    mask: Optional[ndarray] = None,
 ) -> ndarray:
     """Fit continuum of flux.
 
@@ -60,6 +61,9 @@ def continuum(
         Number of bins to separate the spectrum into.
     ntop: int
         Number of highest points in bin to take median of.
+    mask: ndarray, None
+        Boolean array of pixels to exclude from the fit. The continuum is
+        still evaluated at every wavelength.
     """
     if method not in ("scalar", "linear", "quadratic", "cubic", "poly", "exponential"):
         raise ValueError("Incorrect method for polynomial fit.")
@@ -74,23 +78,58 @@ def continuum(
     if method == "poly" and degree is None:
         raise ValueError("No degree specified for continuum method 'poly'.")
 
-    if np.any(np.isnan(wave)) or np.any(np.isnan(flux)):
-        raise ValueError("There are Nan values in spectrum. Please remove first.")
-
     org_wave = wave[:]
+    if mask is not None:
+        good = ~np.asarray(mask, dtype=bool)
+        wave, flux = wave[good], flux[good]
+
+    if np.any(np.isnan(wave)) or np.any(np.isnan(flux)):
+        raise ValueError(
+            "There are Nan values in spectrum. Please remove or mask first."
+        )
 
     # Get continuum value in chunked sections of spectrum.
     wave_points, flux_points = get_continuum_points(wave, flux, nbins=nbins, ntop=ntop)
 
+    return continuum_function(wave_points, flux_points, method=method, degree=degree)(
+        org_wave
+    )
+
+
+def continuum_function(
+    wave_points: ndarray,
+    flux_points: ndarray,
+    method: str = "scalar",
+    degree: Optional[int] = None,
+) -> Callable[[ndarray], ndarray]:
+    """Fit a continuum function to continuum points.
+
+    Parameters
+    ----------
+    wave_points: ndarray
+        Wavelength of the continuum points.
+    flux_points: ndarray
+        Flux of the continuum points.
+    method: str ("scalar")
+        The function type, valid functions are "scalar", "linear",
+        "quadratic", "cubic", "poly", and "exponential".
+        Default "scalar".
+    degree: int, None
+       Degree of polynomial when method="poly". Default = None.
+
+    Returns
+    -------
+    func: callable
+        Function that evaluates the continuum at given wavelengths.
+    """
     poly_degree = {"scalar": 0, "linear": 1, "quadratic": 2, "cubic": 3, "poly": degree}
+    if method not in poly_degree and method != "exponential":
+        raise ValueError("Incorrect method for polynomial fit.")
 
     if method == "exponential":
         z = np.polyfit(wave_points, np.log(flux_points), deg=1, w=np.sqrt(flux_points))
         p = np.poly1d(z)
-        continuum_fit = np.exp(p(org_wave))  # Un-log the y values.
+        return lambda wave: np.exp(p(wave))  # Un-log the y values.
     else:
         z = np.polyfit(wave_points, flux_points, deg=poly_degree[method])
-        p = np.poly1d(z)
-        continuum_fit = p(org_wave)
-
-    return continuum_fit
+        return np.poly1d(z)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""Keplerian radial velocity model of binary components.
+
+The Kepler equation is solved with a Newton iteration on whole arrays, so
+the radial velocities of every epoch, and of a grid of orbital parameters,
+are computed together.
+
+Orbital parameters are given as a dictionary with the keys
+
+=========  ====================================================
+``period``  Orbital period [days].
+``tau``     Time of periastron passage [MJD].
+``e``       Eccentricity.
+``omega``   Argument of periastron of the primary [degrees].
+``k1``      Semi-amplitude of the primary [km/s].
+``k2``      Semi-amplitude of the secondary [km/s]. (Optional)
+``gamma``   Systemic velocity [km/s]. (Optional, default 0)
+=========  ====================================================
+
+Any value can be an array that broadcasts against the times, e.g. a
+column of periods with shape (n, 1) evaluates n orbits at all epochs.
+"""
+from typing import Any, Dict, Union
+
+import numpy as np
+from numpy import ndarray
+
+
+def solve_kepler(
+    mean_anomaly: Union[float, ndarray],
+    e: Union[float, ndarray],
+    tol: float = 1e-12,
+    maxiter: int = 50,
+) -> ndarray:
+    """Solve Kepler's equation M = E - e sin(E) for the eccentric anomaly.
+
+    Parameters
+    ----------
+    mean_anomaly: float, ndarray
+        Mean anomaly [radians].
+    e: float, ndarray
+        Eccentricity, 0 <= e < 1. Broadcasts against mean_anomaly.
+    tol: float
+        Convergence tolerance on the eccentric anomaly [radians].
+    maxiter: int
+        Maximum number of Newton iterations.
+
+    Returns
+    -------
+    E: ndarray
+        Eccentric anomaly [radians].
+
+    """
+    mean_anomaly, e = np.broadcast_arrays(
+        np.asarray(mean_anomaly, dtype=float), np.asarray(e, dtype=float)
+    )
+    if np.any((e < 0) | (e >= 1)):
+        raise ValueError("Eccentricity must be in the range 0 <= e < 1.")
+    mean_anomaly = np.mod(mean_anomaly, 2 * np.pi)
+    # Starting at pi converges for all eccentricities.
+    E = np.where(e > 0.8, np.pi, mean_anomaly + e * np.sin(mean_anomaly))
+    for __ in range(maxiter):
+        delta = (E - e * np.sin(E) - mean_anomaly) / (1 - e * np.cos(E))
+        E = E - delta
+        if np.all(np.abs(delta) < tol):
+            break
+    return E
+
+
+def true_anomaly(times: ndarray, period: ndarray, tau: ndarray, e: ndarray) -> ndarray:
+    """True anomaly [radians] at the given times."""
+    mean_anomaly = 2 * np.pi * (np.asarray(times) - tau) / period
+    E = solve_kepler(mean_anomaly, e)
+    return 2 * np.arctan2(
+        np.sqrt(1 + e) * np.sin(E / 2), np.sqrt(1 - e) * np.cos(E / 2)
+    )
+
+
+def radial_velocity(
+    times: Union[float, ndarray], params: Dict[str, Any], component: str = "primary"
+) -> ndarray:
+    """Radial velocity of a binary component at the given times.
+
+    Parameters
+    ----------
+    times: float, ndarray
+        Observation times [MJD].
+    params: dict
+        Orbital parameters, see the module documentation.
+    component: str
+        "primary" or "secondary".
+
+    Returns
+    -------
+    rv: ndarray
+        Radial velocities [km/s], broadcast over times and parameters.
+
+    """
+    if component not in ("primary", "secondary"):
+        raise ValueError("Component must be one of 'primary' or 'secondary'.")
+    try:
+        period, tau, e = params["period"], params["tau"], params["e"]
+        omega = np.deg2rad(params["omega"])
+        k = params["k1"] if component == "primary" else -params["k2"]
+    except KeyError as err:
+        raise KeyError("Orbital parameter {} is missing.".format(err))
+    gamma = params.get("gamma", 0)
+
+    nu = true_anomaly(times, period, tau, e)
+    return gamma + k * (np.cos(nu + omega) + e * np.cos(omega))
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+"""Parallel processing of many spectra.
+
+Sending a Spectrum to a worker process pickles its full xaxis and flux,
+which for large spectra costs more than the work itself. ``parallel_map``
+instead copies the xaxis and flux of all spectra once into
+``multiprocessing.shared_memory`` blocks. Workers only receive the index of
+a spectrum, build a Spectrum on read-only views of the shared buffers and
+write their result into a preallocated shared output block. Only headers
+travel through pickling, along with the masks of masked spectra. Requires
+Python 3.8 or later.
+
+``interpolate_spectra`` interpolates spectra on a thread pool instead,
+which needs no pickling at all as the interpolation releases the GIL.
+
+Examples
+--------
+>>> broadened = parallel_map(partial(instrument_broaden, R=50000), spectra)
+>>> ccfs = parallel_map(lambda s: s.crosscorr_rv(template, -50, 50, 1)[1],
+...                     spectra, out_length=100)
+>>> aligned = interpolate_spectra(spectra, reference)
+
+"""
+import multiprocessing
+import os
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from numpy import ndarray
+
+from spectrum_overload.spectrum import Spectrum
+
+# State of a worker process, set by _init_worker.
+_worker = {}  # type: dict
+
+
+def _views(blocks: Sequence[SharedMemory], sizes: Sequence[int]) -> List[ndarray]:
+    """Float arrays on the shared memory blocks."""
+    return [
+        np.ndarray((size,), dtype=float, buffer=block.buf)
+        for block, size in zip(blocks, sizes)
+    ]
+
+
+def _init_worker(
+    func: Callable, blocks: Sequence[SharedMemory], sizes: Sequence[int], meta: List
+) -> None:
+    """Keep the function and views of the shared buffers in the worker."""
+    _worker["func"] = func
+    _worker["blocks"] = blocks  # Keep the blocks alive with their views.
+    _worker["views"] = _views(blocks, sizes)
+    _worker["meta"] = meta
+
+
+def _run(i: int) -> Optional[Tuple[Any, bool, str]]:
+    """Apply the function to spectrum i, writing into the output buffers."""
+    xaxis, flux, out_xaxis, out_flux = _worker["views"]
+    start, stop, out_start, out_stop, header, calibrated, interp, mask, align = (
+        _worker["meta"][i]
+    )
+    spec_xaxis = xaxis[start:stop]
+    spec_flux = flux[start:stop]
+    spec_xaxis.flags.writeable = False
+    spec_flux.flags.writeable = False
+    spectrum = Spectrum(
+        xaxis=spec_xaxis,
+        flux=spec_flux,
+        header=header,
+        calibrated=calibrated,
+        interp_method=interp,
+        mask=mask,
+        align=align,
+    )
+
+    result = _worker["func"](spectrum)
+    values = result.flux if isinstance(result, Spectrum) else np.asarray(result)
+    if len(values) != out_stop - out_start:
+        raise ValueError(
+            "Result of length {0} does not match the output length {1}.".format(
+                len(values), out_stop - out_start
+            )
+        )
+    out_flux[out_start:out_stop] = values
+    if isinstance(result, Spectrum):
+        out_xaxis[out_start:out_stop] = result.xaxis
+        return (
+            result.header,
+            result.calibrated,
+            result.interp_method,
+            result.mask,
+            result.align,
+        )
+    return None
+
+
+def parallel_map(
+    func: Callable[[Spectrum], Union[Spectrum, ndarray]],
+    spectra: Sequence[Spectrum],
+    n_jobs: Optional[int] = None,
+    out_length: Optional[int] = None,
+    chunksize: int = 1,
+) -> List[Union[Spectrum, ndarray]]:
+    """Apply a function to many spectra in worker processes.
+
+    Parameters
+    ----------
+    func: callable
+        Function of a Spectrum returning a Spectrum or an array, e.g.
+        ``partial(chunked.normalize, method="linear")``. The input arrays
+        are read-only. With the "fork" start method func need not be
+        picklable.
+    spectra: list of Spectrum
+        Spectra to process.
+    n_jobs: int, None
+        Number of worker processes. Default is the number of CPUs.
+        With 1 the spectra are processed in this process.
+    out_length: int, None
+        Length of every result. Default is the length of each input.
+    chunksize: int
+        Number of spectra sent to a worker at a time.
+
+    Returns
+    -------
+    results: list of Spectrum or ndarray
+        Result of each spectrum. Spectra keep the header and calibration
+        returned by func.
+
+    """
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    if n_jobs == 1 or len(spectra) == 0:
+        return [func(spec) for spec in spectra]
+
+    lengths = np.array([len(spec) for spec in spectra])
+    out_lengths = lengths if out_length is None else np.full(len(spectra), out_length)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    out_offsets = np.concatenate(([0], np.cumsum(out_lengths)))
+    sizes = [offsets[-1], offsets[-1], out_offsets[-1], out_offsets[-1]]
+
+    blocks = []  # type: List[SharedMemory]
+    views = xaxis = flux = out_xaxis = out_flux = None
+    try:
+        for size in sizes:
+            blocks.append(SharedMemory(create=True, size=max(size, 1) * 8))
+        views = _views(blocks, sizes)
+        xaxis, flux, out_xaxis, out_flux = views
+        for i, spec in enumerate(spectra):
+            xaxis[offsets[i] : offsets[i + 1]] = spec.xaxis
+            flux[offsets[i] : offsets[i + 1]] = spec.flux
+        meta = [
+            (
+                offsets[i],
+                offsets[i + 1],
+                out_offsets[i],
+                out_offsets[i + 1],
+                spec.header,
+                spec.calibrated,
+                spec.interp_method,
+                spec.mask,
+                spec.align,
+            )
+            for i, spec in enumerate(spectra)
+        ]
+
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        with context.Pool(
+            n_jobs, initializer=_init_worker, initargs=(func, blocks, sizes, meta)
+        ) as pool:
+            returned = pool.map(_run, range(len(spectra)), chunksize=chunksize)
+
+        # Copy out of the shared memory once, before it is released.
+        result_xaxis, result_flux = out_xaxis.copy(), out_flux.copy()
+    finally:
+        # The views must be released before the blocks can be closed.
+        views = xaxis = flux = out_xaxis = out_flux = None
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    results = []  # type: List[Union[Spectrum, ndarray]]
+    for i, info in enumerate(returned):
+        block = slice(out_offsets[i], out_offsets[i + 1])
+        if info is None:
+            results.append(result_flux[block])
+        else:
+            header, calibrated, interp_method, mask, align = info
+            results.append(
+                Spectrum(
+                    xaxis=result_xaxis[block],
+                    flux=result_flux[block],
+                    header=header,
+                    calibrated=calibrated,
+                    interp_method=interp_method,
+                    mask=mask,
+                    align=align,
+                )
+            )
+    return results
+
+
+def interpolate_spectra(
+    spectra: Sequence[Spectrum],
+    reference: Union[Spectrum, ndarray],
+    n_jobs: Optional[int] = None,
+    **kwargs
+) -> List[Spectrum]:
+    """Interpolate many spectra to a reference xaxis on a thread pool.
+
+    Uses the non-mutating ``Spectrum.interpolated``, so the input spectra
+    are unchanged and may be shared between threads.
+
+    Parameters
+    ----------
+    spectra: list of Spectrum
+        Spectra to interpolate.
+    reference: Spectrum, ndarray
+        The reference xaxis values to interpolate to.
+    n_jobs: int, None
+        Number of threads. Default is the number of CPUs.
+    kwargs:
+        Passed to ``Spectrum.interpolated``, e.g. kind.
+
+    Returns
+    -------
+    results: list of Spectrum
+        Interpolated spectra, in the same order.
+
+    """
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    if n_jobs == 1:
+        return [spec.interpolated(reference, **kwargs) for spec in spectra]
+    with ThreadPoolExecutor(n_jobs) as executor:
+        return list(
+            executor.map(lambda spec: spec.interpolated(reference, **kwargs), spectra)
+        )
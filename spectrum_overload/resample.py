@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+
+"""Resampling of spectra with precomputed sparse matrices.
+
+Resampling flux from one grid onto another is linear in the flux, so it is
+a sparse matrix that only depends on the two grids. The matrices are
+computed once per (source, target) pair, keyed by the fingerprints of the
+grids, and kept in a small least recently used cache. Resampling many
+spectra sharing a source grid is then a single sparse matrix product.
+
+Examples
+--------
+>>> resampler = Resampler(native_xaxis, target_xaxis, kind="cubic")
+>>> stack = resampler(np.vstack([spec.flux for spec in spectra]))
+
+"""
+from collections import OrderedDict
+from typing import Any, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from numpy import ndarray
+from scipy import sparse
+from scipy.sparse.linalg import splu
+
+from spectrum_overload.spectrum import Spectrum, _array_fingerprint
+
+CACHE_SIZE = 32
+
+_cache = OrderedDict()  # type: OrderedDict
+
+
+def _grid(reference: Union[Spectrum, ndarray]) -> Tuple[ndarray, Any]:
+    """The xaxis of a reference and the fingerprint of its values.
+
+    The cached ``Spectrum.xaxis_fingerprint`` is not used, as copies share
+    the xaxis array and an in-place change through one copy leaves the
+    fingerprint of the others stale.
+    """
+    if isinstance(reference, Spectrum):
+        reference = reference.xaxis
+    if isinstance(reference, np.ndarray):
+        return reference, _array_fingerprint(reference)
+    raise TypeError(
+        "Cannot resample with the given object of type {}".format(type(reference))
+    )
+
+
+def _cached(key: Tuple, build) -> Any:
+    """Get the cached value of key, building and storing it if missing."""
+    try:
+        _cache.move_to_end(key)
+        return _cache[key]
+    except KeyError:
+        value = build()
+        _cache[key] = value
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+        return value
+
+
+def clear_cache() -> None:
+    """Clear the cache of resampling matrices."""
+    _cache.clear()
+
+
+def bin_edges(centres: ndarray) -> ndarray:
+    """Edges of the bins around ascending bin centres.
+
+    Inner edges are halfway between the centres, the outer edges are as far
+    from the first and last centres as the neighbouring inner edges.
+    """
+    centres = np.asarray(centres, dtype=float)
+    if len(centres) < 2:
+        raise ValueError("Need at least two bins to find their edges.")
+    if np.any(np.diff(centres) <= 0):
+        raise ValueError("The bin centres must be strictly increasing.")
+    mid = (centres[1:] + centres[:-1]) / 2
+    return np.concatenate(
+        ([2 * centres[0] - mid[0]], mid, [2 * centres[-1] - mid[-1]])
+    )
+
+
+def overlap_matrix(source: ndarray, target: ndarray) -> sparse.csr_matrix:
+    """Flux-conserving rebinning matrix from source to target bin centres.
+
+    Element (i, j) is the fraction of target bin i covered by source bin j.
+    Rows of target bins not fully covered by the source are empty.
+
+    Parameters
+    ----------
+    source: ndarray
+        Ascending bin centres of the flux.
+    target: ndarray
+        Ascending bin centres to rebin onto.
+
+    Returns
+    -------
+    matrix: scipy.sparse.csr_matrix
+        Matrix of shape (len(target), len(source)).
+
+    """
+    source_edges = bin_edges(source)
+    target_edges = bin_edges(target)
+    lower = max(source_edges[0], target_edges[0])
+    upper = min(source_edges[-1], target_edges[-1])
+    edges = np.union1d(source_edges, target_edges)
+    edges = edges[(edges >= lower) & (edges <= upper)]
+
+    # Every segment between consecutive edges lies in one bin of each grid.
+    mid = (edges[1:] + edges[:-1]) / 2
+    columns = np.searchsorted(source_edges, mid) - 1
+    rows = np.searchsorted(target_edges, mid) - 1
+    widths = np.diff(target_edges)
+    matrix = sparse.csr_matrix(
+        (np.diff(edges) / widths[rows], (rows, columns)),
+        shape=(len(target), len(source)),
+    )
+
+    partial = np.asarray(matrix.sum(axis=1)).ravel() < 1 - 1e-9
+    if np.any(partial):
+        matrix = sparse.diags((~partial).astype(float)) @ matrix
+        matrix.eliminate_zeros()
+    return matrix.tocsr()
+
+
+def linear_matrix(source: ndarray, target: ndarray) -> sparse.csr_matrix:
+    """Linear interpolation matrix from source to target positions.
+
+    Rows of targets outside of the source are empty.
+    """
+    source = np.asarray(source, dtype=float)
+    target = np.asarray(target, dtype=float)
+    inside = np.flatnonzero((target >= source[0]) & (target <= source[-1]))
+    j = np.searchsorted(source, target[inside], side="right") - 1
+    j = np.clip(j, 0, len(source) - 2)
+    weight = (target[inside] - source[j]) / (source[j + 1] - source[j])
+    return sparse.csr_matrix(
+        (
+            np.concatenate((1 - weight, weight)),
+            (np.concatenate((inside, inside)), np.concatenate((j, j + 1))),
+        ),
+        shape=(len(target), len(source)),
+    )
+
+
+def _bspline_matrix(
+    x: ndarray,
+    knots: ndarray,
+    k: int,
+    rows: Optional[ndarray] = None,
+    nrows: Optional[int] = None,
+) -> sparse.csr_matrix:
+    """Sparse matrix of the B-spline basis functions evaluated at x.
+
+    The k + 1 non-zero basis functions at each x are found with the
+    Cox-de Boor recursion, vectorized over x. Row r of the matrix is for
+    x[r], or row rows[r] of a matrix with nrows rows if given.
+    """
+    n_coeffs = len(knots) - k - 1
+    interval = np.searchsorted(knots, x, side="right") - 1
+    interval = np.clip(interval, k, n_coeffs - 1)
+    left = np.empty((k + 1, len(x)))
+    right = np.empty((k + 1, len(x)))
+    basis = np.zeros((k + 1, len(x)))
+    basis[0] = 1.0
+    for j in range(1, k + 1):
+        left[j] = x - knots[interval + 1 - j]
+        right[j] = knots[interval + j] - x
+        saved = np.zeros(len(x))
+        for r in range(j):
+            temp = basis[r] / (right[r + 1] + left[j - r])
+            basis[r] = saved + right[r + 1] * temp
+            saved = left[j - r] * temp
+        basis[j] = saved
+
+    if rows is None:
+        rows, nrows = np.arange(len(x)), len(x)
+    columns = interval[np.newaxis, :] - k + np.arange(k + 1)[:, np.newaxis]
+    return sparse.csr_matrix(
+        (basis.ravel(), (np.tile(rows, k + 1), columns.ravel())),
+        shape=(nrows, n_coeffs),
+    )
+
+
+def cubic_operator(source: ndarray, target: ndarray) -> Tuple[sparse.csr_matrix, Any]:
+    """Sparse factors of the not-a-knot cubic spline interpolation.
+
+    The spline through all points is the same as that of
+    ``InterpolatedUnivariateSpline(k=3)`` used by ``spline_interpolate_to``.
+    Its B-spline coefficients solve a banded collocation system, which is
+    factorized once, and the target values are a sparse product with the
+    coefficients. Rows of targets outside of the source are empty.
+
+    Returns
+    -------
+    evaluation: scipy.sparse.csr_matrix
+        B-spline basis at the targets, shape (len(target), len(source)).
+    solver: scipy.sparse.linalg.SuperLU
+        LU factorization of the collocation matrix.
+
+    """
+    source = np.asarray(source, dtype=float)
+    target = np.asarray(target, dtype=float)
+    if len(source) < 4:
+        raise ValueError("Need at least 4 points for cubic interpolation.")
+    k = 3
+    knots = np.concatenate(
+        ([source[0]] * (k + 1), source[2:-2], [source[-1]] * (k + 1))
+    )
+    collocation = _bspline_matrix(source, knots, k).tocsc()
+    inside = np.flatnonzero((target >= source[0]) & (target <= source[-1]))
+    evaluation = _bspline_matrix(target[inside], knots, k, inside, len(target))
+    return evaluation, splu(collocation)
+
+
+class Resampler(object):
+    """Resampling from a source grid to a target grid as a sparse operator.
+
+    The operator is built once per pair of grids and kind, and cached by
+    the fingerprints of the grids, so creating a Resampler for grids seen
+    before is cheap. Applying it to a single flux array or a 2D stack of
+    flux arrays is one sparse product.
+
+    Parameters
+    ----------
+    source_xaxis: Spectrum, ndarray
+        Ascending xaxis of the flux to resample, or a Spectrum with it.
+    target_xaxis: Spectrum, ndarray
+        Ascending xaxis to resample onto, or a Spectrum with it.
+    kind: str
+        "linear" (as ``interpolate1d_to``), "cubic" (as
+        ``spline_interpolate_to``) or "rebin" (as ``rebin_to``).
+
+    """
+
+    kinds = ("linear", "cubic", "rebin")
+
+    def __init__(
+        self,
+        source_xaxis: Union[Spectrum, ndarray],
+        target_xaxis: Union[Spectrum, ndarray],
+        kind: str = "linear",
+    ) -> None:
+        """Build or look up the operator between the grids."""
+        if kind not in self.kinds:
+            raise ValueError("Kind must be one of 'linear', 'cubic' or 'rebin'.")
+        self.kind = kind
+        self.source, source_key = _grid(source_xaxis)
+        self.target, target_key = _grid(target_xaxis)
+        self._matrix, self._solver = _cached(
+            (kind, source_key, target_key), self._build
+        )
+        # Targets without any contribution are outside of the source.
+        self._outside = np.diff(self._matrix.indptr) == 0
+
+    def _build(self) -> Tuple[sparse.csr_matrix, Optional[Any]]:
+        if self.kind == "linear":
+            return linear_matrix(self.source, self.target), None
+        elif self.kind == "cubic":
+            return cubic_operator(self.source, self.target)
+        return overlap_matrix(self.source, self.target), None
+
+    def __call__(self, flux: Union[Spectrum, ndarray]) -> Union[Spectrum, ndarray]:
+        """Resample flux of shape (len(source),) or (spectra, len(source)).
+
+        A Spectrum is resampled into a new Spectrum on the target grid.
+        Targets outside of the source, or bins not fully covered for
+        "rebin", are NaN.
+        """
+        if isinstance(flux, Spectrum):
+            return Spectrum(
+                xaxis=self.target,
+                flux=self(flux.flux),
+                calibrated=flux.calibrated,
+                header=flux.header.copy(),
+                interp_method=flux.interp_method,
+                align=flux.align,
+            )
+        flux = np.asarray(flux, dtype=float)
+        if flux.shape[-1] != len(self.source):
+            raise ValueError("The flux must be the same length as the source xaxis.")
+        values = flux.T
+        if self._solver is not None:
+            values = self._solver.solve(np.ascontiguousarray(values))
+        resampled = np.asarray(self._matrix @ values).T
+        resampled[..., self._outside] = np.nan
+        return resampled
+
+
+def rebin_flux(
+    source: Union[Spectrum, ndarray], flux: ndarray, target: Union[Spectrum, ndarray]
+) -> ndarray:
+    """Flux-conserving rebinning of one or many flux arrays.
+
+    Parameters
+    ----------
+    source: Spectrum, ndarray
+        Ascending xaxis of the flux, or a Spectrum with it.
+    flux: ndarray
+        Flux of shape (len(source),) or (spectra, len(source)).
+    target: Spectrum, ndarray
+        Ascending xaxis to rebin onto, or a Spectrum with it.
+
+    Returns
+    -------
+    rebinned: ndarray
+        Flux on the target, shape (len(target),) or (spectra, len(target)).
+        Bins not fully covered by the source are NaN.
+
+    """
+    return Resampler(source, target, kind="rebin")(flux)
+
+
+def rebin(
+    spectra: Sequence[Spectrum], reference: Union[Spectrum, ndarray]
+) -> List[Spectrum]:
+    """Flux-conserving rebinning of many spectra onto a reference grid.
+
+    Spectra sharing the same xaxis are rebinned together with a single
+    sparse matrix product. Masks are rebinned like ``Spectrum.rebin_to``.
+
+    Parameters
+    ----------
+    spectra: list of Spectrum
+        Spectra to rebin.
+    reference: Spectrum, ndarray
+        Grid to rebin onto.
+
+    Returns
+    -------
+    rebinned: list of Spectrum
+        New spectra on the reference grid, in the same order.
+
+    """
+    target = reference.xaxis if isinstance(reference, Spectrum) else reference
+    groups = []  # type: List[List[int]]
+    for i, spec in enumerate(spectra):
+        for group in groups:
+            first = spectra[group[0]]
+            if len(first) == len(spec) and first.same_xaxis(spec):
+                group.append(i)
+                break
+        else:
+            groups.append([i])
+
+    rebinned = [None] * len(spectra)  # type: List[Any]
+    for group in groups:
+        first = spectra[group[0]]
+        rows = []
+        for i in group:
+            spec = spectra[i]
+            if spec.mask is None:
+                rows.append(spec.flux)
+            else:
+                # Rebin the mask along with the zeroed flux, as in rebin_to.
+                rows.extend((np.where(spec.mask, 0, spec.flux), spec.mask))
+        values = iter(rebin_flux(first, np.vstack(rows), reference))
+        for i in group:
+            spec = spectra[i]
+            flux = next(values)
+            rebinned[i] = Spectrum(
+                xaxis=target,
+                flux=flux,
+                calibrated=spec.calibrated,
+                header=spec.header.copy(),
+                interp_method=spec.interp_method,
+                align=spec.align,
+                mask=None if spec.mask is None else next(values) > 0,
+            )
+    return rebinned
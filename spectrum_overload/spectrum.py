@@ -6,7 +6,11 @@
 from __future__ import division, print_function
 
 import copy
+import hashlib
+import json
 import logging
+import pickle
+import struct
 from typing import Any, Dict, List, Optional, Tuple, Union
 
 import matplotlib.pyplot as plt
@@ -16,8 +20,11 @@ from numpy import ndarray
 from PyAstronomy import pyasl
 from scipy.interpolate import InterpolatedUnivariateSpline, interp1d
 
+import spectrum_overload.kernels as kernels
 import spectrum_overload.norm as norm
 
+ALIGN_MODES = ("left", "intersection", "union")
+
 
 class Spectrum(object):
     """Spectrum class to represent and manipulate astronomical spectra.
@@ -32,9 +39,23 @@ class Spectrum(object):
         Flag to indicate calibration state. (Default = True.)
     header: astropy.Header, dict-like
         Header information of observation.
+    mask: np.ndarray, None
+        Boolean array of bad pixels, True where the flux is not to be used.
+        Masked pixels are skipped by the operators, interpolation,
+        ``continuum`` and ``instrument_broaden`` without removing them, so
+        the grid is unchanged. (Default = None, no masked pixels.)
+    align: str
+        Grid of the result of arithmetic with a Spectrum on another xaxis.
+        "left" uses the xaxis of self, with NaN where the spectra do not
+        overlap. "intersection" only computes and returns the overlap of the
+        xaxis. "union" also returns the pixels of either spectrum outside
+        of the other, as NaN. (Default = "left".)
 
     """
 
+    # Default for spectra pickled before the align attribute existed.
+    _align = "left"
+
     def __init__(
         self,
         *,
@@ -42,9 +63,13 @@ class Spectrum(object):
         flux: Optional[Union[ndarray, List[Union[int, float]]]] = None,
         calibrated: bool = True,
         header: Optional[Union[Header, Dict[str, Any]]] = None,
-        interp_method: str = "spline"
+        interp_method: str = "spline",
+        mask: Optional[Union[ndarray, List[bool]]] = None,
+        align: str = "left"
     ) -> None:
         """Initialise a Spectrum object."""
+        self._xaxis_fingerprint = None  # type: Optional[Tuple[str, Tuple[int, ...], str]]
+        self._runs = None  # type: Optional[Tuple[ndarray, ndarray]]
 
         # Some checks before creating class
         # if not isinstance(flux, (list, np.ndarray, None)):
@@ -81,6 +106,9 @@ class Spectrum(object):
         else:
             self.header = header  # Access header with a dictionary call.
         self.interp_method = interp_method
+        self._mask = None  # type: Optional[ndarray]
+        self.mask = mask
+        self.align = align
 
     @property
     def interp_method(self):
@@ -103,6 +131,30 @@ class Spectrum(object):
                 "Warning the interpolation method was not valid. ['linear', 'spline'] are the valid options."
             )
 
+    @property
+    def align(self) -> str:
+        """Getter for the align attribute."""
+        return self._align
+
+    @align.setter
+    def align(self, value: str) -> None:
+        """Setter for the align attribute.
+
+        Parameters
+        ----------
+        value : str
+            Alignment of arithmetic with other spectra, one of "left",
+            "intersection" or "union".
+        """
+        if value in ALIGN_MODES:
+            self._align = value
+        else:
+            raise ValueError(
+                "Invalid align mode {0}. {1} are the valid options.".format(
+                    value, list(ALIGN_MODES)
+                )
+            )
+
     @property
     def xaxis(self):
         """Getter for the xaxis attribute."""
@@ -129,7 +181,10 @@ class Spectrum(object):
             raise TypeError(
                 "Cannot assign {} to the xaxis attribute".format(type(value))
             )
-        elif value is None:
+
+        # Any new assignment invalidates the cached grid fingerprint.
+        self._xaxis_fingerprint = None
+        if value is None:
             try:
                 # Try to assign arange the length of flux
                 self._xaxis = np.arange(len(self._flux))
@@ -176,9 +231,122 @@ class Spectrum(object):
             # print("Turning flux input into np array")
             # Not checking to make sure it equals the xaxis
             # If changing flux and xaxis set the flux first
-            self._flux = np.asarray(value)
-        else:
-            self._flux = value
+            value = np.asarray(value)
+        if self._mask is not None and np.shape(value) != self._mask.shape:
+            # A mask of the old pixels does not apply to the new flux.
+            self._mask = None
+        self._runs = None
+        self._flux = value
+
+    @property
+    def mask(self) -> Optional[ndarray]:
+        """Boolean array of bad pixels, or None if no pixels are masked."""
+        return self._mask
+
+    @mask.setter
+    def mask(self, value: Optional[Union[ndarray, List[bool]]]) -> None:
+        """Setter for the mask attribute.
+
+        Parameters
+        ----------
+        value: array-like, None
+            True for the pixels to skip. None to unmask all pixels.
+
+        Raises
+        ------
+        ValueError:
+            Shape of the mask does not match the flux.
+
+        """
+        if value is not None:
+            value = np.asarray(value, dtype=bool)
+            if value.shape != np.shape(self._flux):
+                raise ValueError("Shape of mask does not match flux shape")
+        self._runs = None
+        self._mask = value
+
+    def mask_nans(self) -> None:
+        """Mask the pixels with non-finite flux.
+
+        Unlike ``remove_nans`` nothing is copied and the xaxis is kept.
+        """
+        invalid = ~np.isfinite(self.flux)
+        self.mask = invalid if self._mask is None else self._mask | invalid
+
+    def _good_data(self) -> Tuple[ndarray, ndarray]:
+        """The xaxis and flux of the unmasked pixels."""
+        if self._mask is None:
+            return self.xaxis, self.flux
+        good = ~self._mask
+        return self.xaxis[good], self.flux[good]
+
+    def _finite_runs(self) -> Tuple[ndarray, ndarray]:
+        """Start and stop indices of the contiguous finite runs of the flux.
+
+        The indices are into the unmasked pixels (see ``_good_data``), so
+        masked pixels do not split a run. The runs are found once per flux
+        or mask assignment and cached.
+
+        Notes
+        -----
+        Modifying the flux array in-place (e.g. ``spec.flux[0] = np.nan``)
+        does not reset the cache. Re-assign the flux instead.
+
+        """
+        if self._runs is None:
+            finite = np.isfinite(self._good_data()[1]).astype(np.int8)
+            edges = np.diff(np.concatenate(([0], finite, [0])))
+            self._runs = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+        return self._runs
+
+    def _run_splines(
+        self, k: int = 3, w: Optional[ndarray] = None
+    ) -> List[Tuple[float, float, Any]]:
+        """Fit a spline to each finite run of the flux.
+
+        Parameters
+        ----------
+        k: int
+            Degree of the splines, lowered for runs with k or fewer points.
+        w: ndarray, None
+            Weights of all pixels for the spline fits.
+
+        Returns
+        -------
+        runs: list of (float, float, callable)
+            First and last xaxis value of each run and its spline. Evaluate
+            them with ``_evaluate_runs``.
+
+        """
+        xaxis, flux = self._good_data()
+        if w is not None and self.mask is not None:
+            w = np.asarray(w)[~self.mask]
+        runs = []
+        for start, stop in zip(*self._finite_runs()):
+            if stop - start == 1:
+
+                def spline(x, value=flux[start]):
+                    return np.full(len(x), value)
+
+            else:
+                spline = InterpolatedUnivariateSpline(
+                    xaxis[start:stop],
+                    flux[start:stop],
+                    w=None if w is None else w[start:stop],
+                    k=min(k, stop - start - 1),
+                )
+            runs.append((xaxis[start], xaxis[stop - 1], spline))
+        return runs
+
+    def _run_spline(
+        self, new_xaxis: ndarray, k: int = 3, w: Optional[ndarray] = None
+    ) -> ndarray:
+        """Spline interpolate each finite run of the flux separately.
+
+        Points outside of the runs, in NaN gaps or beyond the xaxis, are
+        NaN. See ``_run_splines`` for the parameters.
+        """
+        return _evaluate_runs(self._run_splines(k=k, w=w), new_xaxis)
 
     def length_check(self) -> None:
         """Check length of xaxis and flux are equal.
@@ -199,6 +367,43 @@ class Spectrum(object):
         elif len(self._flux) != len(self._xaxis):
             raise ValueError("The length of xaxis and flux must be the same")
 
+    def xaxis_fingerprint(self) -> Optional[Tuple[str, Tuple[int, ...], str]]:
+        """Fingerprint of the xaxis values.
+
+        The fingerprint is computed once per xaxis assignment and cached.
+        Grid comparisons (``same_xaxis``) do not use it, they compare by
+        identity first and then by value.
+
+        Notes
+        -----
+        Modifying the xaxis array in-place (e.g. ``spec.xaxis[0] = 1``)
+        does not reset the cache, also through copies sharing the array.
+        Re-assign the xaxis instead.
+
+        """
+        if self._xaxis is None:
+            return None
+        if self._xaxis_fingerprint is None:
+            self._xaxis_fingerprint = _array_fingerprint(self._xaxis)
+        return self._xaxis_fingerprint
+
+    def same_xaxis(self, other: "Spectrum") -> bool:
+        """Check if the xaxis of other is the same grid as self.
+
+        Spectra sharing the same xaxis array (e.g. copies) are detected by
+        identity in O(1), otherwise the values are compared. The cached
+        fingerprints are not used, as copies share the xaxis array and an
+        in-place change through one copy leaves the fingerprint of the other
+        stale.
+        """
+        if self._xaxis is other._xaxis:
+            return True
+        elif self._xaxis is None or other._xaxis is None:
+            return False
+        elif self._xaxis.shape != other._xaxis.shape:
+            return False
+        return bool(np.array_equal(self._xaxis, other._xaxis))
+
     def copy(self) -> "Spectrum":
         """Copy the spectrum."""
         return copy.copy(self)
@@ -207,6 +412,32 @@ class Spectrum(object):
         "Return flux shape."
         return self.flux.shape
 
+    def freeze(self) -> "FrozenSpectrum":
+        """Immutable copy of the spectrum.
+
+        See :class:`spectrum_overload.frozen.FrozenSpectrum`.
+        """
+        from spectrum_overload.frozen import FrozenSpectrum
+
+        return FrozenSpectrum.from_spectrum(self)
+
+    def lazy(self) -> "LazySpectrum":
+        """Start a deferred arithmetic expression with this spectrum.
+
+        Operators on the returned LazySpectrum build an expression that is
+        aligned to a common grid once and evaluated in a single pass when
+        its ``flux`` is accessed or ``evaluate()`` is called.
+
+        Returns
+        -------
+        lazy_spec: LazySpectrum
+            Deferred expression containing only this spectrum.
+
+        """
+        from spectrum_overload.lazy import LazySpectrum
+
+        return LazySpectrum(self)
+
     def wav_select(
         self, wav_min: Union[float, int], wav_max: Union[float, int]
     ) -> None:
@@ -232,6 +463,7 @@ class Spectrum(object):
         """
         x_org = self.xaxis
         flux_org = self.flux
+        mask_org = self.mask
         try:
             if len(self.xaxis) == 0:
                 print(
@@ -241,23 +473,34 @@ class Spectrum(object):
                 mask = (self.xaxis > wav_min) & (self.xaxis < wav_max)
                 self.flux = self.flux[mask]  # change flux first
                 self.xaxis = self.xaxis[mask]
+                self.mask = None if mask_org is None else mask_org[mask]
         except TypeError as e:
             print("Spectrum has no xaxis to select wavelength from")
             # Return to original values iscase were changed
             self.flux = flux_org  # Fix flux first
             self.xaxis = x_org
+            self.mask = mask_org
             raise e
 
-    def add_noise(self, snr: Union[float, int]) -> None:
-        """Add noise level of snr to the flux of the spectrum."""
+    def add_noise(
+        self, snr: Union[float, int], rng: Optional["np.random.Generator"] = None
+    ) -> None:
+        """Add noise level of snr to the flux of the spectrum.
+
+        Uses the global ``np.random`` state unless a Generator rng is given.
+        See :mod:`spectrum_overload.noise` for many realizations at once.
+        """
         sigma = self.flux / snr
         # Add normal distributed noise at the SNR level.
-        self.flux += np.random.normal(0, sigma)
+        self.flux += (np.random if rng is None else rng).normal(0, sigma)
 
-    def add_noise_sigma(self, sigma):
-        """Add Gaussian noise with given sigma."""
+    def add_noise_sigma(self, sigma, rng: Optional["np.random.Generator"] = None):
+        """Add Gaussian noise with given sigma.
+
+        Uses the global ``np.random`` state unless a Generator rng is given.
+        """
         # Add normal distributed noise with given sigma.
-        self.flux += np.random.normal(0, sigma)
+        self.flux += (np.random if rng is None else rng).normal(0, sigma)
 
     def plot(self, axis=None, **kwargs) -> None:
         """Plot spectrum with matplotlib."""
@@ -366,7 +609,25 @@ class Spectrum(object):
 
         http://www.hs.uni-hamburg.de/DE/Ins/Per/Czesla/PyA/PyA/pyaslDoc/aslDoc/crosscorr.html
 
+        When numba is installed the compiled ``kernels.crosscorr_rv`` is used
+        instead for the parameters it supports (mode="doppler" and weights).
+
         """
+        if (
+            kernels.HAS_NUMBA
+            and set(params) <= {"mode", "weights"}
+            and params.get("mode", "doppler") == "doppler"
+        ):
+            return kernels.crosscorr_rv(
+                self.xaxis,
+                self.flux,
+                spectrum.xaxis,
+                spectrum.flux,
+                rvmin,
+                rvmax,
+                drv,
+                weights=params.get("weights"),
+            )
         drv, cc = pyasl.crosscorrRV(
             self.xaxis,
             self.flux,
@@ -427,7 +688,8 @@ class Spectrum(object):
         This uses the scipy's interp1d interpolation. The optional
         parameters are passed to scipy's interp1d. This interpolates
         self to the given reference xaxis values. It overwrites the
-        xaxis and flux of self with the new values.
+        xaxis and flux of self with the new values. Masked pixels are not
+        used, and new pixels next to them are masked.
 
         Parameters
         ----------
@@ -477,9 +739,10 @@ class Spectrum(object):
                 " memory errors and crashes"
             )
         # Create scipy interpolation function from self
+        xaxis, flux = self._good_data()
         interp_function = interp1d(
-            self.xaxis,
-            self.flux,
+            xaxis,
+            flux,
             kind=kind,
             fill_value=fill_value,
             bounds_error=bounds_error,
@@ -488,12 +751,16 @@ class Spectrum(object):
         # Determine the flux at the new locations given by reference
         if isinstance(reference, Spectrum):  # Spectrum type
             new_flux = interp_function(reference.xaxis)
+            new_mask = _mapped_mask(self.mask, self.xaxis, reference.xaxis)
             self.flux = new_flux  # Flux needs to change first
             self.xaxis = reference.xaxis
+            self.mask = new_mask
         elif isinstance(reference, np.ndarray):  # Numpy type
             new_flux = interp_function(reference)
+            new_mask = _mapped_mask(self.mask, self.xaxis, reference)
             self.flux = new_flux  # Flux needs to change first
             self.xaxis = reference
+            self.mask = new_mask
         else:
             # print("Interpolate was not give a valid type")
             raise TypeError(
@@ -515,7 +782,12 @@ class Spectrum(object):
                 InterpolatedUnivariateSpline.
 
         The optional parameters are for scipy's InterpolatedUnivariateSpline
-        function.
+        function. Masked pixels are not used, and new pixels next to them
+        are masked. If the flux has NaN values a spline is fitted to each
+        finite run separately (ignoring bbox and ext), and new pixels in
+        the NaN gaps are NaN. When numba is installed, cubic splines without
+        weights or bbox are evaluated with the compiled
+        ``kernels.interp_cubic``.
 
         Documentation copied from Sicpy:
 
@@ -570,16 +842,40 @@ class Spectrum(object):
         """
         if bbox is None:
             bbox = [None, None]
-        # Create scipy interpolation function from self
-        interp_spline = InterpolatedUnivariateSpline(
-            self.xaxis,
-            self.flux,
-            w=w,
-            bbox=bbox,
-            k=k,
-            ext=ext,
-            check_finite=check_finite,
-        )
+        xaxis, flux = self._good_data()
+        starts, stops = self._finite_runs()
+        if (
+            kernels.HAS_NUMBA
+            and len(starts) == 1
+            and stops[0] - starts[0] == len(self.flux)
+            and len(flux) > k
+            and k == 3
+            and w is None
+            and bbox == [None, None]
+            and ext not in (2, "raise")
+        ):
+            # Only used without masked pixels, values beyond the xaxis are NaN.
+
+            def interp_spline(new_xaxis):
+                return kernels.interp_cubic(xaxis, flux, new_xaxis)
+
+        elif len(starts) == 1 and stops[0] - starts[0] == len(flux):
+            # Create scipy interpolation function from self
+            if w is not None and self.mask is not None:
+                w = np.asarray(w)[~self.mask]
+            interp_spline = InterpolatedUnivariateSpline(
+                xaxis,
+                flux,
+                w=w,
+                bbox=bbox,
+                k=k,
+                ext=ext,
+                check_finite=check_finite,
+            )
+        else:
+
+            def interp_spline(new_xaxis):
+                return self._run_spline(new_xaxis, k=k, w=w)
 
         # interp_function = interp1d(self.xaxis, self.flux, kind=kind,
         #                           fill_value=fill_value,
@@ -596,8 +892,10 @@ class Spectrum(object):
                     "A value in reference.xaxis is outside" "the interpolation range."
                 )
             new_flux[self_mask] = np.nan
+            new_mask = _mapped_mask(self.mask, self.xaxis, reference.xaxis)
             self.flux = new_flux  # Flux needs to change first
             self.xaxis = reference.xaxis
+            self.mask = new_mask
         elif isinstance(reference, np.ndarray):  # Numpy type
             new_flux = interp_spline(reference)
             self_mask = (reference < np.min(self.xaxis)) | (
@@ -608,8 +906,10 @@ class Spectrum(object):
                     "A value in reference is outside the" "interpolation range."
                 )
             new_flux[self_mask] = np.nan
+            new_mask = _mapped_mask(self.mask, self.xaxis, reference)
             self.flux = new_flux  # Flux needs to change first
             self.xaxis = reference
+            self.mask = new_mask
         else:
             # print("Interpolate was not give a valid type")
             raise TypeError(
@@ -617,8 +917,112 @@ class Spectrum(object):
                 " {}".format(type(reference))
             )
 
+    def interpolated(
+        self,
+        reference: Union[ndarray, "Spectrum"],
+        kind: Optional[str] = None,
+        k: int = 3,
+    ) -> "Spectrum":
+        """Return a new spectrum interpolated to the reference xaxis.
+
+        Unlike ``interpolate1d_to`` and ``spline_interpolate_to`` self is
+        not modified, so a spectrum can be interpolated from many threads at
+        once. The interpolation does not hold the GIL for large arrays.
+        Values outside of the xaxis are NaN. Masked pixels are not used,
+        and new pixels next to them are masked. Splines are fitted to each
+        finite run of the flux, so NaN values only give NaN in their gap.
+
+        Parameters
+        ----------
+        reference : Spectrum or numpy.ndarray
+            The reference xaxis values to interpolate to.
+        kind : str, None
+            "linear" or "spline". Default is the interp_method of self.
+        k : int
+            Degree of the spline when kind="spline".
+
+        Returns
+        -------
+        s: Spectrum
+            New spectrum on the reference xaxis.
+
+        Raises
+        ------
+        TypeError:
+            Cannot interpolate with the given object of type <type>.
+
+        """
+        if isinstance(reference, Spectrum):
+            new_xaxis = reference.xaxis
+        elif isinstance(reference, np.ndarray):
+            new_xaxis = reference
+        else:
+            raise TypeError(
+                "Cannot interpolate with the given object of type"
+                " {}".format(type(reference))
+            )
+        kind = self.interp_method if kind is None else kind
+        xaxis, flux = self._good_data()
+        if kind == "linear":
+            new_flux = kernels.interp_linear(xaxis, flux, new_xaxis)
+        elif kind == "spline":
+            new_flux = self._run_spline(new_xaxis, k=k)
+        else:
+            raise ValueError("Kind must be one of 'linear' or 'spline'.")
+        return Spectrum(
+            xaxis=new_xaxis,
+            flux=new_flux,
+            calibrated=self.calibrated,
+            header=copy.copy(self.header),
+            interp_method=self.interp_method,
+            mask=_mapped_mask(self.mask, self.xaxis, new_xaxis),
+            align=self.align,
+        )
+
+    def rebin_to(self, reference: Union[ndarray, "Spectrum"]) -> None:
+        """Rebin to the reference xaxis conserving the flux.
+
+        Each new bin is the overlap weighted average of the bins it covers,
+        so the integrated flux is conserved when degrading to a coarser
+        grid. The rebinning matrix is cached per pair of grids, see
+        :mod:`spectrum_overload.resample`. It overwrites the xaxis and flux
+        of self with the new values. Bins not fully covered are NaN. Bins
+        overlapping a masked pixel are masked.
+
+        Parameters
+        ----------
+        reference : Spectrum or numpy.ndarray
+            The reference xaxis values to rebin to.
+
+        Raises
+        ------
+        TypeError:
+            Cannot rebin with the given object of type <type>.
+
+        """
+        from spectrum_overload.resample import rebin_flux
+
+        if not isinstance(reference, (Spectrum, np.ndarray)):
+            raise TypeError(
+                "Cannot rebin with the given object of type {}".format(type(reference))
+            )
+        if self.mask is None:
+            new_flux = rebin_flux(self, self.flux, reference)
+            new_mask = None
+        else:
+            # Zero the masked pixels so they do not turn the bins into NaN.
+            values = np.vstack((np.where(self.mask, 0, self.flux), self.mask))
+            new_flux, new_mask = rebin_flux(self, values, reference)
+            new_mask = new_mask > 0
+        self.flux = new_flux  # Flux needs to change first
+        self.xaxis = reference.xaxis if isinstance(reference, Spectrum) else reference
+        self.mask = new_mask
+
     def remove_nans(self) -> "Spectrum":
-        """Returns new spectrum. Uses slicing with isnan mask."""
+        """Returns new spectrum. Uses slicing with isnan mask.
+
+        See ``mask_nans`` to skip the NaN values without copying.
+        """
         return self[~np.isnan(self.flux)]
 
     def continuum(
@@ -627,7 +1031,8 @@ class Spectrum(object):
         """Fit the continuum of the spectrum.
 
         Fit a function of ``method`` to the median of the highest
-        ``ntop`` points of ``nbins`` bins of the spectrum.``
+        ``ntop`` points of ``nbins`` bins of the spectrum.`` Masked pixels
+        are not used in the fit.
 
         Parameters
         ----------
@@ -650,7 +1055,9 @@ class Spectrum(object):
         """
         s = self.copy()
 
-        s.flux = norm.continuum(s.xaxis, s.flux, method=method, degree=degree, **kwargs)
+        s.flux = norm.continuum(
+            s.xaxis, s.flux, method=method, degree=degree, mask=s.mask, **kwargs
+        )
         return s
 
     def normalize(
@@ -687,7 +1094,11 @@ class Spectrum(object):
     def instrument_broaden(self, R, **pya_kwargs):
         """Broaden spectrum by instrumental resolution R.
 
-        Uses the PyAstronomy instrBroadGaussFast function.
+        Uses the PyAstronomy instrBroadGaussFast function, or the compiled
+        ``kernels.gaussian_broaden`` when numba is installed and only maxsig
+        and edgeHandling are given. Masked pixels are replaced by a linear
+        interpolation of their neighbours before broadening, so they do not
+        spread into the good pixels.
 
         Parameters
         ----------
@@ -702,12 +1113,258 @@ class Spectrum(object):
             Broadened spectrum array.
         """
         s = self.copy()
-        new_flux = pyasl.instrBroadGaussFast(
-            s.xaxis, s.flux, resolution=R, **pya_kwargs
-        )
+        flux = s.flux
+        if s.mask is not None and np.any(s.mask):
+            xaxis, good_flux = s._good_data()
+            flux = np.where(s.mask, np.interp(s.xaxis, xaxis, good_flux), flux)
+        if kernels.HAS_NUMBA and set(pya_kwargs) <= {"maxsig", "edgeHandling"}:
+            new_flux = kernels.gaussian_broaden(
+                s.xaxis,
+                flux,
+                R,
+                maxsig=pya_kwargs.get("maxsig"),
+                edge_handling=pya_kwargs.get("edgeHandling"),
+            )
+        else:
+            new_flux = pyasl.instrBroadGaussFast(
+                s.xaxis, flux, resolution=R, **pya_kwargs
+            )
         s.flux = new_flux
         return s
 
+    def _aligned_flux(self, other: "Spectrum") -> ndarray:
+        """Flux of other on the xaxis of self.
+
+        The flux is returned directly if both share the same grid,
+        otherwise other is spline interpolated onto the xaxis of self.
+
+        Raises
+        ------
+        ValueError:
+            The xaxis do not overlap so cannot be interpolated.
+
+        """
+        if len(self) == len(other) and self.same_xaxis(other):
+            return other.flux
+
+        no_overlap_lower = np.min(self.xaxis) > np.max(other.xaxis)
+        no_overlap_upper = np.max(self.xaxis) < np.min(other.xaxis)
+        if no_overlap_lower | no_overlap_upper:
+            raise ValueError("The xaxis do not overlap so cannot be interpolated")
+        other_copy = other.copy()
+        other_copy.spline_interpolate_to(self, check_finite=True)
+        return other_copy.flux
+
+    def _aligned_mask(self, other: "Spectrum") -> Optional[ndarray]:
+        """Mask of other on the xaxis of self, see ``_aligned_flux``."""
+        if other.mask is None or (len(self) == len(other) and self.same_xaxis(other)):
+            return other.mask
+        return _mapped_mask(other.mask, other.xaxis, self.xaxis)
+
+    def _overlap_window(self, others: List["Spectrum"]) -> Tuple["Spectrum", int]:
+        """Window of self over the overlap with the xaxis of others.
+
+        Used by the "intersection" and "union" align modes. The window is
+        found by binary search, so only the overlapping pixels need to be
+        interpolated and computed.
+
+        Returns
+        -------
+        window: Spectrum
+            New spectrum of the overlapping pixels of self.
+        start: int
+            Index of the first pixel of the window in self.
+
+        Raises
+        ------
+        ValueError:
+            An xaxis is not ascending, or the xaxis do not overlap for
+            align="intersection".
+
+        """
+        for spectrum in [self] + list(others):
+            if np.any(np.diff(spectrum.xaxis) < 0):
+                raise ValueError(
+                    'align="{}" requires ascending xaxis values.'.format(self.align)
+                )
+        lower = max([self.xaxis[0]] + [other.xaxis[0] for other in others])
+        upper = min([self.xaxis[-1]] + [other.xaxis[-1] for other in others])
+        start = np.searchsorted(self.xaxis, lower, side="left")
+        stop = max(np.searchsorted(self.xaxis, upper, side="right"), start)
+        if start == stop and self.align == "intersection":
+            raise ValueError("The xaxis do not overlap so cannot be interpolated")
+        # Sliced as a Spectrum, as the callers modify the window.
+        return Spectrum.__getitem__(self, slice(start, stop)), start
+
+    def _window_values(
+        self, window: "Spectrum", start: int, value: Any
+    ) -> Tuple[Any, Optional[ndarray]]:
+        """Flux and mask of value on a window of self, see ``_overlap_window``.
+
+        Spectra on the xaxis of self and arrays of its length are sliced,
+        spectra on other xaxis are interpolated onto the window.
+        """
+        stop = start + len(window)
+        if isinstance(value, Spectrum):
+            if len(value) == len(self) and self.same_xaxis(value):
+                mask = None if value.mask is None else value.mask[start:stop]
+                return value.flux[start:stop], mask
+            elif len(window) == 0:
+                return np.empty(0), None
+            return window._aligned_flux(value), window._aligned_mask(value)
+        elif np.ndim(value) and len(value) == len(self):
+            return np.asarray(value)[start:stop], None
+        return value, None
+
+    def _window_result(
+        self, window: "Spectrum", start: int, others: List["Spectrum"]
+    ) -> "Spectrum":
+        """Result of an operation computed on a window of self.
+
+        With align="intersection" the window is returned. With "union" it is
+        padded with NaN pixels on the xaxis of self and on the pixels of the
+        others beyond self.
+        """
+        if self.align == "intersection":
+            return window
+
+        before = np.unique(
+            np.concatenate(
+                [
+                    other.xaxis[: np.searchsorted(other.xaxis, self.xaxis[0], "left")]
+                    for other in others
+                ]
+            )
+        )
+        after = np.unique(
+            np.concatenate(
+                [
+                    other.xaxis[np.searchsorted(other.xaxis, self.xaxis[-1], "right") :]
+                    for other in others
+                ]
+            )
+        )
+        offset = len(before) + start
+        flux = np.full(len(before) + len(self) + len(after), np.nan)
+        flux[offset : offset + len(window)] = window.flux
+        result = window.copy()
+        result.flux = flux  # Flux needs to change first
+        result.xaxis = np.concatenate((before, self.xaxis, after))
+        if window.mask is not None:
+            mask = np.zeros(len(flux), dtype=bool)
+            mask[offset : offset + len(window)] = window.mask
+            result.mask = mask
+        return result
+
+    # ######################################################
+    # Numpy array protocol
+    # ######################################################
+    def __array__(self, dtype=None, copy=None) -> ndarray:
+        """Return the flux as a numpy array."""
+        if copy:
+            return np.array(self.flux, dtype=dtype, copy=True)
+        return np.asarray(self.flux, dtype=dtype)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        """Apply numpy ufuncs to the flux of the spectrum.
+
+        The ufunc is evaluated on the flux arrays and returns a Spectrum
+        with the xaxis and header of the first Spectrum input. Other
+        Spectrum inputs are aligned to that xaxis with the same rules as
+        the arithmetic operators, including the ``align`` mode of the first
+        Spectrum. Spectrum objects given to ``out`` have their flux buffer
+        written in-place, which needs all inputs on the same xaxis unless
+        the align mode is "left".
+
+        Non ``__call__`` methods (e.g. ``np.add.reduce``) act on the flux
+        arrays and return plain numpy results. Functions that are not
+        ufuncs, such as ``np.where``, see the flux through ``__array__``
+        and return arrays.
+
+        Examples
+        --------
+        >>> log_spec = np.log(spec)
+        >>> np.sqrt(spec, out=spec)  # In-place on spec.flux
+
+        """
+        out = kwargs.pop("out", ())
+        if method != "__call__":
+            inputs = tuple(_flux_of(arg) for arg in inputs)
+            if out:
+                kwargs["out"] = tuple(_flux_of(arg) for arg in out)
+            return getattr(ufunc, method)(*inputs, **kwargs)
+
+        template = next(arg for arg in inputs + out if isinstance(arg, Spectrum))
+        others = [
+            arg
+            for arg in inputs
+            if isinstance(arg, Spectrum)
+            and not (len(arg) == len(template) and arg.same_xaxis(template))
+        ]
+        window = None
+        if template.align != "left" and others:
+            if out:
+                raise SpectrumError(
+                    'Cannot use out with align="{}" on spectra of different '
+                    "xaxis.".format(template.align)
+                )
+            window, start = template._overlap_window(others)
+
+        args = []
+        mask = None
+        for arg in inputs:
+            if isinstance(arg, Spectrum) and arg.calibrated != template.calibrated:
+                raise SpectrumError(
+                    "Spectra are not consistently calibrated for {}".format(ufunc)
+                )
+            if window is not None:
+                arg, arg_mask = template._window_values(window, start, arg)
+                mask = _combine_masks(mask, arg_mask)
+            elif isinstance(arg, Spectrum):
+                mask = _combine_masks(mask, template._aligned_mask(arg))
+                arg = template._aligned_flux(arg)
+            args.append(arg)
+
+        if out:
+            for arg in out:
+                if isinstance(arg, Spectrum) and not (
+                    len(arg) == len(template) and arg.same_xaxis(template)
+                ):
+                    raise SpectrumError(
+                        "The out Spectrum must share the xaxis of the inputs."
+                    )
+            kwargs["out"] = tuple(_flux_of(arg) for arg in out)
+
+        results = ufunc(*args, **kwargs)
+        if ufunc.nout == 1:
+            results = (results,)
+
+        wrapped = []
+        for i, res in enumerate(results):
+            if out and isinstance(out[i], Spectrum):
+                res = out[i]
+            elif window is not None:
+                res = window.__array_wrap__(res)
+            else:
+                res = template.__array_wrap__(res)
+            if isinstance(res, Spectrum):
+                res.mask = mask
+                if window is not None:
+                    res = template._window_result(res, start, others)
+            wrapped.append(res)
+        return wrapped[0] if ufunc.nout == 1 else tuple(wrapped)
+
+    def __array_wrap__(self, array, context=None, return_scalar=False):
+        """Wrap a flux array result in a new Spectrum like self.
+
+        Results with a different shape than the flux are returned unchanged.
+        """
+        if isinstance(array, np.ndarray) and array.shape == np.shape(self.flux):
+            result = self.copy()
+            result.flux = array
+            return result
+        return array
+
     # ######################################################
     # Overloading Operators
     # Based on code from pyspeckit.
@@ -716,10 +1373,15 @@ class Spectrum(object):
         """
         Perform an operation (addition, subtraction, multiplication, division,
         etc.) after checking for shape matching.
+
+        Spectra on different xaxis are aligned by the align mode of self.
         """
 
         def ofunc(self, other):
             """Operation function """
+            if getattr(other, "_deferred", False):
+                # Let a LazySpectrum extend its expression instead.
+                return NotImplemented
             result = self.copy()
             if np.isscalar(other):
                 other_flux = other
@@ -742,26 +1404,16 @@ class Spectrum(object):
                             operation
                         )
                     )
-
-                def _interp_other():
-                    no_overlap_lower = np.min(self.xaxis) > np.max(other.xaxis)
-                    no_overlap_upper = np.max(self.xaxis) < np.min(other.xaxis)
-                    if no_overlap_lower | no_overlap_upper:
-                        raise ValueError(
-                            "The xaxis do not overlap so cannot be interpolated"
-                        )
-                    else:
-                        other_copy = other.copy()
-                        other_copy.spline_interpolate_to(self, check_finite=True)
-                        other_flux = other_copy.flux
-                    return other_flux
-
-                if len(self) != len(other):
-                    other_flux = _interp_other()
-                elif np.any(self.xaxis != other.xaxis):
-                    other_flux = _interp_other()
-                else:  # Equal xaxis
-                    other_flux = other.copy().flux
+                if self.align != "left" and not (
+                    len(self) == len(other) and self.same_xaxis(other)
+                ):
+                    window, start = self._overlap_window([other])
+                    other_flux, other_mask = self._window_values(window, start, other)
+                    window.flux = operation(window.flux, other_flux)
+                    window.mask = _combine_masks(window.mask, other_mask)
+                    return self._window_result(window, start, [other])
+                other_flux = self._aligned_flux(other)
+                result.mask = _combine_masks(self.mask, self._aligned_mask(other))
 
             result.flux = operation(result.flux, other_flux)  # Perform the operation
             return result
@@ -857,8 +1509,226 @@ class Spectrum(object):
         s = self.copy()
         s.flux = self.flux[item]
         s.xaxis = self.xaxis[item]
+        s.mask = None if self.mask is None else self.mask[item]
         return s
 
+    def __reduce_ex__(self, protocol):
+        """Pickle the xaxis and flux as out-of-band buffers for protocol 5.
+
+        Protocol 5 consumers passing a ``buffer_callback`` to pickle receive
+        the xaxis and flux as ``PickleBuffer`` objects they can transfer
+        without copying. Lower protocols, and arrays of objects, use the
+        default pickling.
+        """
+        arrays = (self._xaxis, self._flux)
+        if protocol < 5 or any(
+            array is not None and array.dtype.hasobject for array in arrays
+        ):
+            return super().__reduce_ex__(protocol)
+        state = self.__dict__.copy()
+        del state["_xaxis"], state["_flux"]
+        buffers = tuple(_array_buffer(array) for array in arrays)
+        return _rebuild_spectrum, (type(self),) + buffers + (state,)
+
+    def to_bytes(self) -> bytes:
+        """Serialize the spectrum into a compact bytes representation.
+
+        The layout is a short magic string, the length of a JSON block with
+        the array layouts, calibration, interpolation method, align mode and
+        header, followed by the raw xaxis, flux and mask data. Headers must be
+        an astropy Header or a JSON serializable dict.
+
+        Returns
+        -------
+        data: bytes
+            The serialized spectrum, see ``Spectrum.from_bytes``.
+
+        """
+        arrays = [
+            None if array is None else np.ascontiguousarray(array)
+            for array in (self._xaxis, self._flux, self._mask)
+        ]
+        if any(array is not None and array.dtype.hasobject for array in arrays):
+            raise TypeError("Cannot serialize arrays of objects to bytes.")
+        meta = {
+            "arrays": [
+                None if array is None else [array.dtype.str, array.shape]
+                for array in arrays
+            ],
+            "calibrated": self.calibrated,
+            "interp_method": self.interp_method,
+            "align": self.align,
+            "header": _header_to_json(self.header),
+        }
+        meta_bytes = json.dumps(meta).encode()
+        # Pad so the arrays start on an 8 byte boundary.
+        meta_bytes += b" " * (-(len(_BYTES_MAGIC) + 4 + len(meta_bytes)) % 8)
+        return b"".join(
+            [_BYTES_MAGIC, struct.pack("<I", len(meta_bytes)), meta_bytes]
+            + [array.tobytes() for array in arrays if array is not None]
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes, copy: bool = True) -> "Spectrum":
+        """Create a spectrum from the output of ``Spectrum.to_bytes``.
+
+        Parameters
+        ----------
+        data: bytes-like
+            Serialized spectrum.
+        copy: bool
+            Copy the arrays out of data. If False the xaxis and flux are
+            views of data, which are read-only for immutable bytes.
+
+        Returns
+        -------
+        s: Spectrum
+            The deserialized spectrum.
+
+        Raises
+        ------
+        ValueError:
+            The data is not a serialized Spectrum.
+
+        """
+        data = memoryview(data).cast("B")
+        start = len(_BYTES_MAGIC) + 4
+        if bytes(data[: len(_BYTES_MAGIC)]) != _BYTES_MAGIC:
+            raise ValueError("The data is not a serialized Spectrum.")
+        (meta_length,) = struct.unpack("<I", data[len(_BYTES_MAGIC) : start])
+        meta = json.loads(bytes(data[start : start + meta_length]).decode())
+        offset = start + meta_length
+
+        arrays = []
+        for layout in meta["arrays"]:
+            if layout is None:
+                arrays.append(None)
+                continue
+            dtype, shape = np.dtype(layout[0]), tuple(layout[1])
+            count = int(np.prod(shape))
+            array = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+            offset += count * dtype.itemsize
+            arrays.append(array.reshape(shape).copy() if copy else array.reshape(shape))
+
+        return cls(
+            xaxis=arrays[0],
+            flux=arrays[1],
+            calibrated=meta["calibrated"],
+            header=_header_from_json(meta["header"]),
+            interp_method=meta["interp_method"],
+            mask=arrays[2] if len(arrays) > 2 else None,
+            align=meta.get("align", "left"),
+        )
+
+
+_BYTES_MAGIC = b"SPEC\x01"
+
+
+def _header_to_json(header: Union[Header, Dict[str, Any]]) -> Dict[str, Any]:
+    """JSON serializable form of an astropy Header or a dict header."""
+    if isinstance(header, Header):
+        return {"fits": header.tostring()}
+    return {"dict": dict(header)}
+
+
+def _header_from_json(data: Dict[str, Any]) -> Union[Header, Dict[str, Any]]:
+    """Header from the output of _header_to_json."""
+    if "fits" in data:
+        return Header.fromstring(data["fits"])
+    return data["dict"]
+
+
+def _array_buffer(
+    array: Optional[ndarray]
+) -> Optional[Tuple[pickle.PickleBuffer, str, Tuple[int, ...]]]:
+    """PickleBuffer of an array with its dtype and shape."""
+    if array is None:
+        return None
+    array = np.ascontiguousarray(array)
+    return pickle.PickleBuffer(array), array.dtype.str, array.shape
+
+
+def _rebuild_spectrum(cls, xaxis, flux, state: Dict[str, Any]) -> "Spectrum":
+    """Rebuild a Spectrum pickled with protocol 5.
+
+    Arrays of read-only buffers, e.g. the bytes of in-band pickles, are
+    copied so that only a FrozenSpectrum has read-only arrays.
+    """
+    from spectrum_overload.frozen import FrozenSpectrum
+
+    spectrum = cls.__new__(cls)
+    state = dict(state)
+    for name, array in (("_xaxis", xaxis), ("_flux", flux)):
+        if array is not None:
+            buffer, dtype, shape = array
+            array = np.frombuffer(buffer, dtype=dtype).reshape(shape)
+            if not array.flags.writeable and not issubclass(cls, FrozenSpectrum):
+                array = array.copy()
+        state[name] = array
+    setstate = getattr(spectrum, "__setstate__", None)
+    if setstate is not None:
+        setstate(state)
+    else:
+        spectrum.__dict__.update(state)
+    return spectrum
+
+
+def _combine_masks(
+    mask: Optional[ndarray], other: Optional[ndarray]
+) -> Optional[ndarray]:
+    """Union of two masks, either of which may be None."""
+    if mask is None:
+        return other
+    elif other is None:
+        return mask
+    return mask | other
+
+
+def _evaluate_runs(
+    runs: List[Tuple[float, float, Any]], new_xaxis: ndarray
+) -> ndarray:
+    """Evaluate the run splines of ``Spectrum._run_splines`` at new_xaxis.
+
+    The target points are grouped into one block per run with a binary
+    search, and each block is evaluated with a single call. Points outside
+    of the runs are NaN.
+    """
+    new_xaxis = np.asarray(new_xaxis)
+    order = np.argsort(new_xaxis, kind="mergesort")
+    sorted_xaxis = new_xaxis[order]
+    new_flux = np.full(len(new_xaxis), np.nan)
+    for first, last, spline in runs:
+        lo = np.searchsorted(sorted_xaxis, first, side="left")
+        hi = np.searchsorted(sorted_xaxis, last, side="right")
+        if hi > lo:
+            block = order[lo:hi]
+            new_flux[block] = spline(new_xaxis[block])
+    return new_flux
+
+
+def _mapped_mask(
+    mask: Optional[ndarray], xaxis: ndarray, new_xaxis: ndarray
+) -> Optional[ndarray]:
+    """Mask of the new_xaxis points that are next to a masked xaxis point."""
+    if mask is None:
+        return None
+    return np.interp(new_xaxis, xaxis, mask.astype(float), left=0, right=0) > 0
+
+
+def _flux_of(value: Any) -> Any:
+    """Return the flux of a Spectrum, other values unchanged."""
+    return value.flux if isinstance(value, Spectrum) else value
+
+
+def _array_fingerprint(array: ndarray) -> Tuple[str, Tuple[int, ...], str]:
+    """Fingerprint the dtype, shape and contents of an array."""
+    array = np.ascontiguousarray(array)
+    if array.dtype.hasobject:
+        digest = hashlib.sha1(repr(array.tolist()).encode()).hexdigest()
+    else:
+        digest = hashlib.sha1(array).hexdigest()
+    return array.dtype.str, array.shape, digest
+
 
 class SpectrumError(Exception):
     """An error class for spectrum errors."""
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+"""Co-addition of many spectra with outlier rejection."""
+import warnings
+from typing import Optional, Sequence, Tuple, Union
+
+import numpy as np
+from numpy import ndarray
+
+from spectrum_overload import kernels
+from spectrum_overload.spectrum import Spectrum, SpectrumError, _evaluate_runs
+
+DEFAULT_CHUNK_SIZE = 2 ** 16
+
+
+def combine(
+    spectra: Sequence[Spectrum],
+    method: str = "mean",
+    sigma_clip: Optional[float] = None,
+    weights: Optional[Sequence[float]] = None,
+    reference: Optional[Union[Spectrum, ndarray]] = None,
+    kind: str = "spline",
+    maxiters: int = 3,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Tuple[Spectrum, ndarray]:
+    """Combine many spectra onto a common grid.
+
+    Every spectrum is resampled once onto the reference grid and the stack
+    is reduced in wavelength blocks of ``chunk_size`` pixels, so only a
+    ``(len(spectra), chunk_size)`` block is held in memory at a time.
+    Pixels outside of a spectrum's xaxis, masked or with non-finite flux
+    do not contribute.
+
+    Parameters
+    ----------
+    spectra: list of Spectrum
+        Spectra to combine.
+    method: str
+        "mean", "median" or "weighted". Default "mean".
+    sigma_clip: float, None
+        Reject values further than sigma_clip standard deviations from the
+        median of each pixel. Default None (no clipping).
+    weights: list of float, None
+        Weight of each spectrum for method="weighted".
+    reference: Spectrum, ndarray, None
+        Grid to combine onto. Default is the xaxis of the first spectrum.
+    kind: str
+        Resampling, "spline" (as used by the operators) or "linear".
+    maxiters: int
+        Maximum number of sigma clipping iterations.
+    chunk_size: int
+        Number of pixels reduced per block.
+
+    Returns
+    -------
+    s: Spectrum
+        Combined spectrum, with the header of the first spectrum.
+    count: ndarray
+        Number of spectra contributing to each pixel.
+
+    """
+    if method not in ("mean", "median", "weighted"):
+        raise ValueError("Method must be one of 'mean', 'median' or 'weighted'.")
+    if kind not in ("spline", "linear"):
+        raise ValueError("Kind must be one of 'spline' or 'linear'.")
+    if len(spectra) == 0:
+        raise ValueError("No spectra given to combine.")
+    if method == "weighted":
+        if weights is None or len(weights) != len(spectra):
+            raise ValueError("Method 'weighted' requires a weight for each spectrum.")
+        weights = np.asarray(weights, dtype=float)
+    if any(spec.calibrated != spectra[0].calibrated for spec in spectra):
+        raise SpectrumError("Spectra are not consistently calibrated for combining.")
+
+    if reference is None:
+        reference = spectra[0]
+    if isinstance(reference, Spectrum):
+        grid = reference.xaxis
+    else:
+        grid = np.asarray(reference)
+        # Only the grid of the reference is used.
+        reference = Spectrum(xaxis=grid, flux=grid)
+
+    resamplers = [_resampler(spec, reference, kind) for spec in spectra]
+
+    flux = np.empty(len(grid))
+    count = np.empty(len(grid), dtype=int)
+    for start in range(0, len(grid), chunk_size):
+        block = slice(start, min(start + chunk_size, len(grid)))
+        stack = np.vstack([resample(block) for resample in resamplers])
+        stack[~np.isfinite(stack)] = np.nan
+        if sigma_clip is not None:
+            _sigma_clip(stack, sigma_clip, maxiters)
+
+        valid = ~np.isnan(stack)
+        count[block] = np.sum(valid, axis=0)
+        with warnings.catch_warnings():
+            # All-NaN pixels warn and give NaN.
+            warnings.simplefilter("ignore", RuntimeWarning)
+            if method == "mean":
+                flux[block] = np.nanmean(stack, axis=0)
+            elif method == "median":
+                flux[block] = np.nanmedian(stack, axis=0)
+            else:
+                block_weights = np.where(valid, weights[:, np.newaxis], 0.0)
+                flux[block] = np.nansum(stack * block_weights, axis=0) / np.sum(
+                    block_weights, axis=0
+                )
+
+    s = Spectrum(
+        xaxis=grid,
+        flux=flux,
+        calibrated=spectra[0].calibrated,
+        header=spectra[0].header.copy(),
+    )
+    s.header["combined"] = "{0} spectra with {1}".format(len(spectra), method)
+    return s, count
+
+
+def _resampler(spectrum: Spectrum, reference: Spectrum, kind: str):
+    """Function returning the flux of spectrum on a block of the reference.
+
+    Masked pixels, and new pixels next to them, are NaN.
+    """
+    if len(spectrum) == len(reference) and spectrum.same_xaxis(reference):
+
+        def resample(block: slice) -> ndarray:
+            values = np.array(spectrum.flux[block], dtype=float)
+            if spectrum.mask is not None:
+                values[spectrum.mask[block]] = np.nan
+            return values
+
+        return resample
+
+    if kind == "spline":
+        # Each finite run is fitted once, so NaN gaps stay NaN.
+        runs = spectrum._run_splines()
+        interp = lambda x: _evaluate_runs(runs, x)  # noqa: E731
+    else:
+        xaxis, flux = spectrum._good_data()
+        xaxis = np.asarray(xaxis, dtype=float)
+        flux = np.asarray(flux, dtype=float)
+        interp = lambda x: kernels.interp_linear(xaxis, flux, x)  # noqa: E731
+    if spectrum.mask is not None:
+        mask = spectrum.mask.astype(float)
+
+    def resample(block: slice) -> ndarray:
+        x = reference.xaxis[block]
+        values = interp(x)
+        if spectrum.mask is not None:
+            # The same pixels as masked by Spectrum.interpolated.
+            masked = np.interp(x, spectrum.xaxis, mask, left=0, right=0) > 0
+            values[masked] = np.nan
+        return values
+
+    return resample
+
+
+def _sigma_clip(stack: ndarray, sigma: float, maxiters: int) -> None:
+    """Replace outliers along the first axis of stack with NaN in-place."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for __ in range(maxiters):
+            center = np.nanmedian(stack, axis=0)
+            std = np.nanstd(stack, axis=0)
+            with np.errstate(invalid="ignore"):
+                outliers = np.abs(stack - center) > sigma * std
+            if not np.any(outliers):
+                break
+            stack[outliers] = np.nan
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+
+"""Telluric correction with the bundled TAPAS transmission model.
+
+The telluric transmission T of an exposure is modelled from a reference
+model T0 (``data/telluric_data.ipac``) as T = T0(lambda / (1 + rv / c))**p,
+where the power p scales the absorption with airmass and rv is a small
+wavelength calibration shift.
+
+The reference model is broadened to the instrument resolution and resampled
+onto the observation grid once per (R, grid) pair and cached. For shifts
+much smaller than the telluric line widths the log of the model is linear in
+the shift, so the power and shift of each exposure are found by a linear
+least squares fit and applied with an elementwise power and divide.
+
+Examples
+--------
+>>> model = TelluricModel()
+>>> corrected = model.correct(spectrum, R=50000)
+
+"""
+import os.path
+from collections import OrderedDict
+from typing import Any, Optional, Tuple, Union
+
+import numpy as np
+from astropy.io import ascii
+from numpy import ndarray
+
+from spectrum_overload import kernels
+from spectrum_overload.kernels import c_kms
+from spectrum_overload.resample import Resampler, _grid
+from spectrum_overload.spectrum import Spectrum, SpectrumError
+
+AIRMASS_KEYS = ("ESO TEL AIRM START", "ESO TEL AIRM END")
+CACHE_SIZE = 16
+
+
+def airmass(header: Any) -> float:
+    """Mean airmass of the exposure from the header."""
+    try:
+        return float(np.mean([header[key] for key in AIRMASS_KEYS]))
+    except KeyError as e:
+        raise SpectrumError("Header is missing {} for the airmass.".format(e))
+
+
+class TelluricModel(object):
+    """Telluric transmission model with a cache of its broadened versions.
+
+    Parameters
+    ----------
+    model: Spectrum, str, None
+        Transmission model or path of an IPAC table with wavelength and
+        transmittance columns. Default is the bundled TAPAS model.
+    airmass: float, None
+        Airmass of the model. Default is read from the IPAC table or the
+        "airmass" header key of a model Spectrum.
+
+    """
+
+    def __init__(
+        self,
+        model: Optional[Union[Spectrum, str]] = None,
+        airmass: Optional[float] = None,
+    ) -> None:
+        """Load the model."""
+        if model is None:
+            model = os.path.join(
+                os.path.dirname(__file__), "data", "telluric_data.ipac"
+            )
+        if isinstance(model, str):
+            table = ascii.read(model, format="ipac")
+            if airmass is None:
+                airmass = table.meta["keywords"]["airmass"]["value"]
+            order = np.argsort(table["wavelength"])
+            model = Spectrum(
+                xaxis=np.asarray(table["wavelength"], dtype=float)[order],
+                flux=np.asarray(table["transmittance"], dtype=float)[order],
+                calibrated=True,
+                header={"airmass": airmass},
+            )
+        if airmass is None:
+            airmass = model.header.get("airmass")
+        self.model = model
+        self.airmass = airmass
+        self._cache = OrderedDict()  # type: OrderedDict
+
+    def on_grid(
+        self, R: Optional[float], reference: Union[Spectrum, ndarray]
+    ) -> Tuple[ndarray, ndarray]:
+        """Log transmission and its derivative on a grid.
+
+        Broadens the model by resolution R and resamples it onto the grid
+        of reference. The result is cached per (R, grid).
+
+        Parameters
+        ----------
+        R: float, None
+            Instrumental resolution. None to not broaden.
+        reference: Spectrum, ndarray
+            Grid to resample onto.
+
+        Returns
+        -------
+        log_model: ndarray
+            Log of the transmission on the grid.
+        log_derivative: ndarray
+            d log(T) / d log(lambda) on the grid, the change of the log
+            transmission with a shift of rv / c.
+
+        """
+        key = (R, _grid(reference)[1])
+        try:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+        except KeyError:
+            pass
+
+        xaxis = self.model.xaxis
+        if R is None:
+            flux = self.model.flux
+        else:
+            flux = self._broadened(R)
+        with np.errstate(divide="ignore"):
+            log_flux = np.log(np.clip(flux, 0, None))
+        log_derivative = np.gradient(log_flux, np.log(xaxis))
+        resampler = Resampler(self.model, reference, kind="linear")
+        values = resampler(np.vstack((log_flux, log_derivative)))
+        self._cache[key] = (values[0], values[1])
+        if len(self._cache) > CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return self._cache[key]
+
+    def _broadened(self, R: float) -> ndarray:
+        """Model transmission broadened to resolution R."""
+        return kernels.gaussian_broaden(
+            self.model.xaxis, self.model.flux, R, edge_handling="firstlast"
+        )
+
+    def clear_cache(self) -> None:
+        """Discard the cached models."""
+        self._cache.clear()
+
+    def fit(
+        self,
+        spectrum: Spectrum,
+        R: Optional[float] = None,
+        power: Optional[float] = None,
+        mask: Optional[ndarray] = None,
+    ) -> Tuple[float, float]:
+        """Fit the airmass power and RV shift of the telluric model.
+
+        Linear least squares fit of log(flux) = p * (log T0 - rv / c * D)
+        over the pixels where the model absorbs, with D the log derivative
+        of the model.
+
+        Parameters
+        ----------
+        spectrum: Spectrum
+            Calibrated, continuum normalized observation.
+        R: float, None
+            Instrumental resolution. None to not broaden.
+        power: float, None
+            Fixed airmass power, only fitting the shift. Default is to fit.
+        mask: ndarray, None
+            Boolean array of pixels to use, e.g. to exclude stellar lines.
+
+        Returns
+        -------
+        power: float
+            Power to raise the model to.
+        rv: float
+            Shift of the model [km/s].
+
+        """
+        if not spectrum.calibrated:
+            raise SpectrumError("Cannot telluric correct an uncalibrated spectrum.")
+        log_model, log_derivative = self.on_grid(R, spectrum)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_flux = np.log(spectrum.flux)
+        use = (
+            np.isfinite(log_flux)
+            & np.isfinite(log_model)
+            & np.isfinite(log_derivative)
+            & (log_model < -1e-3)
+        )
+        if mask is not None:
+            use &= np.asarray(mask, dtype=bool)
+        if np.sum(use) < 2:
+            raise SpectrumError("Not enough telluric absorption to fit the model.")
+
+        if power is None:
+            design = np.column_stack((log_model[use], log_derivative[use]))
+            power, slope = np.linalg.lstsq(design, log_flux[use], rcond=None)[0]
+        else:
+            residual = log_flux[use] - power * log_model[use]
+            derivative = log_derivative[use]
+            slope = np.dot(derivative, residual) / np.dot(derivative, derivative)
+        rv = -slope / power * c_kms
+        return float(power), float(rv)
+
+    def transmission(
+        self,
+        reference: Union[Spectrum, ndarray],
+        R: Optional[float] = None,
+        power: float = 1.0,
+        rv: float = 0.0,
+    ) -> ndarray:
+        """Transmission on a grid with the given power and RV shift."""
+        log_model, log_derivative = self.on_grid(R, reference)
+        return np.exp(power * (log_model - rv / c_kms * log_derivative))
+
+    def correct(
+        self,
+        spectrum: Spectrum,
+        R: Optional[float] = None,
+        power: Optional[float] = None,
+        rv: Optional[float] = None,
+        mask: Optional[ndarray] = None,
+    ) -> Spectrum:
+        """Divide a spectrum by the fitted telluric model.
+
+        Parameters
+        ----------
+        spectrum: Spectrum
+            Calibrated, continuum normalized observation.
+        R: float, None
+            Instrumental resolution. None to not broaden.
+        power: float, None
+            Airmass power. Default is fitted, see ``fit``, or the ratio of
+            the airmass in the header to that of the model if rv is given.
+        rv: float, None
+            Shift of the model [km/s]. Default is fitted.
+        mask: ndarray, None
+            Boolean array of pixels to use in the fit.
+
+        Returns
+        -------
+        s: Spectrum
+            Telluric corrected spectrum, with the power and shift in the
+            header. Pixels outside of the model are NaN.
+
+        """
+        if rv is None:
+            power, rv = self.fit(spectrum, R=R, power=power, mask=mask)
+        elif power is None:
+            power = airmass(spectrum.header) / self.airmass
+        transmission = self.transmission(spectrum, R=R, power=power, rv=rv)
+        s = spectrum.copy()
+        s.header = spectrum.header.copy()
+        s.flux = spectrum.flux / transmission
+        s.header["telluric_power"] = power
+        s.header["telluric_rv"] = rv
+        return s
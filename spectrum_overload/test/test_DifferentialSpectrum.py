@@ -4,8 +4,14 @@
 from __future__ import division, print_function
 
 import numpy as np
+import pytest
 
-from spectrum_overload import DifferentialSpectrum, Spectrum
+from spectrum_overload import (
+    DifferentialSeries,
+    DifferentialSpectrum,
+    Spectrum,
+    SpectrumError,
+)
 
 
 def test_assignment_of_differential():
@@ -23,3 +29,112 @@ def test_assignment_of_differential():
 
 # TODO:
 # Define a fixture that creates a differentail with two spectra.
+
+
+def epoch_spectra(n_epochs=6):
+    x = np.linspace(2110, 2120, 200)
+    spectra = []
+    for i in range(n_epochs):
+        y = 1 - 0.5 * np.exp(-((x - 2115 - 0.05 * i) ** 2) / 0.05)
+        spectra.append(Spectrum(xaxis=x + 0.01 * (i % 2), flux=y))
+    return spectra
+
+
+def test_differential_series_aligns_once(monkeypatch):
+    spectra = epoch_spectra()
+    series = DifferentialSeries(spectra)
+    aligned = series.aligned
+    assert aligned.shape == (len(spectra), len(spectra[0]))
+    assert series.xaxis is spectra[0].xaxis
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Alignment should be cached.")
+
+    monkeypatch.setattr(Spectrum, "spline_interpolate_to", fail)
+    assert series.aligned is aligned
+    diffs = series.diff(reference=0)
+    assert np.allclose(diffs[0], 0)
+    for i, spec in enumerate(spectra[1:], 1):
+        assert np.allclose(diffs[i], aligned[i] - aligned[0], equal_nan=True)
+
+
+def test_differential_series_matches_differential_spectrum():
+    spectra = epoch_spectra()
+    series = DifferentialSeries(spectra)
+    diffs = series.diff(reference=0)
+    # DifferentialSpectrum interpolates onto the grid of its first spectrum.
+    expected = DifferentialSpectrum(spectra[0], spectra[3]).diff()
+    assert np.allclose(-diffs[3], expected.flux, equal_nan=True)
+
+
+@pytest.mark.parametrize("n_jobs", [1, 3])
+def test_differential_series_pairwise(n_jobs):
+    spectra = epoch_spectra(5)
+    series = DifferentialSeries(spectra, grid=np.linspace(2111, 2119, 150))
+    pairs, diffs = series.pairwise(n_jobs=n_jobs)
+    assert pairs.shape == (10, 2)
+    assert diffs.shape == (10, 150)
+    for (i, j), diff in zip(pairs, diffs):
+        assert i < j
+        assert np.allclose(diff, series.aligned[i] - series.aligned[j])
+
+    pairs, diffs = series.pairwise(pairs=[[4, 0]], n_jobs=n_jobs)
+    assert np.allclose(diffs[0], series.aligned[4] - series.aligned[0])
+
+
+def test_differential_series_requires_calibration():
+    spectra = epoch_spectra(2)
+    spectra[1].calibrated = False
+    with pytest.raises(ValueError):
+        DifferentialSeries(spectra)
+
+
+def binary_epochs(primary_rvs, secondary_rvs):
+    x = np.linspace(2110, 2120, 1000)
+
+    def primary(w):
+        return 1 - 0.5 * np.exp(-((w - 2114) ** 2) / 0.02)
+
+    def secondary(w):
+        return -0.2 * np.exp(-((w - 2116) ** 2) / 0.02)
+
+    c = 299792.458
+    spectra = []
+    for rv1, rv2 in zip(primary_rvs, secondary_rvs):
+        flux = primary(x / (1 + rv1 / c)) + secondary(x / (1 + rv2 / c))
+        spectra.append(Spectrum(xaxis=x, flux=flux, calibrated=True))
+    return x, spectra, primary(x), secondary(x)
+
+
+def test_reconstruct_secondary():
+    primary_rvs = np.array([-15.0, -8.0, -2.0, 5.0, 11.0, 16.0])
+    secondary_rvs = -2.5 * primary_rvs
+    x, spectra, primary, secondary = binary_epochs(primary_rvs, secondary_rvs)
+    series = DifferentialSeries(spectra)
+    a, b = series.reconstruct(primary_rvs, secondary_rvs, max_iter=200, tol=1e-8)
+    assert a.header["reconstruction_iterations"] < 200
+    # The edges are not covered by all epochs.
+    inner = (x > 2111) & (x < 2119)
+    # The continuum of the secondary is removed, it stays in the primary.
+    assert np.allclose(b.flux[inner], secondary[inner], atol=0.005)
+    assert np.allclose(a.flux[inner], primary[inner], atol=0.005)
+
+
+def test_reconstruct_secondary_iteration_cap():
+    from spectrum_overload.differential import reconstruct_secondary
+
+    primary_rvs = np.array([-10.0, 0.0, 10.0])
+    x, spectra, __, __ = binary_epochs(primary_rvs, -primary_rvs)
+    stack = np.vstack([spec.flux for spec in spectra])
+    __, __, iterations = reconstruct_secondary(
+        x, stack, primary_rvs, -primary_rvs, max_iter=2, tol=0
+    )
+    assert iterations == 2
+    with pytest.raises(ValueError):
+        reconstruct_secondary(x, stack, primary_rvs[:2], -primary_rvs, max_iter=2)
+
+
+def test_reconstruct_requires_rvs():
+    series = DifferentialSeries(epoch_spectra(3))
+    with pytest.raises(SpectrumError):
+        series.reconstruct()
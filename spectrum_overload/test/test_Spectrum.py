@@ -7,6 +7,8 @@ It is not perfect and can be definitely improved.
 """
 from __future__ import division, print_function
 
+import pickle
+
 import hypothesis.strategies as st
 import numpy as np
 import pytest
@@ -525,3 +527,154 @@ def test_specturm_slicing_invalid_types(phoenix_spectrum, item):
     """Invalid scalars and other types."""
     with pytest.raises(ValueError):
         _ = phoenix_spectrum[item]
+
+
+def pickle_spectrum():
+    x = np.linspace(2100, 2110, 100)
+    return Spectrum(
+        xaxis=x, flux=np.sin(x), header={"OBJECT": "test"}, calibrated=False
+    )
+
+
+@pytest.mark.parametrize("protocol", [2, 4, 5])
+def test_spectrum_pickle_round_trip(protocol):
+    spec = pickle_spectrum()
+    spec.xaxis_fingerprint()
+    new_spec = pickle.loads(pickle.dumps(spec, protocol=protocol))
+    assert np.all(new_spec.xaxis == spec.xaxis)
+    assert np.all(new_spec.flux == spec.flux)
+    assert new_spec.header == spec.header
+    assert new_spec.calibrated == spec.calibrated
+    assert new_spec.same_xaxis(spec)
+    new_spec.flux[0] = 5  # In-band buffers are writable copies.
+    assert spec.flux[0] != 5
+
+
+def test_spectrum_pickle_read_only_arrays():
+    spec = pickle_spectrum()
+    spec.flux.flags.writeable = False
+    new_spec = pickle.loads(pickle.dumps(spec, protocol=5))
+    assert new_spec.flux.flags.writeable
+    assert np.all(new_spec.flux == spec.flux)
+    frozen = pickle.loads(pickle.dumps(spec.freeze(), protocol=5))
+    assert not frozen.flux.flags.writeable
+
+
+def test_spectrum_pickle_out_of_band_buffers():
+    spec = pickle_spectrum()
+    buffers = []
+    data = pickle.dumps(spec, protocol=5, buffer_callback=buffers.append)
+    assert len(buffers) == 2
+    assert len(data) < spec.flux.nbytes
+    new_spec = pickle.loads(data, buffers=buffers)
+    assert np.all(new_spec.flux == spec.flux)
+    # The arrays are not copied.
+    assert np.shares_memory(new_spec.flux, spec.flux)
+    assert np.shares_memory(new_spec.xaxis, spec.xaxis)
+
+
+def test_spectrum_pickle_without_arrays():
+    new_spec = pickle.loads(pickle.dumps(Spectrum(), protocol=5))
+    assert new_spec.xaxis is None and new_spec.flux is None
+
+
+@pytest.mark.parametrize("copy", [True, False])
+def test_spectrum_bytes_round_trip(copy):
+    spec = pickle_spectrum()
+    data = spec.to_bytes()
+    new_spec = Spectrum.from_bytes(data, copy=copy)
+    assert np.all(new_spec.xaxis == spec.xaxis)
+    assert np.all(new_spec.flux == spec.flux)
+    assert new_spec.header == spec.header
+    assert new_spec.calibrated is False
+    assert new_spec.flux.flags.writeable == copy
+
+
+def test_spectrum_bytes_with_fits_header():
+    fitshdr = fits.getheader(resource_filename("spectrum_overload", "data/spec_1.fits"))
+    flux = np.ones(5, dtype=np.float32)
+    spec = Spectrum(xaxis=np.arange(5.0), flux=flux, header=fitshdr)
+    new_spec = Spectrum.from_bytes(spec.to_bytes())
+    assert new_spec.flux.dtype == np.float32
+    assert isinstance(new_spec.header, fits.Header)
+    assert new_spec.header["OBJECT"] == fitshdr["OBJECT"]
+
+
+def test_spectrum_from_invalid_bytes():
+    with pytest.raises(ValueError):
+        Spectrum.from_bytes(b"not a spectrum")
+
+
+def test_interpolated_does_not_modify_self():
+    x = np.linspace(2100, 2110, 50)
+    spec = Spectrum(xaxis=x, flux=np.sin(x), header={"OBJECT": "test"})
+    reference = Spectrum(xaxis=np.linspace(2099, 2105, 40), flux=np.ones(40))
+    new_spec = spec.interpolated(reference)
+    assert spec.xaxis is x
+    assert new_spec.xaxis is reference.xaxis
+    assert np.all(np.isnan(new_spec.flux[reference.xaxis < 2100]))
+    new_spec.header["OBJECT"] = "changed"
+    assert spec.header["OBJECT"] == "test"
+
+    spec.spline_interpolate_to(reference)
+    assert np.allclose(new_spec.flux, spec.flux, equal_nan=True)
+
+
+def test_interpolated_invalid():
+    spec = Spectrum(xaxis=np.arange(10.0), flux=np.ones(10))
+    with pytest.raises(TypeError):
+        spec.interpolated([1, 2])
+    with pytest.raises(ValueError):
+        spec.interpolated(np.arange(5.0), kind="cubic")
+
+
+def test_finite_runs_are_cached():
+    flux = np.array([np.nan, 1, 2, np.nan, np.nan, 3, 4, 5, np.inf])
+    spec = Spectrum(xaxis=np.arange(9.0), flux=flux)
+    starts, stops = spec._finite_runs()
+    assert np.array_equal(starts, [1, 5])
+    assert np.array_equal(stops, [3, 8])
+    assert spec._finite_runs() is spec._finite_runs()
+
+    spec.mask = np.isnan(flux)
+    assert np.array_equal(spec._finite_runs()[0], [0])
+    assert np.array_equal(spec._finite_runs()[1], [5])
+    spec.flux = np.ones(9)
+    assert np.array_equal(spec._finite_runs()[1], [9 - np.sum(spec.mask)])
+
+
+@pytest.mark.parametrize("kind", ["spline", "linear"])
+def test_interpolation_with_nan_gap_is_local(kind):
+    x = np.linspace(2100, 2110, 200)
+    flux = 1 + 0.1 * np.sin(x)
+    gapped = flux.copy()
+    gapped[100:105] = np.nan
+    spec = Spectrum(xaxis=x, flux=gapped, interp_method=kind)
+    grid = np.linspace(2101, 2109, 333)
+
+    new = spec.interpolated(grid)
+    in_gap = (grid > x[99]) & (grid < x[105])
+    assert np.all(np.isnan(new.flux[in_gap]))
+    assert np.allclose(new.flux[~in_gap], 1 + 0.1 * np.sin(grid[~in_gap]), atol=1e-4)
+
+    spec.spline_interpolate_to(grid[::-1])
+    assert np.array_equal(np.isnan(spec.flux), in_gap[::-1])
+
+
+def test_operator_with_nan_spectrum_on_other_grid():
+    x = np.linspace(2100, 2110, 200)
+    flux = np.ones(200)
+    flux[50] = np.nan
+    other = Spectrum(xaxis=x, flux=flux)
+    spec = Spectrum(xaxis=x[10:-10] + 0.01, flux=np.ones(180))
+    result = spec + other
+    assert np.sum(np.isnan(result.flux)) == 2
+    assert np.allclose(result.flux[np.isfinite(result.flux)], 2)
+
+
+def test_align_is_serialized():
+    spec = Spectrum(xaxis=np.arange(5.0), flux=np.ones(5), align="union")
+    assert Spectrum.from_bytes(spec.to_bytes()).align == "union"
+    assert pickle.loads(pickle.dumps(spec, protocol=5)).align == "union"
+    assert spec.freeze().align == "union"
+    assert spec.interpolated(np.arange(3.0)).align == "union"
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""Test barycentric correction."""
+import numpy as np
+import pytest
+from astropy.io import fits
+from pkg_resources import resource_filename
+
+from spectrum_overload import DifferentialSeries, DifferentialSpectrum, Spectrum
+from spectrum_overload import SpectrumError
+from spectrum_overload import barycentric
+
+
+@pytest.fixture
+def crires_header():
+    return fits.getheader(resource_filename("spectrum_overload", "data/spec_1.fits"))
+
+
+def epochs(header, n=4):
+    x = np.linspace(2110, 2120, 100)
+    spectra = []
+    for i in range(n):
+        hdr = header.copy()
+        hdr["MJD-OBS"] = header["MJD-OBS"] + 40 * i
+        spectra.append(Spectrum(xaxis=x, flux=np.ones_like(x), header=hdr))
+    return spectra
+
+
+def test_observation_info(crires_header):
+    mjd, site, target = barycentric.observation_info(crires_header)
+    assert np.isclose(mjd, 56024.0059025 + 90 / 86400)
+    assert site == (-70.4051, -24.6276, 2648.0)
+    assert target == (71.409028, -50.07734)
+
+    with pytest.raises(SpectrumError):
+        barycentric.observation_info({"MJD-OBS": 56000})
+
+
+def test_barycentric_rv_is_cached(crires_header, monkeypatch):
+    barycentric.clear_cache()
+    info = [barycentric.observation_info(spec.header) for spec in epochs(crires_header)]
+    rvs = barycentric.barycentric_rv(*zip(*info))
+    assert rvs.shape == (4,)
+    assert np.all(np.abs(rvs) < 31)
+    # Matches PyAstronomy helcorr (heliocentric) to within a few m/s.
+    assert np.isclose(rvs[0], -5.7179, atol=0.02)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Cached corrections should be reused.")
+
+    monkeypatch.setattr(barycentric, "SkyCoord", fail)
+    assert np.all(barycentric.barycentric_rv(*zip(*info)) == rvs)
+
+
+def test_doppler_shift_spectra_matches_doppler_shift(crires_header):
+    spectra = epochs(crires_header)
+    spectra[2] = Spectrum(xaxis=spectra[2].xaxis + 1, flux=spectra[2].flux)
+    expected = [spec.copy() for spec in spectra]
+    rvs = [1.5, -3.0, 10.0, 0.5]
+    for spec, rv in zip(expected, rvs):
+        spec.doppler_shift(rv)
+    barycentric.doppler_shift_spectra(spectra, rvs)
+    for spec, exp in zip(spectra, expected):
+        assert np.allclose(spec.xaxis, exp.xaxis, rtol=1e-14)
+
+
+def test_differential_series_barycentric_correct(crires_header):
+    spectra = epochs(crires_header)
+    for spec in spectra:
+        spec.flux = 1 - 0.5 * np.exp(-((spec.xaxis - 2115) ** 2) / 0.5)
+    series = DifferentialSeries(spectra)
+    __ = series.aligned
+    rvs = series.barycentric_correct()
+    # The alignment is redone from the shifted spectra.
+    fresh = DifferentialSeries(spectra, grid=series.xaxis)
+    assert np.array_equal(series.aligned, fresh.aligned, equal_nan=True)
+    assert series.xaxis is not spectra[0].xaxis
+    expected = epochs(crires_header)[1].xaxis * (1 + rvs[1] / 299792.458)
+    assert np.allclose(spectra[1].xaxis, expected)
+    assert spectra[0].header["BERVCORR"] == rvs[0]
+    with pytest.raises(SpectrumError):
+        series.barycentric_correct()
+
+
+def test_differential_spectrum_barycentric_correct(crires_header):
+    spec1, spec2 = epochs(crires_header, 2)
+    rvs = DifferentialSpectrum(spec1, spec2).barycentric_correct()
+    assert len(rvs) == 2
+    assert rvs[0] != rvs[1]
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+"""Test the content-addressed disk cache."""
+import os
+from functools import partial
+
+import numpy as np
+import pytest
+from astropy.io.fits import Header
+
+from spectrum_overload import Spectrum
+from spectrum_overload.cache import DiskCache
+
+
+@pytest.fixture
+def spectrum():
+    x = np.linspace(2100, 2110, 500)
+    flux = 1 - 0.5 * np.exp(-((x - 2105) ** 2) / 0.01)
+    return Spectrum(xaxis=x, flux=flux, calibrated=True, header={"OBJECT": "a"})
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return DiskCache(str(tmpdir.join("cache")))
+
+
+def test_apply_stores_and_loads_memmap(cache, spectrum):
+    expected = spectrum.instrument_broaden(R=50000)
+    first = cache.apply(spectrum, "instrument_broaden", R=50000)
+    assert np.allclose(first.flux, expected.flux)
+    second = cache.apply(spectrum, "instrument_broaden", R=50000)
+    assert not second.flux.flags.owndata
+    assert not second.flux.flags.writeable
+    assert np.array_equal(second.flux, first.flux)
+    assert np.array_equal(second.xaxis, spectrum.xaxis)
+    assert second.header == first.header
+    assert second.calibrated
+
+
+def test_apply_in_place_method_uses_copy(cache, spectrum):
+    original = spectrum.flux.copy()
+    shifted = cache.apply(spectrum, "doppler_shift", 10)
+    assert np.array_equal(spectrum.flux, original)
+    assert not np.allclose(shifted.xaxis, spectrum.xaxis)
+
+
+def test_cached_result_is_used(cache, spectrum):
+    calls = []
+
+    def double(spec):
+        calls.append(1)
+        return spec * 2
+
+    cache.apply(spectrum, double, name="double")
+    result = cache.apply(spectrum, double, name="double")
+    assert len(calls) == 1
+    assert np.allclose(result.flux, 2 * spectrum.flux)
+
+
+def scale(spec, factor):
+    return spec * factor
+
+
+def shift(spec, factor):
+    return spec + factor
+
+
+def test_partials_are_keyed_by_function_and_arguments(cache, spectrum):
+    scaled = cache.apply(spectrum, partial(scale, factor=3))
+    shifted = cache.apply(spectrum, partial(shift, factor=10))
+    assert np.allclose(scaled.flux, 3 * spectrum.flux)
+    assert np.allclose(shifted.flux, spectrum.flux + 10)
+    assert cache.key(spectrum, partial(scale, factor=3)) != cache.key(
+        spectrum, partial(scale, factor=4)
+    )
+    assert cache.key(spectrum, partial(scale, 3)) == cache.key(
+        spectrum, partial(scale, 3)
+    )
+
+
+def test_unnamed_callables_need_a_name(cache, spectrum):
+    with pytest.raises(ValueError):
+        cache.apply(spectrum, lambda t: t * 2)
+    with pytest.raises(ValueError):
+        cache.apply(spectrum, partial(lambda t, f: t * f, f=2))
+    double = cache.apply(spectrum, lambda t: t * 2, name="double")
+    fivefold = cache.apply(spectrum, lambda t: t * 5, name="fivefold")
+    assert np.allclose(double.flux, 2 * spectrum.flux)
+    assert np.allclose(fivefold.flux, 5 * spectrum.flux)
+
+
+def test_key_depends_on_inputs(cache, spectrum):
+    key = cache.key(spectrum, "instrument_broaden", kwargs={"R": 50000})
+    assert key == cache.key(spectrum.copy(), "instrument_broaden", kwargs={"R": 50000})
+    assert key == cache.key(spectrum.freeze(), "instrument_broaden", kwargs={"R": 50000})
+    assert key != cache.key(spectrum, "instrument_broaden", kwargs={"R": 40000})
+    assert key != cache.key(spectrum, "normalize", kwargs={"R": 50000})
+    changed = spectrum.copy()
+    changed.flux = spectrum.flux + 1e-9
+    assert key != cache.key(changed, "instrument_broaden", kwargs={"R": 50000})
+    changed = spectrum.copy()
+    changed.header = {"OBJECT": "b"}
+    assert key != cache.key(changed, "instrument_broaden", kwargs={"R": 50000})
+    spectrum.copy().xaxis *= 1.1  # Shared with spectrum
+    assert key != cache.key(spectrum, "instrument_broaden", kwargs={"R": 50000})
+
+
+def test_key_depends_on_version(cache, spectrum, monkeypatch):
+    key = cache.key(spectrum, "normalize")
+    monkeypatch.setattr("spectrum_overload.cache.__version__", "0.0")
+    assert key != cache.key(spectrum, "normalize")
+
+
+def test_key_uses_contents_of_array_parameters(cache, spectrum):
+    grid = np.linspace(2101, 2109, 100)
+    key = cache.key(spectrum, "interpolated", (grid,))
+    assert key == cache.key(spectrum, "interpolated", (grid.copy(),))
+    assert key != cache.key(spectrum, "interpolated", (grid + 0.1,))
+
+
+def test_fits_header_round_trip(cache, spectrum):
+    header = Header()
+    header["OBJECT"] = "HD 4747"
+    spectrum.header = header
+    cache.apply(spectrum, "normalize", method="linear")
+    result = cache.apply(spectrum, "normalize", method="linear")
+    assert isinstance(result.header, Header)
+    assert result.header["OBJECT"] == "HD 4747"
+
+
+def test_non_spectrum_result_raises(cache, spectrum):
+    with pytest.raises(TypeError):
+        cache.apply(spectrum, np.sum)
+
+
+def test_lru_eviction(tmpdir, spectrum):
+    cache = DiskCache(str(tmpdir.join("cache")))
+    keys = []
+    for i in range(3):
+        keys.append(cache.key(spectrum, "multiply", kwargs={"i": i}))
+        cache.put(keys[-1], spectrum * i)
+        os.utime(os.path.join(cache.directory, keys[-1]), (i, i))
+    entry = cache.size() // 3
+    cache.get(keys[0])  # Now the most recently used.
+
+    cache.max_bytes = 3 * entry
+    cache.put(cache.key(spectrum, "multiply", kwargs={"i": 3}), spectrum * 3)
+    assert keys[0] in cache
+    assert keys[1] not in cache
+    assert keys[2] in cache
+    assert cache.size() <= cache.max_bytes
+
+    cache.clear()
+    assert cache.size() == 0
+    assert cache.get(keys[0]) is None
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""Test out-of-core chunked processing."""
+import numpy as np
+import pytest
+
+from spectrum_overload import Spectrum
+from spectrum_overload import chunked
+
+
+@pytest.fixture
+def line_spectrum():
+    x = np.linspace(2110, 2120, 5003)
+    y = 1 - 0.5 * np.exp(-((x - 2115) ** 2) / 0.01) + 0.001 * (x - 2110)
+    return Spectrum(xaxis=x, flux=y, header={"OBJECT": "test"})
+
+
+@pytest.fixture
+def memmap_line_spectrum(line_spectrum, tmpdir):
+    xaxis_file = str(tmpdir.join("wave.npy"))
+    flux_file = str(tmpdir.join("flux.npy"))
+    np.save(xaxis_file, line_spectrum.xaxis)
+    np.save(flux_file, line_spectrum.flux)
+    return chunked.memmap_spectrum(xaxis_file, flux_file, header={"OBJECT": "test"})
+
+
+@pytest.mark.parametrize("chunk_size", [100, 777, 10000])
+@pytest.mark.parametrize("edge_handling", [None, "firstlast"])
+def test_chunked_instrument_broaden(line_spectrum, chunk_size, edge_handling):
+    expected = line_spectrum.instrument_broaden(
+        20000, maxsig=5, edgeHandling=edge_handling
+    )
+    result = chunked.instrument_broaden(
+        line_spectrum, 20000, chunk_size=chunk_size, edge_handling=edge_handling
+    )
+    assert np.allclose(result.flux, expected.flux, rtol=1e-10)
+    assert result.xaxis is line_spectrum.xaxis
+
+
+def test_chunked_broaden_to_memmap(memmap_line_spectrum, line_spectrum, tmpdir):
+    out_file = str(tmpdir.join("broad.npy"))
+    result = chunked.instrument_broaden(
+        memmap_line_spectrum, 20000, out=out_file, chunk_size=500
+    )
+    expected = line_spectrum.instrument_broaden(20000, maxsig=5)
+    assert np.allclose(np.load(out_file), expected.flux, rtol=1e-10)
+
+
+def test_chunked_broaden_requires_equidistant(line_spectrum):
+    spec = Spectrum(xaxis=line_spectrum.xaxis ** 2, flux=line_spectrum.flux)
+    with pytest.raises(ValueError):
+        chunked.instrument_broaden(spec, 20000, chunk_size=500)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 333, 10000])
+@pytest.mark.parametrize("method", ["scalar", "linear", "cubic", "exponential"])
+def test_chunked_normalize(memmap_line_spectrum, line_spectrum, chunk_size, method):
+    expected = line_spectrum.normalize(method, nbins=40, ntop=10)
+    result = chunked.normalize(
+        memmap_line_spectrum, method, nbins=40, ntop=10, chunk_size=chunk_size
+    )
+    assert np.allclose(result.flux, expected.flux)
+    assert result.header["normalized"] == expected.header["normalized"]
+    assert result.header["OBJECT"] == "test"
+
+
+def test_chunked_normalize_with_nans(line_spectrum):
+    line_spectrum.flux[-1] = np.nan
+    with pytest.raises(ValueError):
+        chunked.normalize(line_spectrum, "linear", chunk_size=1000)
+
+
+@pytest.fixture
+def masked_spectrum(line_spectrum):
+    np.random.seed(3)
+    outliers = np.concatenate(
+        (np.arange(5), np.arange(700, 760), np.random.randint(0, 5003, 35))
+    )
+    flux = line_spectrum.flux.copy()
+    flux[outliers] = 100
+    mask = np.zeros(len(flux), dtype=bool)
+    mask[outliers] = True
+    return Spectrum(xaxis=line_spectrum.xaxis, flux=flux, mask=mask)
+
+
+@pytest.mark.parametrize("chunk_size", [50, 777, 10000])
+@pytest.mark.parametrize("edge_handling", [None, "firstlast"])
+def test_chunked_broaden_fills_masked_pixels(
+    masked_spectrum, chunk_size, edge_handling
+):
+    expected = masked_spectrum.instrument_broaden(
+        20000, maxsig=5, edgeHandling=edge_handling
+    )
+    result = chunked.instrument_broaden(
+        masked_spectrum, 20000, chunk_size=chunk_size, edge_handling=edge_handling
+    )
+    assert np.allclose(result.flux, expected.flux, rtol=1e-10)
+    assert np.max(result.flux) < 2
+
+
+@pytest.mark.parametrize("chunk_size", [1, 333, 10000])
+def test_chunked_normalize_skips_masked_pixels(masked_spectrum, chunk_size):
+    expected = masked_spectrum.normalize("linear", nbins=40, ntop=10)
+    result = chunked.normalize(
+        masked_spectrum, "linear", nbins=40, ntop=10, chunk_size=chunk_size
+    )
+    assert np.allclose(result.flux, expected.flux)
+    assert np.allclose(np.median(result.flux[~result.mask]), 1, atol=0.05)
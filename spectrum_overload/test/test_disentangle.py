@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""Test Fourier-space disentangling."""
+import numpy as np
+import pytest
+
+from spectrum_overload import Spectrum, SpectrumError
+from spectrum_overload.disentangle import disentangle, log_wavelength_grid
+
+c = 299792.458
+
+
+def primary(w):
+    return 1 - 0.4 * np.exp(-((w - 2114) ** 2) / 0.005) - 0.3 * np.exp(
+        -((w - 2117) ** 2) / 0.005
+    )
+
+
+def secondary(w):
+    return 1 - 0.15 * np.exp(-((w - 2115.5) ** 2) / 0.005)
+
+
+def binary_epochs(rvs):
+    x = np.linspace(2110, 2120, 2000)
+    spectra = []
+    for rv1, rv2 in rvs:
+        flux = primary(x / (1 + rv1 / c)) + secondary(x / (1 + rv2 / c)) - 1
+        spectra.append(Spectrum(xaxis=x, flux=flux, calibrated=True))
+    return spectra
+
+
+def test_log_wavelength_grid():
+    grid = log_wavelength_grid(2000, 2100, 101)
+    assert np.allclose(grid[[0, -1]], [2000, 2100])
+    assert np.allclose(np.diff(np.log(grid)), np.log(2100 / 2000) / 100)
+    with pytest.raises(ValueError):
+        log_wavelength_grid(2100, 2000, 10)
+
+
+def test_disentangle_two_components():
+    primary_rvs = np.array([-30.0, -18.0, -5.0, 6.0, 17.0, 29.0])
+    rvs = np.column_stack((primary_rvs, -1.5 * primary_rvs))
+    a, b = disentangle(binary_epochs(rvs), rvs)
+    assert a.calibrated and b.calibrated
+    inner = (a.xaxis > 2111) & (a.xaxis < 2119)
+    # Only known up to a smooth offset between the components.
+    offset = np.median(b.flux[inner]) - 1
+    assert np.allclose(a.flux[inner] + offset, primary(a.xaxis[inner]), atol=1e-3)
+    assert np.allclose(b.flux[inner] - offset, secondary(b.xaxis[inner]), atol=1e-3)
+
+
+def test_disentangle_light_factors():
+    rvs = np.array([[-20.0, 20.0], [0.0, 0.0], [20.0, -20.0], [10.0, -10.0]])
+    spectra = binary_epochs(rvs)
+    a, b = disentangle(spectra, rvs)
+    a2, b2 = disentangle(spectra, rvs, light_factors=[0.8, 0.2])
+    assert np.allclose(b2.flux - 1, (b.flux - 1) / 0.2)
+    assert np.allclose(a2.flux - 1, (a.flux - 1) / 0.8)
+
+
+def test_disentangle_validation():
+    rvs = np.array([[-20.0, 20.0], [20.0, -20.0]])
+    spectra = binary_epochs(rvs)
+    with pytest.raises(ValueError):
+        disentangle(spectra, rvs[:1])
+    with pytest.raises(ValueError):
+        disentangle(spectra, rvs, light_factors=[1.0])
+    spectra[0].calibrated = False
+    with pytest.raises(SpectrumError):
+        disentangle(spectra, rvs)
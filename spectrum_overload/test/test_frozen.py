@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+"""Test the immutable FrozenSpectrum."""
+import pickle
+
+import numpy as np
+import pytest
+
+from spectrum_overload import FrozenSpectrum, Spectrum
+
+
+@pytest.fixture
+def frozen():
+    x = np.linspace(2100, 2110, 100)
+    return FrozenSpectrum(xaxis=x, flux=1 + 0.1 * np.sin(x), header={"OBJECT": "a"})
+
+
+def test_frozen_copies_and_locks_arrays():
+    x = np.arange(10.0)
+    y = np.ones(10)
+    spec = FrozenSpectrum(xaxis=x, flux=y)
+    assert x.flags.writeable and y.flags.writeable
+    with pytest.raises(ValueError):
+        spec.flux[0] = 2
+    with pytest.raises(ValueError):
+        spec.flux += 1
+    for name, value in [("flux", y), ("xaxis", x), ("calibrated", False)]:
+        with pytest.raises(AttributeError):
+            setattr(spec, name, value)
+
+
+def test_freeze_and_thaw(frozen):
+    spec = frozen.thaw()
+    assert type(spec) is Spectrum
+    spec.flux[0] = 5
+    assert frozen.flux[0] != 5
+    refrozen = spec.freeze()
+    assert isinstance(refrozen, FrozenSpectrum)
+    assert refrozen.freeze() is refrozen
+    spec.flux[1] = 5
+    assert refrozen.flux[1] != 5
+
+
+@pytest.mark.parametrize(
+    "method, args",
+    [
+        ("wav_select", (2102, 2108)),
+        ("add_noise", (100,)),
+        ("doppler_shift", (10,)),
+        ("spline_interpolate_to", (np.linspace(2101, 2109, 50),)),
+        ("interpolate1d_to", (np.linspace(2101, 2109, 50),)),
+        ("rebin_to", (np.linspace(2101, 2109, 50),)),
+    ],
+)
+def test_in_place_methods_return_new(frozen, method, args):
+    xaxis, flux = frozen.xaxis.copy(), frozen.flux.copy()
+    result = getattr(frozen, method)(*args)
+    assert isinstance(result, FrozenSpectrum)
+    assert result is not frozen
+    assert not result.flux.flags.writeable
+    assert np.all(frozen.xaxis == xaxis) and np.all(frozen.flux == flux)
+
+    expected = frozen.thaw()
+    getattr(expected, method)(*args)
+    assert len(result) == len(expected)
+    if method != "add_noise":
+        assert np.allclose(result.flux, expected.flux, equal_nan=True)
+
+
+def test_transforms_return_frozen(frozen):
+    results = [
+        frozen + 1,
+        1 + frozen,
+        frozen - frozen,
+        frozen * 2,
+        frozen / 2,
+        frozen ** 2,
+        -frozen,
+        abs(frozen),
+        frozen[10:20],
+        np.sqrt(frozen),
+        frozen.normalize("linear"),
+        frozen.interpolated(np.linspace(2101, 2109, 20)),
+        frozen + frozen.thaw(),
+    ]
+    for result in results:
+        assert isinstance(result, FrozenSpectrum)
+        assert not result.flux.flags.writeable
+    assert np.allclose((frozen * 2).flux, 2 * frozen.flux)
+
+
+def test_hash_and_equality(frozen):
+    same = FrozenSpectrum.from_spectrum(frozen.thaw())
+    assert frozen == same
+    assert hash(frozen) == hash(same)
+    assert frozen.content_hash == same.content_hash
+    assert len({frozen, same}) == 1
+    assert frozen != frozen * 2
+    assert frozen == frozen.thaw()
+
+    other_header = FrozenSpectrum(
+        xaxis=frozen.xaxis, flux=frozen.flux, header={"OBJECT": "b"}
+    )
+    # The header is not hashed but is compared.
+    assert hash(other_header) == hash(frozen)
+    assert other_header != frozen
+
+
+def test_hash_is_cached(frozen, monkeypatch):
+    same = FrozenSpectrum.from_spectrum(frozen)
+    hash(frozen), hash(same)
+
+    def fail(*args):
+        raise AssertionError("Hash should be cached.")
+
+    monkeypatch.setattr("spectrum_overload.frozen._array_fingerprint", fail)
+    monkeypatch.setattr("spectrum_overload.spectrum._array_fingerprint", fail)
+    assert frozen == same
+    assert hash(frozen) == hash(same)
+
+
+@pytest.mark.parametrize("protocol", [2, 4, 5])
+def test_frozen_pickle(frozen, protocol):
+    new = pickle.loads(pickle.dumps(frozen, protocol=protocol))
+    assert isinstance(new, FrozenSpectrum)
+    assert new == frozen
+    assert not new.flux.flags.writeable
+    with pytest.raises(AttributeError):
+        new.flux = np.ones(100)
+
+
+def test_frozen_results_do_not_lock_caller_arrays(frozen):
+    grid = np.linspace(2101, 2109, 50)
+    reference = Spectrum(xaxis=grid.copy(), flux=np.ones(50))
+    result = frozen.interpolated(reference)
+    assert reference.xaxis.flags.writeable
+    assert not result.xaxis.flags.writeable
+
+    frozen.spline_interpolate_to(grid)
+    frozen.rebin_to(grid)
+    frozen.interpolated(grid)
+    assert grid.flags.writeable
+
+    masked = Spectrum(
+        xaxis=frozen.xaxis, flux=np.ones(100), mask=np.arange(100) == 3
+    )
+    total = frozen + masked
+    assert masked.mask.flags.writeable
+    assert not total.mask.flags.writeable and total.mask[3]
+
+
+def test_frozen_ufunc_out_is_returned(frozen):
+    out = Spectrum(xaxis=frozen.xaxis, flux=np.zeros(100))
+    result = np.sqrt(frozen, out=out)
+    assert result is out
+    assert out.flux.flags.writeable
+    assert np.allclose(out.flux, np.sqrt(frozen.flux))
+    assert isinstance(np.sqrt(frozen), FrozenSpectrum)
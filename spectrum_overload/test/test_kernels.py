@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+"""Test the compiled kernels against their reference implementations."""
+import numpy as np
+import pytest
+from PyAstronomy import pyasl
+from scipy.interpolate import InterpolatedUnivariateSpline, interp1d
+
+from spectrum_overload import Spectrum
+from spectrum_overload import kernels
+
+backends = [
+    "numpy",
+    pytest.param(
+        "numba",
+        marks=pytest.mark.skipif(not kernels.HAS_NUMBA, reason="numba not installed"),
+    ),
+]
+
+
+@pytest.fixture
+def line_spectrum():
+    x = np.linspace(2110, 2120, 800)
+    y = 1 - 0.5 * np.exp(-((x - 2115) ** 2) / 0.01) - 0.3 * np.exp(
+        -((x - 2112) ** 2) / 0.02
+    )
+    return x, y
+
+
+@pytest.mark.parametrize("backend", backends)
+def test_interp_linear_matches_interp1d(line_spectrum, backend):
+    x, y = line_spectrum
+    x_new = np.linspace(2109, 2121, 1234)
+    expected = interp1d(x, y, bounds_error=False, fill_value=np.nan)(x_new)
+    result = kernels.interp_linear(x, y, x_new, backend=backend)
+    assert np.allclose(result, expected, rtol=1e-10, equal_nan=True)
+
+
+@pytest.mark.parametrize("backend", backends)
+def test_interp_cubic_matches_spline(line_spectrum, backend):
+    x, y = line_spectrum
+    x_new = np.linspace(2109, 2121, 1234)
+    expected = InterpolatedUnivariateSpline(x, y, k=3)(x_new)
+    expected[(x_new < x[0]) | (x_new > x[-1])] = np.nan
+    result = kernels.interp_cubic(x, y, x_new, backend=backend)
+    assert np.allclose(result, expected, rtol=1e-8, atol=1e-12, equal_nan=True)
+
+
+@pytest.mark.parametrize("backend", backends)
+@pytest.mark.parametrize("edge_handling", [None, "firstlast"])
+def test_gaussian_broaden_matches_pyasl(line_spectrum, backend, edge_handling):
+    x, y = line_spectrum
+    expected = pyasl.instrBroadGaussFast(
+        x, y, 50000, maxsig=5, edgeHandling=edge_handling
+    )
+    result = kernels.gaussian_broaden(
+        x, y, 50000, maxsig=5, edge_handling=edge_handling, backend=backend
+    )
+    assert np.allclose(result, expected, rtol=1e-10)
+
+
+@pytest.mark.parametrize("backend", backends)
+def test_gaussian_broaden_full_kernel_matches_pyasl(line_spectrum, backend):
+    x, y = line_spectrum
+    expected = pyasl.instrBroadGaussFast(x, y, 5000)
+    result = kernels.gaussian_broaden(x, y, 5000, maxsig=None, backend=backend)
+    assert np.allclose(result, expected, rtol=1e-10)
+
+
+def test_gaussian_broaden_requires_equidistant(line_spectrum):
+    x, y = line_spectrum
+    with pytest.raises(ValueError):
+        kernels.gaussian_broaden(x ** 2, y, 50000)
+
+
+@pytest.mark.parametrize("backend", backends)
+def test_crosscorr_rv_matches_pyasl(line_spectrum, backend):
+    x, y = line_spectrum
+    tx = np.linspace(2100, 2130, 3000)
+    ty = 1 - 0.5 * np.exp(-((tx - 2115.05) ** 2) / 0.01)
+    expected_rv, expected_cc = pyasl.crosscorrRV(x, y, tx, ty, -50, 50, 0.5)
+    rv, cc = kernels.crosscorr_rv(x, y, tx, ty, -50, 50, 0.5, backend=backend)
+    assert np.allclose(rv, expected_rv)
+    assert np.allclose(cc, expected_cc, rtol=1e-10)
+
+
+def test_crosscorr_rv_requires_template_coverage(line_spectrum):
+    x, y = line_spectrum
+    with pytest.raises(ValueError):
+        kernels.crosscorr_rv(x, y, x, y, -50, 50, 0.5)
+
+
+def test_invalid_backend(line_spectrum):
+    x, y = line_spectrum
+    with pytest.raises(ValueError):
+        kernels.interp_linear(x, y, x, backend="fortran")
+
+
+@pytest.mark.parametrize("has_numba", [False, kernels.HAS_NUMBA])
+def test_spectrum_methods_dispatch_to_kernels(line_spectrum, monkeypatch, has_numba):
+    x, y = line_spectrum
+    monkeypatch.setattr(kernels, "HAS_NUMBA", has_numba)
+    spec = Spectrum(xaxis=x, flux=y)
+
+    broad = spec.instrument_broaden(5000)
+    assert np.allclose(broad.flux, pyasl.instrBroadGaussFast(x, y, 5000), rtol=1e-10)
+    broad = spec.instrument_broaden(5000, maxsig=5, edgeHandling="firstlast")
+    expected = pyasl.instrBroadGaussFast(x, y, 5000, maxsig=5, edgeHandling="firstlast")
+    assert np.allclose(broad.flux, expected, rtol=1e-10)
+
+    tx = np.linspace(2100, 2130, 3000)
+    template = Spectrum(xaxis=tx, flux=1 - 0.5 * np.exp(-((tx - 2115.05) ** 2) / 0.01))
+    rv, cc = spec.crosscorr_rv(template, -50, 50, 0.5)
+    expected_rv, expected_cc = pyasl.crosscorrRV(x, y, tx, template.flux, -50, 50, 0.5)
+    assert np.allclose(rv, expected_rv)
+    assert np.allclose(cc, expected_cc, rtol=1e-10)
+
+    x_new = np.linspace(2109, 2121, 1234)
+    expected = InterpolatedUnivariateSpline(x, y, k=3)(x_new)
+    expected[(x_new < x[0]) | (x_new > x[-1])] = np.nan
+    spec.spline_interpolate_to(x_new)
+    assert np.allclose(spec.flux, expected, rtol=1e-8, atol=1e-12, equal_nan=True)
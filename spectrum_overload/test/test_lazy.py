@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""Test deferred evaluation of Spectrum arithmetic."""
+import numpy as np
+import pytest
+
+import spectrum_overload.lazy as lazy
+from spectrum_overload import LazySpectrum, Spectrum, SpectrumError
+
+
+@pytest.fixture(params=[True, False], ids=["numexpr", "numpy"])
+def use_numexpr(request):
+    if request.param and lazy.numexpr is None:
+        pytest.skip("numexpr is not installed")
+    return request.param
+
+
+@pytest.fixture
+def residual_spectra():
+    x = np.linspace(2000, 2100, 60)
+    obs = Spectrum(xaxis=x, flux=np.random.random(60) + 1, header={"obs": 1})
+    model = Spectrum(xaxis=x + 0.3, flux=np.random.random(60) + 1)
+    continuum = Spectrum(xaxis=x, flux=np.linspace(1.5, 2, 60))
+    return obs, model, continuum
+
+
+def test_lazy_expression_matches_eager(residual_spectra, use_numexpr):
+    obs, model, continuum = residual_spectra
+    eager = (obs - model * 3.0) / continuum + 0.5
+
+    expression = (obs.lazy() - model.lazy() * 3.0) / continuum + 0.5
+    expression.use_numexpr = use_numexpr
+    assert isinstance(expression, LazySpectrum)
+    result = expression.evaluate()
+    assert isinstance(result, Spectrum)
+    assert np.allclose(result.flux, eager.flux, equal_nan=True)
+    assert result.xaxis is obs.xaxis
+    assert result.header == obs.header
+
+
+def test_lazy_reflected_and_unary(residual_spectra, use_numexpr):
+    obs, __, continuum = residual_spectra
+    expression = -(2 - obs.lazy()) ** 2 / (continuum * 1)
+    expression.use_numexpr = use_numexpr
+    assert np.allclose(expression.flux, -((2 - obs.flux) ** 2) / continuum.flux)
+
+
+def test_spectrum_operator_defers_to_lazy(residual_spectra):
+    obs, __, continuum = residual_spectra
+    expression = continuum - obs.lazy()
+    assert isinstance(expression, LazySpectrum)
+    assert expression.xaxis is continuum.xaxis
+    assert np.allclose(expression.flux, continuum.flux - obs.flux)
+
+
+def test_lazy_is_only_evaluated_once(residual_spectra):
+    obs, model, __ = residual_spectra
+    expression = obs.lazy() + model
+    assert expression.evaluate() is expression.evaluate()
+
+
+def test_lazy_errors(residual_spectra):
+    obs, model, __ = residual_spectra
+    with pytest.raises(TypeError):
+        obs.lazy() ** model
+    with pytest.raises(ValueError):
+        (obs.lazy() + [1, 2, 3]).evaluate()
+    uncalibrated = Spectrum(xaxis=obs.xaxis, flux=obs.flux, calibrated=False)
+    with pytest.raises(SpectrumError):
+        (obs.lazy() + uncalibrated).evaluate()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+"""Test the prefetching spectrum loader."""
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+from astropy.io import fits
+from pkg_resources import resource_filename
+
+from spectrum_overload import Spectrum
+from spectrum_overload.loader import PrefetchLoader, read_fits
+
+
+def test_read_fits_image():
+    path = resource_filename("spectrum_overload", "data/spec_1.fits")
+    spec = read_fits(path)
+    assert len(spec) == 1024
+    header = fits.getheader(path)
+    assert spec.calibrated
+    assert np.isclose(spec.xaxis[0], header["CRVAL1"])
+    assert np.allclose(np.diff(spec.xaxis), header["CDELT1"])
+    assert spec.header["OBJECT"] == header["OBJECT"]
+
+
+def test_read_fits_image_without_wcs(tmpdir):
+    path = str(tmpdir.join("pixels.fits"))
+    fits.PrimaryHDU(np.ones(10)).writeto(path)
+    spec = read_fits(path)
+    assert not spec.calibrated
+    assert np.all(spec.xaxis == np.arange(10))
+
+
+def test_read_fits_table():
+    path = resource_filename("spectrum_overload", "data/spec_wavecal.fits")
+    spec = read_fits(path)
+    data = fits.getdata(path)
+    assert spec.calibrated
+    assert np.allclose(spec.xaxis, data["Wavelength"])
+    assert np.allclose(spec.flux, data["Extracted_DRACS"])
+
+
+def test_read_fits_linear_wcs(tmpdir):
+    hdu = fits.PrimaryHDU(np.ones(10))
+    hdu.header.update(CRVAL1=2100.0, CDELT1=0.5, CRPIX1=1)
+    path = str(tmpdir.join("wcs.fits"))
+    hdu.writeto(path)
+    spec = read_fits(path)
+    assert spec.calibrated
+    assert np.allclose(spec.xaxis, 2100 + 0.5 * np.arange(10))
+
+
+class SlowReader(object):
+    """Reader recording the number of concurrent reads."""
+
+    def __init__(self, delay=0.02):
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self.started = []
+        self.lock = threading.Lock()
+
+    def __call__(self, path):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.started.append(path)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        return Spectrum(xaxis=np.arange(3), flux=np.ones(3), header={"path": path})
+
+
+def collect(loader, work=0.0):
+    async def run():
+        results = []
+        async with loader:
+            async for spec in loader:
+                results.append(spec.header["path"])
+                await asyncio.sleep(work)
+        return results
+
+    return asyncio.run(run())
+
+
+def test_prefetch_loader_preserves_order():
+    reader = SlowReader()
+    paths = list(range(10))
+    assert collect(PrefetchLoader(paths, reader=reader, prefetch=3)) == paths
+    assert 1 < reader.max_active <= 3
+
+
+def test_prefetch_loader_backpressure():
+    reader = SlowReader(delay=0.001)
+
+    async def run():
+        loader = PrefetchLoader(range(20), reader=reader, prefetch=2)
+        await loader.__anext__()
+        await asyncio.sleep(0.05)
+        # Only the prefetch window is read ahead of the slow consumer.
+        started = len(reader.started)
+        await loader.aclose()
+        return started
+
+    assert asyncio.run(run()) == 3
+
+
+def test_prefetch_loader_overlaps_reads_with_work():
+    reader = SlowReader(delay=0.01)
+
+    async def run():
+        started = []
+        async with PrefetchLoader(range(6), reader=reader, prefetch=2) as loader:
+            async for spec in loader:
+                await asyncio.sleep(0.05)  # Work on spec
+                started.append(len(reader.started))
+        return started
+
+    # The next read started while the consumer worked on each spectrum.
+    started = asyncio.run(run())
+    assert all(n > i + 1 for i, n in enumerate(started[:-1]))
+    assert reader.max_active <= 2
+
+
+def test_prefetch_loader_read_error():
+    def reader(path):
+        if path == 2:
+            raise IOError("Cannot read")
+        return Spectrum(xaxis=[0], flux=[0], header={"path": path})
+
+    with pytest.raises(IOError):
+        collect(PrefetchLoader(range(5), reader=reader))
+
+
+def test_prefetch_loader_invalid_prefetch():
+    with pytest.raises(ValueError):
+        PrefetchLoader([], prefetch=0)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+"""Test masked pixels carried through Spectrum operations."""
+import pickle
+
+import numpy as np
+import pytest
+
+from spectrum_overload import Spectrum
+from spectrum_overload.resample import rebin
+
+
+@pytest.fixture
+def masked():
+    x = np.linspace(2100, 2110, 200)
+    flux = 1 - 0.3 * np.exp(-((x - 2105) ** 2) / 0.5) + 0.01 * x / 2100
+    flux[[50, 51, 120]] = np.nan
+    spec = Spectrum(xaxis=x, flux=flux, header={"OBJECT": "a"})
+    spec.mask_nans()
+    return spec
+
+
+def test_mask_validation():
+    spec = Spectrum(xaxis=np.arange(5.0), flux=np.ones(5))
+    assert spec.mask is None
+    spec.mask = [0, 1, 0, 0, 0]
+    assert spec.mask.dtype == bool
+    with pytest.raises(ValueError):
+        spec.mask = [True, False]
+    with pytest.raises(ValueError):
+        Spectrum(flux=np.ones(3), mask=np.zeros(4, dtype=bool))
+
+
+def test_mask_dropped_when_flux_length_changes(masked):
+    masked.flux = masked.flux + 1
+    assert masked.mask is not None
+    masked.flux = np.ones(5)
+    assert masked.mask is None
+
+
+def test_mask_nans_keeps_grid(masked):
+    assert np.array_equal(np.where(masked.mask)[0], [50, 51, 120])
+    assert len(masked) == 200
+
+
+def test_operators_combine_masks(masked):
+    other = Spectrum(xaxis=masked.xaxis, flux=np.ones(200), mask=np.zeros(200))
+    other.mask = np.arange(200) == 10
+    result = masked * other
+    assert np.array_equal(np.where(result.mask)[0], [10, 50, 51, 120])
+    assert (masked + 1).mask is masked.mask
+    assert np.array_equal(np.sqrt(masked * other).mask, result.mask)
+
+
+def test_operator_on_other_grid_maps_mask(masked):
+    other = Spectrum(xaxis=masked.xaxis + 0.01, flux=np.ones(200))
+    other.mask = np.arange(200) == 100
+    result = other + masked
+    assert result.same_xaxis(other)
+    assert np.all(np.isfinite(result.flux[~result.mask][1:-1]))
+    assert result.mask[100] and result.mask[50] and result.mask[120]
+
+
+def test_interpolation_skips_masked_pixels(masked):
+    grid = np.linspace(2101, 2109, 300)
+    for new in (
+        masked.interpolated(grid, kind="linear"),
+        masked.interpolated(grid, kind="spline"),
+    ):
+        assert np.all(np.isfinite(new.flux))
+        near = np.abs(grid - masked.xaxis[50]) < np.diff(masked.xaxis)[0]
+        assert np.all(new.mask[near])
+        assert np.sum(new.mask) < 10
+
+    spec = masked.copy()
+    spec.spline_interpolate_to(grid)
+    assert np.all(np.isfinite(spec.flux))
+    assert np.array_equal(spec.mask, masked.interpolated(grid).mask)
+    spec = masked.copy()
+    spec.interpolate1d_to(grid)
+    assert np.all(np.isfinite(spec.flux))
+
+
+def test_rebin_masks_bins_with_masked_pixels(masked):
+    grid = masked.xaxis[::4]
+    spec = masked.copy()
+    spec.rebin_to(grid)
+    assert np.all(np.isfinite(spec.flux[1:-1]))
+    assert spec.mask[np.searchsorted(grid, masked.xaxis[50])]
+    assert np.array_equal(rebin([masked], grid)[0].mask, spec.mask)
+
+
+def test_continuum_and_normalize_with_mask(masked):
+    with pytest.raises(ValueError):
+        Spectrum(xaxis=masked.xaxis, flux=masked.flux).continuum("linear")
+    continuum = masked.continuum("linear", nbins=10, ntop=5)
+    assert np.all(np.isfinite(continuum.flux))
+    normalized = masked.normalize("linear", nbins=10, ntop=5)
+    assert np.array_equal(normalized.mask, masked.mask)
+    assert np.allclose(np.nanmedian(normalized.flux[~normalized.mask]), 1, atol=0.05)
+
+
+def test_broaden_with_mask(masked):
+    broad = masked.instrument_broaden(R=10000)
+    assert np.all(np.isfinite(broad.flux))
+    assert np.array_equal(broad.mask, masked.mask)
+
+
+def test_slicing_and_wav_select(masked):
+    sliced = masked[40:60]
+    assert np.array_equal(np.where(sliced.mask)[0], [10, 11])
+    masked.wav_select(2102, 2108)
+    assert len(masked.mask) == len(masked)
+    assert np.sum(masked.mask) == 3
+
+
+def test_mask_serialization(masked):
+    for new in (
+        pickle.loads(pickle.dumps(masked, protocol=5)),
+        Spectrum.from_bytes(masked.to_bytes()),
+    ):
+        assert np.array_equal(new.mask, masked.mask)
+    frozen = masked.freeze()
+    assert not frozen.mask.flags.writeable
+    assert frozen.content_hash != Spectrum(
+        xaxis=masked.xaxis, flux=masked.flux
+    ).freeze().content_hash
+    assert np.array_equal(frozen.thaw().mask, masked.mask)
+
+
+def test_lazy_combines_masks(masked):
+    other = Spectrum(xaxis=masked.xaxis, flux=np.ones(200))
+    other.mask = np.arange(200) == 10
+    result = (masked.lazy() * other + 1).evaluate()
+    assert np.array_equal(result.mask, (masked * other).mask)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""Test the Monte Carlo noise realizations."""
+import numpy as np
+import pytest
+
+from spectrum_overload import Spectrum
+from spectrum_overload.noise import (
+    iter_noise_realizations,
+    monte_carlo,
+    noise_realizations,
+)
+
+
+@pytest.fixture
+def spectrum():
+    x = np.linspace(2100, 2110, 1000)
+    return Spectrum(xaxis=x, flux=2 - np.exp(-((x - 2105) ** 2)))
+
+
+def test_noise_realizations_statistics(spectrum):
+    stack = noise_realizations(spectrum, 2000, snr=50, seed=1)
+    assert stack.shape == (2000, 1000)
+    assert np.allclose(stack.mean(axis=0), spectrum.flux, atol=0.01)
+    assert np.allclose(stack.std(axis=0), spectrum.flux / 50, rtol=0.1)
+
+    stack = noise_realizations(spectrum, 2000, sigma=0.1, seed=1)
+    assert np.allclose(stack.std(axis=0), 0.1, rtol=0.1)
+
+
+def test_seeding_is_reproducible_and_chunk_independent(spectrum):
+    stack = noise_realizations(spectrum, 10, sigma=0.1, seed=7)
+    assert np.array_equal(stack, noise_realizations(spectrum, 10, sigma=0.1, seed=7))
+    assert not np.allclose(stack, noise_realizations(spectrum, 10, sigma=0.1, seed=8))
+    chunks = list(iter_noise_realizations(spectrum, 10, sigma=0.1, seed=7, chunk_size=3))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 3, 1]
+    assert np.array_equal(np.vstack(chunks), stack)
+    # Realizations are independent streams, not repeated rows.
+    assert not np.allclose(stack[0], stack[1])
+
+
+def test_noise_does_not_use_global_state(spectrum):
+    np.random.seed(0)
+    first = noise_realizations(spectrum, 2, sigma=0.1, seed=3)
+    np.random.seed(1)
+    assert np.array_equal(first, noise_realizations(spectrum, 2, sigma=0.1, seed=3))
+
+
+def test_noise_parameters(spectrum):
+    with pytest.raises(ValueError):
+        noise_realizations(spectrum, 2)
+    with pytest.raises(ValueError):
+        noise_realizations(spectrum, 2, snr=10, sigma=0.1)
+    with pytest.raises(ValueError):
+        noise_realizations(spectrum, 2, sigma=np.ones(3))
+    with pytest.raises(ValueError):
+        list(iter_noise_realizations(spectrum, 2, sigma=0.1, chunk_size=0))
+    assert noise_realizations(spectrum, 0, sigma=0.1).shape == (0, 1000)
+    sigma = np.linspace(0.01, 0.1, 1000)
+    stack = noise_realizations(spectrum, 1000, sigma=sigma, seed=2)
+    assert np.allclose(stack.std(axis=0), sigma, rtol=0.2)
+
+
+def test_monte_carlo(spectrum):
+    results = monte_carlo(
+        spectrum, lambda s: np.mean(s.flux), 50, sigma=0.1, seed=4, chunk_size=7
+    )
+    stack = noise_realizations(spectrum, 50, sigma=0.1, seed=4)
+    assert np.allclose(results, stack.mean(axis=1))
+
+
+def test_add_noise_with_generator(spectrum):
+    first = spectrum.copy()
+    first.flux = spectrum.flux.copy()
+    first.add_noise(100, rng=np.random.default_rng(5))
+    second = spectrum.copy()
+    second.flux = spectrum.flux.copy()
+    second.add_noise(100, rng=np.random.default_rng(5))
+    assert np.array_equal(first.flux, second.flux)
+    assert not np.array_equal(first.flux, spectrum.flux)
+    second.add_noise_sigma(0.1, rng=np.random.default_rng(5))
+    assert not np.array_equal(first.flux, second.flux)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+"""Test the Keplerian orbit model."""
+import numpy as np
+import pytest
+
+from spectrum_overload import DifferentialSeries, DifferentialSpectrum, Spectrum
+from spectrum_overload import SpectrumError, orbit
+
+params = {
+    "period": 100.0,
+    "tau": 56000.0,
+    "e": 0.3,
+    "omega": 60.0,
+    "k1": 20.0,
+    "k2": 35.0,
+    "gamma": 5.0,
+}
+
+
+@pytest.mark.parametrize("e", [0, 0.1, 0.5, 0.9, 0.99])
+def test_solve_kepler(e):
+    mean_anomaly = np.linspace(-10, 10, 1001)
+    E = orbit.solve_kepler(mean_anomaly, e)
+    assert np.allclose(E - e * np.sin(E), np.mod(mean_anomaly, 2 * np.pi), atol=1e-10)
+
+
+def test_solve_kepler_broadcasts_eccentricity():
+    e = np.array([[0.0], [0.4], [0.8]])
+    E = orbit.solve_kepler(np.linspace(0, 6, 50), e)
+    assert E.shape == (3, 50)
+    assert np.allclose(E[0], np.linspace(0, 6, 50))
+
+
+def test_solve_kepler_invalid_eccentricity():
+    with pytest.raises(ValueError):
+        orbit.solve_kepler(1.0, 1.0)
+
+
+def test_radial_velocity_circular_orbit():
+    circular = dict(params, e=0.0, omega=0.0)
+    times = circular["tau"] + np.array([0, 25, 50, 75])
+    rv = orbit.radial_velocity(times, circular, "primary")
+    assert np.allclose(rv, 5 + 20 * np.array([1, 0, -1, 0]), atol=1e-10)
+    rv2 = orbit.radial_velocity(times, circular, "secondary")
+    assert np.allclose(rv2, 5 - 35 * np.array([1, 0, -1, 0]), atol=1e-10)
+
+
+def test_radial_velocity_over_parameter_grid():
+    times = np.linspace(56000, 56200, 30)
+    grid = dict(params, period=np.array([[90.0], [100.0], [110.0]]))
+    rv = orbit.radial_velocity(times, grid)
+    assert rv.shape == (3, 30)
+    assert np.allclose(rv[1], orbit.radial_velocity(times, params))
+    # Mean over a full orbit weighted by time is gamma.
+    full_orbit = np.linspace(56000, 56100, 100001)
+    assert np.isclose(np.mean(orbit.radial_velocity(full_orbit, params)), 5, atol=1e-3)
+
+
+def test_radial_velocity_missing_param():
+    with pytest.raises(KeyError):
+        orbit.radial_velocity(56000, {"period": 1})
+    with pytest.raises(ValueError):
+        orbit.radial_velocity(56000, params, "tertiary")
+
+
+def test_rest_frame_of_differential_series():
+    x = np.linspace(2110, 2120, 2000)
+    times = 56000 + np.array([0, 20, 45, 70])
+    rvs = orbit.radial_velocity(times, params, "primary")
+    spectra = []
+    for rv, t in zip(rvs, times):
+        spec = Spectrum(
+            xaxis=x, flux=1 - 0.5 * np.exp(-((x - 2115) ** 2) / 0.01), header={"MJD-OBS": t}
+        )
+        spec.doppler_shift(rv)
+        spectra.append(spec)
+    series = DifferentialSeries(spectra, grid=x)
+    series.add_orbital_params(params)
+    __ = series.aligned
+    removed = series.rest_frame("primary")
+    assert np.allclose(removed, rvs)
+    # Independent of whether the alignment was computed before the shift.
+    assert np.array_equal(
+        series.aligned, DifferentialSeries(spectra, grid=x).aligned, equal_nan=True
+    )
+    # In the rest frame of the primary the epochs line up again.
+    diffs = series.diff(reference=0)
+    assert np.nanmax(np.abs(diffs)) < 1e-3
+    for spec in spectra:
+        assert np.allclose(spec.xaxis, x, rtol=1e-8)
+
+
+def test_rest_frame_of_differential_spectrum():
+    x = np.linspace(2110, 2120, 100)
+    spec1 = Spectrum(xaxis=x, flux=np.ones_like(x))
+    spec2 = Spectrum(xaxis=x, flux=np.ones_like(x))
+    diff = DifferentialSpectrum(spec1, spec2)
+    with pytest.raises(SpectrumError):
+        diff.rest_frame("primary", times=[56000, 56010])
+    diff.add_orbital_params(params)
+    rvs = diff.rest_frame("secondary", times=[56000, 56010])
+    assert np.allclose(rvs, orbit.radial_velocity([56000, 56010], params, "secondary"))
+    assert np.allclose(spec1.xaxis, x * (1 - rvs[0] / 299792.458))
@@ -666,3 +666,178 @@ def test_operation_wrapper_returns_ofunc():
     # Check that the wrapper return is a function.
     assert isinstance(ofunc, types.FunctionType)
     assert ofunc.__name__ == "ofunc"
+
+
+def test_operation_with_shared_xaxis_skips_interpolation(monkeypatch):
+    s = Spectrum(xaxis=[1., 2, 3, 4], flux=[2., 4, 6, 8])
+    t = s.copy()
+    assert s.xaxis is t.xaxis
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Interpolation should not be called.")
+
+    monkeypatch.setattr(Spectrum, "spline_interpolate_to", fail)
+    assert np.all((s + t).flux == [4, 8, 12, 16])
+    # Equal values in a different array also match.
+    u = Spectrum(xaxis=[1., 2, 3, 4], flux=[1., 1, 1, 1])
+    assert np.all((s - u).flux == [1, 3, 5, 7])
+
+
+def test_xaxis_fingerprint_reset_on_assignment():
+    s = Spectrum(xaxis=[1., 2, 3, 4], flux=[2., 4, 6, 8])
+    t = s.copy()
+    fingerprint = s.xaxis_fingerprint()
+    assert fingerprint == t.xaxis_fingerprint()
+    t.xaxis = t.xaxis + 0.5
+    assert t.xaxis_fingerprint() != fingerprint
+    assert not s.same_xaxis(t)
+    assert s.xaxis_fingerprint() == fingerprint
+
+
+def test_same_xaxis_after_in_place_change_of_shared_xaxis():
+    s = Spectrum(xaxis=[1., 2, 3, 4], flux=[2., 4, 6, 8])
+    u = Spectrum(xaxis=[1., 2, 3, 4], flux=[1., 1, 1, 1])
+    assert s.same_xaxis(u)
+    t = s.copy()
+    t.xaxis += 0.5  # Changes the xaxis array shared with s.
+    assert not s.same_xaxis(u)
+    assert np.isnan((s - u).flux[-1])
+
+
+def test_same_xaxis_with_different_dtypes():
+    s = Spectrum(xaxis=[1, 2, 3, 4], flux=[2., 4, 6, 8])
+    t = Spectrum(xaxis=[1., 2., 3., 4.], flux=[2., 4, 6, 8])
+    assert s.same_xaxis(t)
+    assert not s.same_xaxis(Spectrum(xaxis=[1, 2, 3, 5], flux=[2., 4, 6, 8]))
+
+
+#######################################################
+#    Numpy array protocol
+#######################################################
+def test_ufunc_returns_spectrum_with_header():
+    hdr = {"this": "header"}
+    s = Spectrum(xaxis=[1., 2, 3, 4], flux=[1., 4, 9, 16], header=hdr)
+    result = np.sqrt(s)
+    assert isinstance(result, Spectrum)
+    assert np.allclose(result.flux, [1, 2, 3, 4])
+    assert result.xaxis is s.xaxis
+    assert result.header == hdr
+    assert np.all(s.flux == [1, 4, 9, 16])  # s didn't change
+
+
+def test_ufunc_with_out_spectrum_is_in_place():
+    s = Spectrum(xaxis=[1., 2, 3, 4], flux=[1., 4, 9, 16])
+    flux = s.flux
+    result = np.sqrt(s, out=s)
+    assert result is s
+    assert s.flux is flux
+    assert np.allclose(s.flux, [1, 2, 3, 4])
+
+
+def test_ufunc_aligns_spectra_like_operators():
+    x = np.array([1, 5, 7, 8, 12])
+    s = Spectrum(xaxis=x, flux=[1., 2, 1, 2, 1])
+    t = Spectrum(xaxis=x + 1, flux=[3., 1, 1, 4, 1])
+    assert np.allclose(np.add(s, t).flux, (s + t).flux, equal_nan=True)
+
+
+def test_ufunc_with_array_first():
+    s = Spectrum(xaxis=[1., 2, 3, 4], flux=[1., 2, 3, 4])
+    result = np.arange(4) + s
+    assert isinstance(result, Spectrum)
+    assert np.all(result.flux == [1, 3, 5, 7])
+
+
+def test_ufunc_raises_on_calibration_mismatch():
+    s = Spectrum(xaxis=[1., 2, 3, 4], flux=[1., 2, 3, 4], calibrated=True)
+    t = Spectrum(xaxis=[1., 2, 3, 4], flux=[1., 2, 3, 4], calibrated=False)
+    with pytest.raises(SpectrumError):
+        np.multiply(s, t)
+
+
+def test_array_protocol_for_non_ufuncs():
+    s = Spectrum(xaxis=[1., 2, 3, 4], flux=[1., 5, 3, 0])
+    assert np.all(np.asarray(s) == s.flux)
+    assert np.add.reduce(s) == 9
+    clipped = np.clip(s, 1, 4)
+    assert isinstance(clipped, Spectrum)
+    assert np.all(clipped.flux == [1, 4, 3, 1])
+
+
+def test_align_modes_on_partial_overlap():
+    s3 = Spectrum(flux=[1, 3, 1, 2, 3, 2], xaxis=[3, 4, 5, 6, 7, 8])
+    s4 = Spectrum(flux=[1, 2, 1, 2, 1, 2, 1], xaxis=[4, 5, 6, 7, 8, 9, 10])
+    left = s3 + s4
+
+    s3.align = "intersection"
+    inter = s3 + s4
+    assert np.array_equal(inter.xaxis, [4, 5, 6, 7, 8])
+    assert np.allclose(inter.flux, left.flux[1:])
+    assert inter.align == "intersection"
+
+    s3.align = "union"
+    union = s3 + s4
+    assert np.array_equal(union.xaxis, [3, 4, 5, 6, 7, 8, 9, 10])
+    assert np.allclose(union.flux[1:6], left.flux[1:])
+    assert np.all(np.isnan(union.flux[[0, 6, 7]]))
+
+    # Same grids are unaffected.
+    assert np.array_equal((s3 - s3).xaxis, s3.xaxis)
+
+
+def test_align_intersection_without_overlap():
+    s1 = Spectrum(flux=[1, 2, 1], xaxis=[1, 2, 3], align="intersection")
+    s2 = Spectrum(flux=[1, 2, 1], xaxis=[5, 6, 7])
+    with pytest.raises(ValueError):
+        s1 * s2
+    s1.align = "union"
+    union = s1 * s2
+    assert np.array_equal(union.xaxis, [1, 2, 3, 5, 6, 7])
+    assert np.all(np.isnan(union.flux))
+
+
+def test_align_only_interpolates_overlap():
+    x = np.linspace(2100, 2110, 1000)
+    s1 = Spectrum(flux=np.ones(1000), xaxis=x, align="intersection")
+    s2 = Spectrum(flux=2 * np.ones(100), xaxis=np.linspace(2104.005, 2105.005, 100))
+    mask = np.zeros(100, dtype=bool)
+    mask[50] = True
+    s2.mask = mask
+    result = s1 / s2
+    assert result.xaxis[0] >= s2.xaxis[0] and result.xaxis[-1] <= s2.xaxis[-1]
+    assert np.allclose(result.flux, 0.5)
+    assert np.sum(result.mask) > 0
+
+    frozen = s1.freeze() / s2
+    assert np.array_equal(frozen.xaxis, result.xaxis)
+
+
+@pytest.mark.parametrize("align", ["intersection", "union"])
+def test_ufuncs_and_lazy_follow_align(align):
+    x = np.linspace(2100, 2110, 101)
+    s1 = Spectrum(flux=1 + x / 1e4, xaxis=x, align=align)
+    s2 = Spectrum(flux=2 + x / 1e4, xaxis=x + 5)
+    expected = s1 + s2
+    for result in (np.add(s1, s2), (s1.lazy() + s2).evaluate()):
+        assert np.array_equal(result.xaxis, expected.xaxis)
+        assert np.allclose(result.flux, expected.flux, equal_nan=True)
+    assert len(np.add(s1, s2)) == len(expected)
+    with pytest.raises(SpectrumError):
+        np.add(s1, s2, out=s1)
+
+
+def test_align_needs_ascending_xaxis():
+    s1 = Spectrum(flux=[1, 2, 1, 2], xaxis=[4, 3, 2, 1], align="intersection")
+    s2 = Spectrum(flux=[1, 2, 1], xaxis=[2, 3, 4])
+    with pytest.raises(ValueError, match="ascending"):
+        s1 + s2
+    with pytest.raises(ValueError, match="ascending"):
+        np.multiply(s1, s2)
+
+
+def test_invalid_align_mode():
+    with pytest.raises(ValueError):
+        Spectrum(flux=[1, 2], align="right")
+    spec = Spectrum(flux=[1, 2])
+    with pytest.raises(ValueError):
+        spec.align = "outer"
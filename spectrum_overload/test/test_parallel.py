@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""Test the shared memory parallel map."""
+from functools import partial
+
+import numpy as np
+import pytest
+
+from spectrum_overload import Spectrum
+from spectrum_overload import chunked
+from spectrum_overload.parallel import interpolate_spectra, parallel_map
+
+
+def spectra(n=5):
+    x = np.linspace(2110, 2120, 500)
+    return [
+        Spectrum(
+            xaxis=x + i,
+            flux=1 + 0.1 * np.sin(x * (i + 1)),
+            header={"index": i},
+            calibrated=True,
+        )
+        for i in range(n)
+    ]
+
+
+def double(spectrum):
+    return Spectrum(
+        xaxis=spectrum.xaxis, flux=2 * spectrum.flux, header=dict(spectrum.header)
+    )
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_parallel_map_spectra(n_jobs):
+    inputs = spectra()
+    results = parallel_map(double, inputs, n_jobs=n_jobs)
+    assert len(results) == len(inputs)
+    for spec, result in zip(inputs, results):
+        assert np.allclose(result.xaxis, spec.xaxis)
+        assert np.allclose(result.flux, 2 * spec.flux)
+        assert result.header == spec.header
+
+
+def test_parallel_map_matches_serial():
+    inputs = spectra()
+    func = partial(chunked.instrument_broaden, R=20000)
+    expected = [func(spec) for spec in inputs]
+    for result, spec in zip(parallel_map(func, inputs, n_jobs=2), expected):
+        assert np.allclose(result.flux, spec.flux)
+
+
+def test_parallel_map_arrays_with_out_length():
+    inputs = spectra(4)
+    results = parallel_map(
+        lambda s: np.array([s.flux.min(), s.flux.max()]), inputs, n_jobs=2, out_length=2
+    )
+    for spec, result in zip(inputs, results):
+        assert np.allclose(result, [spec.flux.min(), spec.flux.max()])
+
+
+def test_parallel_map_inputs_are_read_only():
+    def modify(spectrum):
+        spectrum.flux[0] = 0
+        return spectrum
+
+    with pytest.raises(ValueError):
+        parallel_map(modify, spectra(2), n_jobs=2)
+
+
+def test_parallel_map_wrong_length():
+    with pytest.raises(ValueError):
+        parallel_map(lambda s: s[:10], spectra(2), n_jobs=2)
+
+
+@pytest.mark.parametrize("kind", ["linear", "spline"])
+@pytest.mark.parametrize("n_jobs", [1, 3])
+def test_interpolate_spectra(kind, n_jobs):
+    inputs = spectra(6)
+    reference = np.linspace(2112, 2118, 300)
+    originals = [(spec.xaxis.copy(), spec.flux.copy()) for spec in inputs]
+    results = interpolate_spectra(inputs, reference, n_jobs=n_jobs, kind=kind)
+    for spec, result, (xaxis, flux) in zip(inputs, results, originals):
+        # The inputs are not modified.
+        assert np.all(spec.xaxis == xaxis) and np.all(spec.flux == flux)
+        expected = spec.copy()
+        if kind == "linear":
+            expected.interpolate1d_to(reference)
+        else:
+            expected.spline_interpolate_to(reference)
+        assert result.xaxis is reference
+        assert np.allclose(result.flux, expected.flux, equal_nan=True)
+        assert result.header == spec.header
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+"""Test resampling with sparse matrices."""
+import numpy as np
+import pytest
+
+from spectrum_overload import Spectrum
+from spectrum_overload import resample
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    resample.clear_cache()
+    yield
+    resample.clear_cache()
+
+
+def test_bin_edges():
+    assert np.allclose(resample.bin_edges([1.0, 2.0, 4.0]), [0.5, 1.5, 3.0, 5.0])
+    with pytest.raises(ValueError):
+        resample.bin_edges([1.0, 3.0, 2.0])
+
+
+def test_overlap_matrix_rows_sum_to_one():
+    source = np.linspace(2000, 2010, 101)
+    target = np.linspace(2001, 2009, 17)
+    matrix = resample.overlap_matrix(source, target)
+    assert matrix.shape == (17, 101)
+    assert np.allclose(matrix.sum(axis=1), 1)
+
+
+def test_rebin_conserves_flux():
+    x = np.linspace(2000, 2010, 1001)
+    flux = 1 - 0.5 * np.exp(-((x - 2005) ** 2) / 0.1)
+    spec = Spectrum(xaxis=x, flux=flux)
+    coarse = x[::10]
+    spec.rebin_to(coarse)
+    assert spec.xaxis is coarse
+    # The equivalent width of the line is conserved.
+    valid = np.isfinite(spec.flux)
+    coarse_widths = np.diff(resample.bin_edges(coarse))[valid]
+    fine_widths = np.diff(resample.bin_edges(x))
+    assert np.isclose(
+        np.sum((1 - spec.flux[valid]) * coarse_widths),
+        np.sum((1 - flux) * fine_widths),
+        rtol=1e-9,
+    )
+
+
+def test_rebin_to_identical_grid():
+    x = np.linspace(2000, 2010, 50)
+    spec = Spectrum(xaxis=x, flux=np.random.random(50))
+    expected = spec.flux.copy()
+    spec.rebin_to(Spectrum(xaxis=x.copy(), flux=x))
+    assert np.allclose(spec.flux, expected)
+
+
+def test_rebin_uncovered_bins_are_nan():
+    spec = Spectrum(xaxis=np.linspace(2000, 2010, 101), flux=np.ones(101))
+    spec.rebin_to(np.linspace(2005, 2015, 11))
+    assert np.all(np.isnan(spec.flux[6:]))
+    assert np.allclose(spec.flux[:5], 1)
+
+
+def test_rebin_to_invalid_type():
+    spec = Spectrum(xaxis=np.linspace(2000, 2010, 10), flux=np.ones(10))
+    with pytest.raises(TypeError):
+        spec.rebin_to([2001, 2002])
+
+
+def test_rebin_many_builds_one_matrix(monkeypatch):
+    x = np.linspace(2000, 2010, 200)
+    spectra = [Spectrum(xaxis=x, flux=np.random.random(200)) for __ in range(5)]
+    spectra.append(Spectrum(xaxis=x + 0.01, flux=np.random.random(200)))
+    target = np.linspace(2001, 2009, 40)
+    calls = []
+    original = resample.overlap_matrix
+
+    def counting(source, target):
+        calls.append(1)
+        return original(source, target)
+
+    monkeypatch.setattr(resample, "overlap_matrix", counting)
+    rebinned = resample.rebin(spectra, target)
+    assert len(calls) == 2
+    for spec, result in zip(spectra, rebinned):
+        single = spec.copy()
+        single.rebin_to(target)
+        assert np.allclose(result.flux, single.flux, equal_nan=True)
+    # The matrices are cached for further calls.
+    resample.rebin(spectra, target)
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize("kind", ["linear", "cubic"])
+def test_resampler_matches_interpolation(kind):
+    x = np.sort(np.random.uniform(2000, 2010, 300))
+    flux = np.sin(x) + np.random.random(300) * 0.1
+    target = np.linspace(1999, 2011, 500)
+    expected = Spectrum(xaxis=x, flux=flux)
+    if kind == "linear":
+        expected.interpolate1d_to(target)
+    else:
+        expected.spline_interpolate_to(target)
+    result = resample.Resampler(x, target, kind=kind)(flux)
+    assert np.allclose(result, expected.flux, equal_nan=True)
+    assert np.all(np.isnan(result[(target < x[0]) | (target > x[-1])]))
+
+
+@pytest.mark.parametrize("kind", ["linear", "cubic", "rebin"])
+def test_resampler_stack_matches_single(kind):
+    x = np.linspace(2000, 2010, 100)
+    stack = np.random.random((4, 100))
+    resampler = resample.Resampler(x, np.linspace(2001, 2009, 33), kind=kind)
+    result = resampler(stack)
+    assert result.shape == (4, 33)
+    for flux, row in zip(stack, result):
+        assert np.allclose(resampler(flux), row, equal_nan=True)
+
+
+def test_resampler_is_cached_by_fingerprint(monkeypatch):
+    x = np.linspace(2000, 2010, 100)
+    target = np.linspace(2001, 2009, 50)
+    first = resample.Resampler(x, target, kind="cubic")
+
+    def fail(*args):
+        raise AssertionError("Operator should be cached.")
+
+    monkeypatch.setattr(resample, "cubic_operator", fail)
+    spec = Spectrum(xaxis=x.copy(), flux=x)
+    second = resample.Resampler(spec, target.copy(), kind="cubic")
+    assert second._matrix is first._matrix
+
+
+def test_resampler_sees_in_place_change_of_shared_xaxis():
+    x = np.linspace(2000, 2010, 100)
+    a = Spectrum(xaxis=x, flux=np.sin(x))
+    target = np.linspace(2001, 2009, 50)
+    resample.Resampler(a, target, kind="linear")
+    b = a.copy()
+    b.xaxis *= 1.0001
+    result = resample.Resampler(a, target, kind="linear")(a.flux)
+    expected = a.interpolated(target, kind="linear").flux
+    assert np.allclose(result, expected, equal_nan=True)
+
+
+def test_resampler_spectrum_and_validation():
+    x = np.linspace(2000, 2010, 100)
+    spec = Spectrum(xaxis=x, flux=np.ones(100), header={"OBJECT": "test"})
+    resampler = resample.Resampler(spec, np.linspace(2001, 2009, 10))
+    new_spec = resampler(spec)
+    assert isinstance(new_spec, Spectrum)
+    assert new_spec.header["OBJECT"] == "test"
+    assert np.allclose(new_spec.flux, 1)
+    with pytest.raises(ValueError):
+        resampler(np.ones(10))
+    with pytest.raises(ValueError):
+        resample.Resampler(x, x, kind="quintic")
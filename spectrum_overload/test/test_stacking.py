@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+"""Test combining of spectra."""
+import numpy as np
+import pytest
+
+from spectrum_overload import Spectrum, SpectrumError
+from spectrum_overload.stacking import combine
+
+
+@pytest.fixture
+def exposures():
+    x = np.linspace(2110, 2120, 500)
+    np.random.seed(42)
+    spectra = [
+        Spectrum(xaxis=x, flux=1 + 0.01 * np.random.randn(len(x)), header={"n": i})
+        for i in range(20)
+    ]
+    return spectra
+
+
+@pytest.mark.parametrize("chunk_size", [7, 100, 1000])
+@pytest.mark.parametrize("method", ["mean", "median"])
+def test_combine_same_grid(exposures, method, chunk_size):
+    combined, count = combine(exposures, method=method, chunk_size=chunk_size)
+    stack = np.vstack([spec.flux for spec in exposures])
+    expected = np.mean(stack, axis=0) if method == "mean" else np.median(stack, axis=0)
+    assert np.allclose(combined.flux, expected)
+    assert np.all(count == len(exposures))
+    assert combined.xaxis is exposures[0].xaxis
+    assert combined.header["n"] == 0
+    assert combined.header["combined"] == "20 spectra with {}".format(method)
+
+
+def test_combine_weighted(exposures):
+    weights = np.arange(1, len(exposures) + 1)
+    combined, __ = combine(exposures, method="weighted", weights=weights)
+    stack = np.vstack([spec.flux for spec in exposures])
+    assert np.allclose(combined.flux, np.average(stack, axis=0, weights=weights))
+
+
+def test_combine_sigma_clip_rejects_outliers(exposures):
+    exposures[3].flux[100] = 50
+    exposures[7].flux[200] = -50
+    clipped, count = combine(exposures, method="mean", sigma_clip=3)
+    assert len(exposures) - 3 < count[100] < len(exposures)
+    assert len(exposures) - 3 < count[200] < len(exposures)
+    assert np.allclose(clipped.flux[[100, 200]], 1, atol=0.02)
+
+    unclipped, __ = combine(exposures, method="mean")
+    assert unclipped.flux[100] > 3
+
+
+def test_combine_counts_overlap(exposures):
+    shifted = exposures[0].copy()
+    shifted.xaxis = shifted.xaxis + 5
+    combined, count = combine([exposures[1], shifted], kind="linear")
+    overlap = combined.xaxis >= shifted.xaxis[0]
+    assert np.all(count[overlap] == 2)
+    assert np.all(count[~overlap] == 1)
+    assert np.allclose(combined.flux[~overlap], exposures[1].flux[~overlap])
+
+
+def test_combine_with_nans_and_reference_grid(exposures):
+    exposures[0].flux[10:20] = np.nan
+    grid = np.linspace(2112, 2118, 300)
+    combined, count = combine(exposures, reference=grid)
+    assert combined.xaxis is grid
+    assert np.all(np.isfinite(combined.flux))
+    assert count.max() == len(exposures)
+
+
+@pytest.mark.parametrize("kind", ["spline", "linear"])
+def test_combine_gap_on_other_grid_does_not_contribute(exposures, kind):
+    gapped = exposures[0].copy()
+    flux = gapped.flux.copy()
+    flux[200:250] = np.nan
+    gapped.flux = flux
+    gapped.xaxis = gapped.xaxis + 0.001
+    combined, count = combine(exposures[1:3] + [gapped], kind=kind, chunk_size=64)
+    gap = (combined.xaxis > gapped.xaxis[199]) & (combined.xaxis < gapped.xaxis[250])
+    assert np.all(count[gap] == 2)
+    assert np.all(count[~gap][1:] == 3)
+    assert np.all(np.isfinite(combined.flux))
+
+
+@pytest.mark.parametrize("kind", ["spline", "linear"])
+def test_combine_other_grid_independent_of_chunks(exposures, kind):
+    shifted = exposures[0].copy()
+    shifted.xaxis = shifted.xaxis + 0.003
+    flux = shifted.flux.copy()
+    flux[100:110] = np.nan
+    shifted.flux = flux
+    expected = shifted.interpolated(exposures[1], kind=kind).flux
+    combined, count = combine([exposures[1], shifted], kind=kind, chunk_size=7)
+    unchunked, __ = combine([exposures[1], shifted], kind=kind, chunk_size=1000)
+    assert np.array_equal(combined.flux, unchunked.flux, equal_nan=True)
+    both = count == 2
+    assert np.allclose(combined.flux[both], (exposures[1].flux + expected)[both] / 2)
+
+
+def test_combine_errors(exposures):
+    with pytest.raises(ValueError):
+        combine(exposures, method="sum")
+    with pytest.raises(ValueError):
+        combine(exposures, method="weighted")
+    with pytest.raises(ValueError):
+        combine([])
+    exposures[1].calibrated = False
+    with pytest.raises(SpectrumError):
+        combine(exposures)
+
+
+@pytest.mark.parametrize("shift", [0, 0.003])
+def test_combine_ignores_masked_pixels(exposures, shift):
+    masked = exposures[0].copy()
+    flux = masked.flux.copy()
+    flux[250] = 100
+    masked.flux = flux
+    masked.xaxis = masked.xaxis + shift
+    mask = np.zeros(len(flux), dtype=bool)
+    mask[250] = True
+    masked.mask = mask
+    combined, count = combine([exposures[1], masked], kind="linear")
+    step = np.diff(combined.xaxis)[0]
+    near = np.abs(combined.xaxis - masked.xaxis[250]) < step
+    assert np.all(count[near] == 1)
+    assert np.allclose(combined.flux[near], exposures[1].flux[near])
+    assert np.max(combined.flux) < 2
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+"""Test the telluric correction."""
+import numpy as np
+import pytest
+
+from spectrum_overload import Spectrum, SpectrumError
+from spectrum_overload import telluric
+
+
+@pytest.fixture(scope="module")
+def model():
+    return telluric.TelluricModel()
+
+
+@pytest.fixture
+def observation(model):
+    x = np.linspace(2120, 2160, 2000)
+    star = 1 - 0.3 * np.exp(-((x - 2140) ** 2) / 0.01)
+    # Shift the broadened model exactly rather than with the linear model.
+    broadened = model._broadened(50000)
+    shifted = np.interp(x / (1 + 0.4 / telluric.c_kms), model.model.xaxis, broadened)
+    transmission = shifted ** 1.3
+    return Spectrum(
+        xaxis=x,
+        flux=star * transmission,
+        calibrated=True,
+        header={"ESO TEL AIRM START": 2.0, "ESO TEL AIRM END": 2.2},
+    ), star
+
+
+def test_model_is_loaded(model):
+    assert np.isclose(model.airmass, 1.628051)
+    assert np.all(np.diff(model.model.xaxis) > 0)
+    assert np.all(model.model.flux <= 1)
+
+
+def test_on_grid_is_cached(model, monkeypatch):
+    x = np.linspace(2120, 2160, 500)
+    first = model.on_grid(50000, x)
+
+    def fail(*args):
+        raise AssertionError("Model should be cached.")
+
+    monkeypatch.setattr(model, "_broadened", fail)
+    second = model.on_grid(50000, Spectrum(xaxis=x.copy(), flux=x))
+    assert second[0] is first[0]
+    with pytest.raises(AssertionError):
+        model.on_grid(40000, x)
+    spec = Spectrum(xaxis=x.copy(), flux=x)
+    model.on_grid(50000, spec)
+    spec.copy().xaxis += 1  # Shared with spec
+    with pytest.raises(AssertionError):
+        model.on_grid(50000, spec)
+
+
+def test_fit_and_correct(model, observation):
+    spectrum, star = observation
+    mask = np.abs(spectrum.xaxis - 2140) > 0.5
+    power, rv = model.fit(spectrum, R=50000, mask=mask)
+    assert np.isclose(power, 1.3, rtol=1e-3)
+    assert np.isclose(rv, 0.4, atol=0.01)
+
+    corrected = model.correct(spectrum, R=50000, mask=mask)
+    assert np.allclose(corrected.flux, star, atol=5e-3)
+    assert np.isclose(corrected.header["telluric_power"], power)
+    assert "telluric_power" not in spectrum.header
+
+
+def test_fit_shift_with_fixed_power(model, observation):
+    spectrum, __ = observation
+    mask = np.abs(spectrum.xaxis - 2140) > 0.5
+    power, rv = model.fit(spectrum, R=50000, power=1.3, mask=mask)
+    assert power == 1.3
+    assert np.isclose(rv, 0.4, atol=0.01)
+
+
+def test_correct_power_from_airmass(model, observation):
+    spectrum, __ = observation
+    corrected = model.correct(spectrum, R=50000, rv=0.0)
+    assert np.isclose(corrected.header["telluric_power"], 2.1 / model.airmass)
+
+
+def test_airmass_missing():
+    with pytest.raises(SpectrumError):
+        telluric.airmass({})
+
+
+def test_uncalibrated(model, observation):
+    spectrum, __ = observation
+    spectrum.calibrated = False
+    with pytest.raises(SpectrumError):
+        model.fit(spectrum, R=50000)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+"""Test the two-dimensional cross-correlation."""
+import numpy as np
+import pytest
+
+from spectrum_overload import Spectrum, SpectrumError
+from spectrum_overload.todcor import _correlate, todcor
+
+c = 299792.458
+
+
+def lines(w, centres, depth):
+    flux = np.ones_like(w)
+    for centre in centres:
+        flux -= depth * np.exp(-((w - centre) ** 2) / 0.002)
+    return flux
+
+
+def primary(w):
+    return lines(w, [2112.3, 2113.1, 2114.6, 2116.2, 2117.9], 0.5)
+
+
+def secondary(w):
+    return lines(w, [2111.7, 2113.8, 2115.4, 2118.4], 0.4)
+
+
+@pytest.fixture
+def binary():
+    x = np.linspace(2110, 2120, 3000)
+    rvs = np.array([[-25.0, 40.0], [10.0, -18.0], [3.0, 3.0 + 30.0]])
+    spectra = [
+        Spectrum(
+            xaxis=x,
+            flux=primary(x / (1 + rv1 / c)) + 0.5 * secondary(x / (1 + rv2 / c)),
+            calibrated=True,
+        )
+        for rv1, rv2 in rvs
+    ]
+    tx = np.linspace(2105, 2125, 8000)
+    templates = (
+        Spectrum(xaxis=tx, flux=primary(tx), calibrated=True),
+        Spectrum(xaxis=tx, flux=secondary(tx), calibrated=True),
+    )
+    return spectra, templates, rvs
+
+
+def test_todcor_recovers_rvs(binary):
+    spectra, (t1, t2), rvs = binary
+    rv_axis, surfaces, peaks = todcor(spectra, t1, t2, 0.5, -60, 60)
+    assert surfaces.shape == (len(spectra), len(rv_axis), len(rv_axis))
+    assert rv_axis[0] <= -60 and rv_axis[-1] >= 60
+    assert np.allclose(peaks, rvs, atol=1.0)
+
+
+def test_todcor_single_epoch_matches_batch(binary):
+    spectra, (t1, t2), rvs = binary
+    __, surfaces, peaks = todcor(spectra, t1, t2, 0.5, -60, 60)
+    __, surface, peak = todcor(spectra[1:2], t1, t2, 0.5, -60, 60)
+    assert np.allclose(surface[0], surfaces[1])
+    assert np.allclose(peak[0], peaks[1])
+
+
+def test_correlate_matches_direct_sum():
+    f = np.random.random(50)
+    g = np.random.random(50)
+    lags = np.arange(-5, 6)
+    expected = [
+        np.sum(f[i] * g[i - lag] for i in range(max(lag, 0), 50 + min(lag, 0)))
+        for lag in lags
+    ]
+    assert np.allclose(_correlate(f, g, 100, lags), expected)
+
+
+def test_todcor_validation(binary):
+    spectra, (t1, t2), __ = binary
+    with pytest.raises(ValueError):
+        todcor(spectra, t1, t2, 0.5, 60, -60)
+    t2.calibrated = False
+    with pytest.raises(SpectrumError):
+        todcor(spectra, t1, t2, 0.5, -60, 60)
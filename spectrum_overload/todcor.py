@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+"""Two-dimensional cross-correlation (TODCOR) of double-lined binaries.
+
+TODCOR (Zucker & Mazeh 1994) correlates an observation with the sum of two
+templates shifted by (RV1, RV2) and a flux ratio. The 2D surface follows
+from three 1D correlations: of the observation with each template and of
+the two templates with each other,
+
+    R(s1, s2) = (C1(s1) + a C2(s2)) / sqrt(1 + 2 a C12(s2 - s1) + a**2)
+
+where the C are normalized correlations and ``a`` is the flux ratio scaled
+by the ratio of the template standard deviations. On a log-lambda grid the
+shifts are pixel lags, so every correlation is a single FFT product and
+the surfaces of all epochs are built together by broadcasting.
+"""
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+from numpy import ndarray
+
+from spectrum_overload.differential import DifferentialSeries
+from spectrum_overload.disentangle import log_wavelength_grid
+from spectrum_overload.kernels import c_kms
+from spectrum_overload.spectrum import Spectrum, SpectrumError
+
+
+def _correlate(f: ndarray, g: ndarray, size: int, lags: ndarray) -> ndarray:
+    """Correlation sum_i f[i] g[i - lag] at integer lags along the last axis."""
+    product = np.fft.rfft(f, n=size, axis=-1) * np.conj(np.fft.rfft(g, n=size))
+    return np.fft.irfft(product, n=size, axis=-1)[..., lags % size]
+
+
+def _normalized(flux: ndarray) -> ndarray:
+    """Subtract the mean and divide by the norm along the last axis."""
+    flux = flux - np.mean(flux, axis=-1, keepdims=True)
+    norm = np.sqrt(np.sum(flux ** 2, axis=-1, keepdims=True))
+    if np.any(norm == 0):
+        raise ValueError("Cannot correlate a flat spectrum.")
+    return flux / norm
+
+
+def _refine_peak(values: ndarray, index: ndarray, axis: int) -> ndarray:
+    """Sub-pixel peak positions from a parabola through the peak and neighbours."""
+    n = values.shape[axis]
+    inner = np.clip(index, 1, n - 2)
+    left = np.take_along_axis(values, np.expand_dims(inner - 1, axis), axis)
+    mid = np.take_along_axis(values, np.expand_dims(inner, axis), axis)
+    right = np.take_along_axis(values, np.expand_dims(inner + 1, axis), axis)
+    left, mid, right = (np.squeeze(a, axis) for a in (left, mid, right))
+    curvature = left - 2 * mid + right
+    with np.errstate(divide="ignore", invalid="ignore"):
+        offset = np.where(curvature < 0, 0.5 * (left - right) / curvature, 0.0)
+    # Peaks on the edge of the range are not refined.
+    offset[(index == 0) | (index == n - 1)] = 0.0
+    return index + offset
+
+
+def todcor(
+    spectra: Sequence[Spectrum],
+    template1: Spectrum,
+    template2: Spectrum,
+    flux_ratio: float,
+    rvmin: float,
+    rvmax: float,
+    oversample: float = 1.0,
+    grid: Optional[ndarray] = None,
+) -> Tuple[ndarray, ndarray, ndarray]:
+    """Two-dimensional cross-correlation of many epochs with two templates.
+
+    Parameters
+    ----------
+    spectra: list of Spectrum
+        Calibrated spectra of each epoch.
+    template1, template2: Spectrum
+        Templates of the primary and secondary. They should cover the
+        observations shifted over the RV range.
+    flux_ratio: float
+        Flux ratio of the secondary to the primary.
+    rvmin, rvmax: float
+        RV range of both components [km/s].
+    oversample: float
+        Number of log-lambda pixels per pixel of the longest epoch. Sets
+        the RV step of the surface.
+    grid: ndarray, None
+        Log-lambda wavelength grid to correlate on. Default is a grid over
+        the overlap of the epochs.
+
+    Returns
+    -------
+    rvs: ndarray
+        RV axis of both components [km/s].
+    surfaces: ndarray
+        Correlation surfaces, shape (epochs, len(rvs), len(rvs)), indexed by
+        [epoch, primary RV, secondary RV].
+    peaks: ndarray
+        (RV1, RV2) at the maximum of each surface with parabolic sub-step
+        refinement [km/s], shape (epochs, 2).
+
+    Raises
+    ------
+    SpectrumError:
+        The spectra are not calibrated or do not overlap.
+
+    """
+    if rvmax <= rvmin:
+        raise ValueError("rvmin needs to be smaller than rvmax.")
+    if not all(spec.calibrated for spec in list(spectra) + [template1, template2]):
+        raise SpectrumError("Cannot correlate uncalibrated spectra.")
+    if grid is None:
+        lower = max(np.min(spec.xaxis) for spec in spectra)
+        upper = min(np.max(spec.xaxis) for spec in spectra)
+        if lower >= upper:
+            raise SpectrumError("The spectra do not overlap so cannot be correlated.")
+        n = int(max(len(spec) for spec in spectra) * oversample)
+        grid = log_wavelength_grid(lower, upper, n)
+    grid = np.asarray(grid, dtype=float)
+    step = np.log(grid[1] / grid[0])
+
+    observed = DifferentialSeries(spectra, grid=grid).aligned
+    templates = np.vstack(
+        [
+            np.interp(grid, template.xaxis, template.flux)
+            for template in (template1, template2)
+        ]
+    )
+    if not np.all(np.isfinite(observed)):
+        raise SpectrumError("The spectra have non-finite flux on the grid.")
+
+    lags = np.arange(
+        int(np.floor(np.log1p(rvmin / c_kms) / step)),
+        int(np.ceil(np.log1p(rvmax / c_kms) / step)) + 1,
+    )
+    rvs = c_kms * np.expm1(lags * step)
+    size = 2 * len(grid)
+
+    sigmas = np.std(templates, axis=1)
+    alpha = flux_ratio * sigmas[1] / sigmas[0]
+    observed, templates = _normalized(observed), _normalized(templates)
+
+    c1 = _correlate(observed, templates[0], size, lags)  # (epochs, lags)
+    c2 = _correlate(observed, templates[1], size, lags)
+    # C12 at every lag difference s2 - s1.
+    c12 = _correlate(templates[0], templates[1], size, lags[None, :] - lags[:, None])
+    denominator = np.sqrt(1 + 2 * alpha * c12 + alpha ** 2)
+
+    surfaces = (c1[:, :, None] + alpha * c2[:, None, :]) / denominator
+
+    flat = np.argmax(surfaces.reshape(len(surfaces), -1), axis=1)
+    i1, i2 = np.unravel_index(flat, surfaces.shape[1:])
+    epochs = np.arange(len(surfaces))
+    p1 = _refine_peak(surfaces[epochs, :, i2], i1, axis=1)
+    p2 = _refine_peak(surfaces[epochs, i1, :], i2, axis=1)
+    peaks = c_kms * np.expm1((lags[0] + np.column_stack((p1, p2))) * step)
+    return rvs, surfaces, peaks